@@ -0,0 +1,212 @@
+import json
+import os
+import struct
+from typing import List, NamedTuple, Optional
+
+# Pure-Python MP3 inspection: reads the ID3v2 tag and the first audio frame
+# (plus its Xing/Info or VBRI header), never the audio payload.
+
+SEEK_TABLE_POINTS = 100
+# Text frames are read from at most this many tag bytes (cover art is skipped)
+ID3_READ_LIMIT = 256 * 1024
+FRAME_SEARCH_BYTES = 64 * 1024
+
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+_TEXT_FRAMES = {"TIT2": "title", "TT2": "title", "TPE1": "artist", "TP1": "artist", "TCON": "genre", "TCO": "genre"}
+
+
+class AudioInfo(NamedTuple):
+    duration: Optional[float] # Seconds
+    bitrate: Optional[int] # kbps; average for VBR files
+    sample_rate: Optional[int]
+    seek_table: Optional[List[int]] # Byte offset at i/len of the duration
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    genre: Optional[str] = None
+
+
+class _Frame(NamedTuple):
+    version: int # 1, 2 or 25 (MPEG 2.5)
+    layer: int
+    bitrate: int
+    sample_rate: int
+    samples: int
+    length: int
+    mono: bool
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _decode_text(payload: bytes) -> Optional[str]:
+    if not payload:
+        return None
+    encoding, body = payload[0], payload[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(encoding)
+    if codec is None:
+        return None
+    text = body.decode(codec, errors="replace").split("\x00")[0].strip()
+    if text.startswith("(") and ")" in text:
+        # ID3v1-style genre reference, e.g. "(17)Rock"
+        rest = text[text.index(")") + 1:].strip()
+        text = rest or text
+    return text or None
+
+
+def _parse_id3(f) -> tuple[int, dict]:
+    # Returns (audio start offset, text fields)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0, {}
+    major, flags = header[3], header[5]
+    tag_size = _syncsafe(header[6:10])
+    audio_start = 10 + tag_size + (10 if flags & 0x10 else 0)
+    data = f.read(min(tag_size, ID3_READ_LIMIT))
+    pos = 0
+    if flags & 0x40 and len(data) >= 4 and major >= 3:
+        ext_size = _syncsafe(data[:4]) if major == 4 else struct.unpack(">I", data[:4])[0] + 4
+        pos = ext_size
+    fields: dict = {}
+    id_len, header_len = (3, 6) if major == 2 else (4, 10)
+    while pos + header_len <= len(data):
+        frame_id = data[pos:pos + id_len].decode("latin-1", errors="replace")
+        if not frame_id.strip("\x00"):
+            break # Padding
+        raw = data[pos + id_len:pos + id_len + (3 if major == 2 else 4)]
+        if len(raw) < (3 if major == 2 else 4):
+            break
+        if major == 2:
+            size = int.from_bytes(raw, "big")
+        elif major == 4:
+            size = _syncsafe(raw)
+        else:
+            size = struct.unpack(">I", raw)[0]
+        body = data[pos + header_len:pos + header_len + size]
+        key = _TEXT_FRAMES.get(frame_id)
+        if key and key not in fields:
+            value = _decode_text(body)
+            if value:
+                fields[key] = value
+        pos += header_len + size
+    return audio_start, fields
+
+
+def _parse_frame_header(data: bytes) -> Optional[_Frame]:
+    if len(data) < 4 or data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+        return None
+    version = {0: 25, 2: 2, 3: 1}.get((data[1] >> 3) & 0x03)
+    layer = {1: 3, 2: 2, 3: 1}.get((data[1] >> 1) & 0x03)
+    bitrate_index = data[2] >> 4
+    rate_index = (data[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (data[2] >> 1) & 0x01
+    mono = (data[3] >> 6) == 3
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version == 1) else 576
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return _Frame(version, layer, bitrate, sample_rate, samples, length, mono)
+
+
+def _find_first_frame(data: bytes) -> Optional[tuple[int, _Frame]]:
+    pos = data.find(b"\xff")
+    while pos != -1 and pos + 4 <= len(data):
+        frame = _parse_frame_header(data[pos:pos + 4])
+        if frame is not None:
+            # Require the next frame to line up to rule out false syncs
+            following = data[pos + frame.length:pos + frame.length + 4]
+            if len(following) < 4 or _parse_frame_header(following) is not None:
+                return pos, frame
+        pos = data.find(b"\xff", pos + 1)
+    return None
+
+
+def _linear_seek_table(audio_start: int, audio_bytes: int) -> List[int]:
+    return [audio_start + audio_bytes * i // SEEK_TABLE_POINTS for i in range(SEEK_TABLE_POINTS)]
+
+
+def read_audio_info(path: str) -> AudioInfo:
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        audio_start, tags = _parse_id3(f)
+        f.seek(audio_start)
+        data = f.read(FRAME_SEARCH_BYTES)
+        audio_end = file_size
+        if file_size >= 128:
+            f.seek(file_size - 128)
+            if f.read(3) == b"TAG":
+                audio_end -= 128 # ID3v1 trailer
+    found = _find_first_frame(data)
+    if found is None:
+        return AudioInfo(None, None, None, None, **tags)
+    offset, frame = found
+    first_frame = audio_start + offset
+    audio_bytes = max(audio_end - first_frame, 0)
+
+    # VBR headers live inside the first frame
+    side_info = (32 if not frame.mono else 17) if frame.version == 1 else (17 if not frame.mono else 9)
+    xing_at = offset + 4 + side_info
+    tag = data[xing_at:xing_at + 4]
+    frames = vbr_bytes = None
+    toc = None
+    try:
+        if tag in (b"Xing", b"Info"):
+            flags = struct.unpack(">I", data[xing_at + 4:xing_at + 8])[0]
+            pos = xing_at + 8
+            if flags & 0x1:
+                frames = struct.unpack(">I", data[pos:pos + 4])[0]
+                pos += 4
+            if flags & 0x2:
+                vbr_bytes = struct.unpack(">I", data[pos:pos + 4])[0]
+                pos += 4
+            if flags & 0x4:
+                toc = data[pos:pos + 100]
+        elif data[offset + 36:offset + 40] == b"VBRI":
+            vbr_bytes, frames = struct.unpack(">II", data[offset + 46:offset + 54])
+    except struct.error:
+        # Truncated VBR header; fall back to the CBR estimate
+        frames = vbr_bytes = toc = None
+
+    if frames:
+        duration = frames * frame.samples / frame.sample_rate
+        stream_bytes = vbr_bytes or audio_bytes
+        bitrate = int(stream_bytes * 8 / duration / 1000) if duration else frame.bitrate
+    else:
+        stream_bytes = audio_bytes
+        bitrate = frame.bitrate
+        duration = audio_bytes * 8 / (bitrate * 1000)
+
+    if toc is not None and len(toc) == 100:
+        seek_table = [first_frame + stream_bytes * b // 256 for b in toc]
+    else:
+        seek_table = _linear_seek_table(first_frame, stream_bytes)
+    return AudioInfo(round(duration, 3), bitrate, frame.sample_rate, seek_table, **tags)
+
+
+def seek_offset(seek_table_json: Optional[str], duration: Optional[float], seconds: float) -> Optional[int]:
+    """Byte offset to start streaming from for a time position."""
+    if not seek_table_json or not duration:
+        return None
+    table = json.loads(seek_table_json)
+    if not table:
+        return None
+    position = min(max(seconds / duration, 0.0), 1.0) * len(table)
+    index = int(position)
+    if index >= len(table) - 1:
+        return table[-1]
+    fraction = position - index
+    return int(table[index] + (table[index + 1] - table[index]) * fraction)
@@ -1,9 +1,12 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import asyncio
 import os
 import hashlib
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,19 +16,78 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 1 week
 ACCESS_TOKEN_EXPIRE_MINUTES_LONG = 60 * 24 * 30 # 30 days
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with a different cost factor are flagged for rehash on next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a small dedicated thread pool hashes in parallel
+# without occupying the request threadpool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
 
-def verify_password(plain_password, hashed_password):
-    # Fix for bcrypt 72 character limit bug in passlib + newer bcrypt
-    if len(plain_password) > 72:
-        plain_password = hashlib.sha256(plain_password.encode()).hexdigest()
-    return pwd_context.verify(plain_password, hashed_password)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
-def get_password_hash(password):
+def _prepare(password):
     # Fix for bcrypt 72 character limit bug in passlib + newer bcrypt
     if len(password) > 72:
         password = hashlib.sha256(password.encode()).hexdigest()
-    return pwd_context.hash(password)
+    return password
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(_prepare(plain_password), hashed_password)
+
+def verify_and_update_password(plain_password, hashed_password):
+    # Returns (valid, new_hash); new_hash is set when the stored hash is stale
+    return pwd_context.verify_and_update(_prepare(plain_password), hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(_prepare(password))
+
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded executor.
+
+    At most `workers + max_queue` operations may be in flight; beyond that
+    callers get PasswordHasherBusy (served as 503) instead of queueing.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_QUEUE):
+        self.limit = workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.limit:
+                raise PasswordHasherBusy()
+            self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    async def hash(self, password):
+        return await self._run(get_password_hash, password)
+
+    async def verify_and_update(self, plain_password, hashed_password):
+        return await self._run(verify_and_update_password, plain_password, hashed_password)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+password_hasher = PasswordHasher()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
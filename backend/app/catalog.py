@@ -0,0 +1,141 @@
+import base64
+import json
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy import Float, String, func, literal_column, tuple_
+from sqlalchemy.orm import Session
+from . import models
+
+MAX_PAGE_SIZE = 500
+
+# What a NULL sorts as. A bare column would drop NULL rows from keyset
+# pages (NULL never compares greater than the cursor), so sorts go through
+# coalesce; SORT_KEYS must match the ix_songs_*_key index expressions.
+NULL_SORT_VALUES = {"title": "", "artist": "", "price": 0}
+# JSON types a cursor value may have for each sort
+CURSOR_VALUE_TYPES = {"id": (int,), "title": (str,), "artist": (str,), "price": (int, float)}
+
+SORT_KEYS = {
+    "id": models.Song.id,
+    "title": func.coalesce(models.Song.title, literal_column("''", String)),
+    "artist": func.coalesce(models.Song.artist, literal_column("''", String)),
+    "price": func.coalesce(models.Song.price, literal_column("0", Float)),
+}
+
+
+def search_vector():
+    # Must match the expression of the ix_songs_search GIN index, literals
+    # included: with bound parameters the planner can't match the index
+    return func.to_tsvector(
+        literal_column("'simple'"),
+        func.coalesce(models.Song.title, literal_column("''", String)) + literal_column("' '", String)
+        + func.coalesce(models.Song.artist, literal_column("''", String)),
+    )
+
+
+def encode_cursor(sort: str, order: str, value, song_id: int) -> str:
+    raw = json.dumps({"s": sort, "o": order, "v": value, "id": song_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[object, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value, song_id = data["v"], int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if data.get("s") != sort or data.get("o") != order:
+        raise ValueError("Cursor does not match the requested sort")
+    if value is None and sort in NULL_SORT_VALUES:
+        value = NULL_SORT_VALUES[sort]
+    # bool is an int subclass; anything else would reach the query as is
+    if isinstance(value, bool) or not isinstance(value, CURSOR_VALUE_TYPES[sort]):
+        raise ValueError("Invalid cursor")
+    return value, song_id
+
+
+def _text_search(query, db: Session, q: str):
+    terms = re.findall(r"\w+", q.lower())
+    if not terms:
+        return query
+    if db.get_bind().dialect.name == "postgresql":
+        # Prefix match on every term, served by the GIN index
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        return query.filter(search_vector().op("@@")(func.to_tsquery(literal_column("'simple'"), tsquery)))
+    # Portable fallback (SQLite in tests/local dev): every term must appear
+    # in the title or the artist
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.filter(
+            func.lower(models.Song.title).like(pattern) | func.lower(models.Song.artist).like(pattern)
+        )
+    return query
+
+
+def search_songs(
+    db: Session,
+    q: Optional[str] = None,
+    genre: Optional[str] = None,
+    artist: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: str = "id",
+    order: str = "asc",
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+) -> Tuple[List[models.Song], Optional[str]]:
+    """Filtered catalog page ordered by (sort column, id).
+
+    Returns the songs and a cursor for the next page (None on the last
+    page). Passing the cursor back continues after the last row seen, so
+    deep pages cost the same as the first one.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unsupported sort: {sort}")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unsupported order: {order}")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    column = SORT_KEYS[sort]
+
+    query = db.query(models.Song)
+    if genre:
+        query = query.filter(models.Song.genre == genre)
+    if artist:
+        query = query.filter(models.Song.artist == artist)
+    if min_price is not None:
+        query = query.filter(models.Song.price >= min_price)
+    if max_price is not None:
+        query = query.filter(models.Song.price <= max_price)
+    if q:
+        query = _text_search(query, db, q)
+
+    key = column if sort == "id" else tuple_(column, models.Song.id)
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort, order)
+        boundary = last_id if sort == "id" else tuple_(value, last_id)
+        query = query.filter(key > boundary if order == "asc" else key < boundary)
+        if sort != "id":
+            # Redundant, but SQLite only seeks an expression index on a
+            # plain comparison, not a row value
+            query = query.filter(column >= value if order == "asc" else column <= value)
+
+    if order == "asc":
+        query = query.order_by(column.asc(), models.Song.id.asc())
+    else:
+        query = query.order_by(column.desc(), models.Song.id.desc())
+    if skip and not cursor:
+        # Legacy OFFSET paging, kept for existing clients
+        query = query.offset(skip)
+    songs = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(songs) > limit:
+        songs = songs[:limit]
+        last = songs[-1]
+        value = getattr(last, sort)
+        if value is None:
+            value = NULL_SORT_VALUES[sort]
+        next_cursor = encode_cursor(sort, order, value, int(getattr(last, "id")))
+    return songs, next_cursor
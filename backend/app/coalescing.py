@@ -0,0 +1,45 @@
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+# A merge rule folds the payloads of a device's still-pending commands of one
+# type (oldest first) together with the new payload into a single payload.
+# The pending rows are replaced by one new row at the tail of the queue, so
+# the relative order against other command types is preserved.
+MergeRule = Callable[[List[Optional[str]], Optional[str]], Optional[str]]
+
+
+def sum_field(field: str) -> MergeRule:
+    def merge(pending: List[Optional[str]], payload: Optional[str]) -> Optional[str]:
+        total = 0
+        for item in pending + [payload]:
+            if item:
+                total += json.loads(item).get(field, 0)
+        return json.dumps({field: total})
+    return merge
+
+
+def keep_latest(pending: List[Optional[str]], payload: Optional[str]) -> Optional[str]:
+    return payload
+
+
+MERGE_RULES: Dict[str, MergeRule] = {
+    "VOLUME_DELTA": sum_field("delta"),
+    "LOAD_PLAYLIST": keep_latest,
+}
+
+# Comma separated command types to coalesce; "none" disables coalescing
+ENABLED_TYPES = {
+    t.strip() for t in os.getenv("COMMAND_COALESCE", ",".join(MERGE_RULES)).split(",") if t.strip()
+}
+
+
+def register_rule(command_type: str, rule: MergeRule):
+    MERGE_RULES[command_type] = rule
+    ENABLED_TYPES.add(command_type)
+
+
+def get_rule(command_type: str) -> Optional[MergeRule]:
+    if command_type not in ENABLED_TYPES:
+        return None
+    return MERGE_RULES.get(command_type)
@@ -0,0 +1,134 @@
+import json
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import Integer, insert, literal, select
+from sqlalchemy.orm import Session
+from . import catalog, models, schemas
+
+try:
+    import orjson
+
+    def _dumps(row: dict) -> bytes:
+        return orjson.dumps(row)
+except ImportError:
+    def _dumps(row: dict) -> bytes:
+        return json.dumps(row, separators=(",", ":")).encode()
+
+EXPORT_BATCH = 1000
+
+user_songs = models.user_songs
+
+
+def owned_song_ids(db: Session, user_id: int, song_ids: Optional[Iterable[int]] = None) -> Set[int]:
+    """The subset of song_ids the user owns (all owned ids if None).
+
+    One lookup on the user_songs primary key; the collection relationship is
+    never loaded.
+    """
+    query = select(user_songs.c.song_id).where(user_songs.c.user_id == user_id)
+    if song_ids is not None:
+        song_ids = list(song_ids)
+        if not song_ids:
+            return set()
+        query = query.where(user_songs.c.song_id.in_(song_ids))
+    return set(db.scalars(query))
+
+
+def _insert_ignoring_duplicates(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(user_songs)
+
+
+def purchase_songs(db: Session, user_id: int, song_ids: Iterable[int]) -> dict:
+    """Add songs to the user's collection; safe to repeat.
+
+    A single INSERT ... SELECT ... ON CONFLICT DO NOTHING, so the cost does
+    not depend on how many songs the user already owns. Ids that don't exist
+    are skipped. Returns the newly purchased, already owned and missing ids.
+    """
+    song_ids = list(dict.fromkeys(song_ids))
+    if not song_ids:
+        return {"purchased": [], "already_owned": [], "missing": []}
+    songs = select(literal(user_id, Integer), models.Song.id).where(models.Song.id.in_(song_ids))
+    statement = _insert_ignoring_duplicates(db)
+    if statement is not None:
+        statement = statement.from_select(["user_id", "song_id"], songs).on_conflict_do_nothing()
+    else:
+        # Portable fallback: skip what is already owned
+        statement = insert(user_songs).from_select(
+            ["user_id", "song_id"],
+            songs.where(models.Song.id.not_in(select(user_songs.c.song_id).where(user_songs.c.user_id == user_id))),
+        )
+    purchased = set(db.scalars(statement.returning(user_songs.c.song_id)))
+    db.commit()
+
+    already_owned: Set[int] = set()
+    missing: List[int] = []
+    if len(purchased) < len(song_ids):
+        rest = [song_id for song_id in song_ids if song_id not in purchased]
+        already_owned = owned_song_ids(db, user_id, rest)
+        missing = [song_id for song_id in rest if song_id not in already_owned]
+    return {
+        "purchased": [song_id for song_id in song_ids if song_id in purchased],
+        "already_owned": [song_id for song_id in song_ids if song_id in already_owned],
+        "missing": missing,
+    }
+
+
+def _owned_songs(db: Session, user_id: int):
+    return (
+        db.query(models.Song)
+        .join(user_songs, user_songs.c.song_id == models.Song.id)
+        .filter(user_songs.c.user_id == user_id)
+        .order_by(user_songs.c.song_id)
+    )
+
+
+def get_collection(db: Session, user_id: int) -> List[models.Song]:
+    return _owned_songs(db, user_id).all()
+
+
+def collection_page(
+    db: Session, user_id: int, cursor: Optional[str] = None, limit: int = 100
+) -> Tuple[List[models.Song], Optional[str]]:
+    """Owned songs by id, walked along the user_songs primary key.
+
+    Uses the same cursor format as the catalog (sort "id"), so every page
+    costs the same however deep it is.
+    """
+    limit = max(1, min(limit, catalog.MAX_PAGE_SIZE))
+    query = _owned_songs(db, user_id)
+    if cursor:
+        _, last_id = catalog.decode_cursor(cursor, "id", "asc")
+        query = query.filter(user_songs.c.song_id > last_id)
+    songs = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(songs) > limit:
+        songs = songs[:limit]
+        last_id = int(getattr(songs[-1], "id"))
+        next_cursor = catalog.encode_cursor("id", "asc", last_id, last_id)
+    return songs, next_cursor
+
+
+def export_ndjson(db: Session, user_id: int, batch_size: int = EXPORT_BATCH) -> Iterator[bytes]:
+    """The whole collection as NDJSON, one schemas.Song object per line.
+
+    Plain column rows are read through a server-side cursor and serialized
+    directly, skipping ORM objects and per-row validation, so memory stays
+    flat however large the collection is. One chunk per batch of rows.
+    """
+    columns = [getattr(models.Song, name) for name in schemas.Song.model_fields]
+    result = db.execute(
+        select(*columns)
+        .join(user_songs, user_songs.c.song_id == models.Song.id)
+        .where(user_songs.c.user_id == user_id)
+        .order_by(user_songs.c.song_id)
+        .execution_options(yield_per=batch_size)
+    )
+    for rows in result.partitions():
+        yield b"".join(_dumps(row._asdict()) + b"\n" for row in rows)
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import BigInteger, cast, func, insert, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import idset, models
+from .database import COOCCURRENCE_LOCK_KEY, SessionLocal, worker_lock
+
+logger = logging.getLogger(__name__)
+
+COOCCURRENCE_TOP_K = int(os.getenv("COOCCURRENCE_TOP_K", "20"))
+# Keep this below COMMAND_ACKED_RETENTION so no LOAD_PLAYLIST is compacted
+# away before it has been counted
+COOCCURRENCE_REFRESH_INTERVAL = float(os.getenv("COOCCURRENCE_REFRESH_INTERVAL", "600"))
+COOCCURRENCE_BATCH = int(os.getenv("COOCCURRENCE_BATCH", "500"))
+LAST_COMMAND_KEY = "last_command_id"
+# Song ids go through a non-linear mix before summing, so swapping songs
+# for others with the same count and id sum (e.g. 1, 4 -> 2, 3) still
+# changes the digest. Every product fits a signed 64-bit integer for int4 ids.
+DIGEST_MULTIPLIER = 2654435761
+DIGEST_MODULUS = 2147483647
+
+
+def _mix(song_id):
+    # Works on ints and on SQL column expressions alike
+    mixed = song_id * DIGEST_MULTIPLIER % DIGEST_MODULUS
+    return mixed * mixed % DIGEST_MODULUS
+
+
+def song_digest(song_ids) -> int:
+    """Order-independent digest of a playlist's members (see _changed_playlists)."""
+    return sum(_mix(song_id) for song_id in song_ids)
+
+
+def _count_new_taps(db: Session) -> Tuple[Counter, Optional[int]]:
+    # LOAD_PLAYLIST history since the last run. One tap fans out to every
+    # device of the account with a shared created_at, so count it once.
+    state = db.get(models.CooccurrenceState, LAST_COMMAND_KEY)
+    last_id = int(state.value) if state is not None else 0
+    taps = set()
+    max_id = None
+    rows = db.execute(
+        select(models.Command.id, models.Command.payload, models.Command.created_at)
+        .where(models.Command.command_type == "LOAD_PLAYLIST", models.Command.id > last_id)
+        .order_by(models.Command.id)
+        .execution_options(yield_per=1000)
+    )
+    for command_id, payload, created_at in rows:
+        max_id = command_id
+        try:
+            playlist_id = int(json.loads(payload)["playlist_id"])
+        except (TypeError, ValueError, KeyError):
+            continue
+        taps.add((playlist_id, created_at))
+    return Counter(playlist_id for playlist_id, _ in taps), max_id
+
+
+def _changed_playlists(db: Session, new_plays: Counter, full: bool):
+    song_id = models.playlist_songs.c.song_id
+    # Same arithmetic as song_digest(), computed by the database in BIGINT
+    mixed = _mix(cast(song_id, BigInteger))
+    current = {
+        int(playlist_id): (int(count), int(total), int(digest))
+        for playlist_id, count, total, digest in db.execute(
+            select(models.playlist_songs.c.playlist_id, func.count(), func.sum(song_id), func.sum(mixed))
+            .group_by(models.playlist_songs.c.playlist_id)
+        )
+    }
+    indexed = {
+        int(row.playlist_id): row
+        for row in db.execute(select(
+            models.CooccurrencePlaylist.playlist_id, models.CooccurrencePlaylist.song_count,
+            models.CooccurrencePlaylist.song_id_sum, models.CooccurrencePlaylist.song_digest,
+            models.CooccurrencePlaylist.plays,
+        ))
+    }
+    changed = set(new_plays) & (set(current) | set(indexed))
+    for playlist_id in set(current) | set(indexed):
+        row = indexed.get(playlist_id)
+        if full or row is None or current.get(playlist_id, (0, 0, 0)) != (row.song_count, row.song_id_sum, row.song_digest):
+            changed.add(playlist_id)
+    return sorted(changed), indexed
+
+
+def _reindex_playlists(db: Session, playlist_ids: List[int], indexed: dict, new_plays: Counter) -> Set[int]:
+    # Refresh the membership snapshots; returns every song whose neighbors
+    # may have moved (members before and after the change)
+    dirty: Set[int] = set()
+    members: Dict[int, Set[int]] = defaultdict(set)
+    for playlist_id, song_id in db.execute(
+        select(models.playlist_songs.c.playlist_id, models.playlist_songs.c.song_id)
+        .where(models.playlist_songs.c.playlist_id.in_(playlist_ids))
+    ):
+        members[playlist_id].add(song_id)
+    for snapshot in db.scalars(
+        select(models.CooccurrencePlaylist.song_ids).where(models.CooccurrencePlaylist.playlist_id.in_(playlist_ids))
+    ):
+        dirty |= idset.decode_id_set(snapshot or "")
+    rows = []
+    for playlist_id in playlist_ids:
+        row = indexed.get(playlist_id)
+        songs = members.get(playlist_id, set())
+        dirty |= songs
+        if songs:
+            rows.append({
+                "playlist_id": playlist_id,
+                "song_ids": idset.encode_id_set(songs),
+                "song_count": len(songs),
+                "song_id_sum": sum(songs),
+                "song_digest": song_digest(songs),
+                "plays": (int(row.plays or 0) if row is not None else 0) + new_plays.get(playlist_id, 0),
+            })
+    db.query(models.CooccurrencePlaylist).filter(
+        models.CooccurrencePlaylist.playlist_id.in_(playlist_ids)
+    ).delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(models.CooccurrencePlaylist), rows)
+    return dirty
+
+
+def _rebuild_neighbors(db: Session, song_ids: List[int], top_k: int):
+    # Weighted co-occurrence: each shared playlist counts 1 + its tap count
+    a = models.playlist_songs.alias("a")
+    b = models.playlist_songs.alias("b")
+    weights = models.CooccurrencePlaylist
+    scores: Dict[int, List[Tuple[float, int]]] = defaultdict(list)
+    for song_id, neighbor_id, score in db.execute(
+        select(a.c.song_id, b.c.song_id, func.sum(1 + func.coalesce(weights.plays, 0)))
+        .select_from(
+            a.join(b, a.c.playlist_id == b.c.playlist_id)
+            .outerjoin(weights, weights.playlist_id == a.c.playlist_id)
+        )
+        .where(a.c.song_id.in_(song_ids), b.c.song_id != a.c.song_id)
+        .group_by(a.c.song_id, b.c.song_id)
+    ):
+        scores[song_id].append((float(score), neighbor_id))
+    rows = [
+        {"song_id": song_id, "neighbor_id": neighbor_id, "score": score}
+        for song_id, candidates in scores.items()
+        for score, neighbor_id in heapq.nlargest(top_k, candidates)
+    ]
+    db.query(models.SongNeighbor).filter(models.SongNeighbor.song_id.in_(song_ids)).delete(synchronize_session=False)
+    if rows:
+        db.execute(insert(models.SongNeighbor), rows)
+
+
+def refresh_neighbors(
+    db: Session, top_k: int = COOCCURRENCE_TOP_K, batch_size: int = COOCCURRENCE_BATCH, full: bool = False
+) -> dict:
+    """Incrementally update the song_neighbors table.
+
+    Only playlists whose membership changed (or that were tapped) since the
+    last run are re-read, and only their songs' neighbor lists are rebuilt,
+    so a run costs what changed rather than the size of the catalog.
+    """
+    new_plays, last_command_id = _count_new_taps(db)
+    changed, indexed = _changed_playlists(db, new_plays, full)
+    dirty: Set[int] = set()
+    for start in range(0, len(changed), batch_size):
+        dirty |= _reindex_playlists(db, changed[start:start + batch_size], indexed, new_plays)
+    if last_command_id is not None:
+        db.merge(models.CooccurrenceState(name=LAST_COMMAND_KEY, value=last_command_id))
+    db.commit()
+
+    songs = sorted(dirty)
+    for start in range(0, len(songs), batch_size):
+        _rebuild_neighbors(db, songs[start:start + batch_size], top_k)
+        db.commit()
+    return {"playlists": len(changed), "songs": len(songs), "taps": sum(new_plays.values())}
+
+
+def _refresh_once():
+    with worker_lock(COOCCURRENCE_LOCK_KEY, "cooccurrence"):
+        db = SessionLocal()
+        try:
+            return refresh_neighbors(db)
+        finally:
+            db.close()
+
+
+async def refresh_loop(interval: float = COOCCURRENCE_REFRESH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await run_in_threadpool(_refresh_once)
+            if result["songs"]:
+                logger.info(f"Neighbor table refreshed: {result['playlists']} playlists, {result['songs']} songs")
+        except Exception:
+            logger.exception("Neighbor table refresh failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the song co-occurrence neighbor table.")
+    parser.add_argument("--full", action="store_true", help="re-read every playlist instead of only changed ones")
+    parser.add_argument("--top-k", type=int, default=COOCCURRENCE_TOP_K)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from .database import init_lock, prepare_schema
+    with init_lock():
+        prepare_schema()
+    with worker_lock(COOCCURRENCE_LOCK_KEY, "cooccurrence"):
+        db = SessionLocal()
+        try:
+            print(json.dumps(refresh_neighbors(db, top_k=args.top_k, full=args.full), indent=2))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
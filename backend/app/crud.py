@@ -1,12 +1,19 @@
-from sqlalchemy.orm import Session
-from typing import Optional, List, Any
-from . import models, schemas, auth
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.orm import Session, joinedload, lazyload, selectinload
+from typing import Optional, Dict, List, Any, Set
+from . import models, schemas, auth, coalescing, playlist_edits
+from .retention import COMMAND_PENDING_TTL
+from .notifications import command_hub
+
+def get_user(db: Session, user_id: int):
+    return db.get(models.User, user_id)
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = auth.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: Optional[str] = None):
+    if hashed_password is None:
+        hashed_password = auth.get_password_hash(user.password)
     db_user = models.User(
         email=user.email,
         hashed_password=hashed_password,
@@ -19,8 +26,10 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
-def get_songs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Song).offset(skip).limit(limit).all()
+def update_user_password_hash(db: Session, user: models.User, hashed_password: str):
+    user.hashed_password = hashed_password # type: ignore
+    db.commit()
+    return user
 
 def get_song(db: Session, song_id: int):
     return db.query(models.Song).filter(models.Song.id == song_id).first()
@@ -32,21 +41,13 @@ def create_song(db: Session, song: schemas.SongCreate):
     db.refresh(db_song)
     return db_song
 
-def add_song_to_collection(db: Session, user_id: int, song_id: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    song = db.query(models.Song).filter(models.Song.id == song_id).first()
-    if user and song:
-        if song not in user.collection:
-            user.collection.append(song)
-            db.commit()
-    return user
-
-def get_user_collection(db: Session, user_id: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    return user.collection if user else []
+def count_songs_with_file(db: Session, file_path: str) -> int:
+    return db.query(models.Song).filter(models.Song.file_path == file_path).count()
 
-def get_nfc_tags(db: Session, user_id: int):
-    return db.query(models.NFCTag).filter(models.NFCTag.user_id == user_id).all()
+def get_nfc_tags(db: Session, user_id: int, with_songs: bool = True):
+    playlist = selectinload(models.NFCTag.playlist)
+    songs = playlist.selectinload(models.Playlist.songs) if with_songs else playlist.lazyload(models.Playlist.songs)
+    return db.query(models.NFCTag).options(songs).filter(models.NFCTag.user_id == user_id).all()
 
 def create_nfc_tag(db: Session, tag: schemas.NFCTagCreate, user_id: int):
     db_tag = models.NFCTag(tag_id=tag.tag_id, name=tag.name, user_id=user_id)
@@ -73,18 +74,24 @@ def update_tag_playlist(db: Session, tag_id: str, playlist_id: int | None, user_
     db.refresh(db_tag)
     return db_tag
 
-def get_tag_playlist(db: Session, tag_id: str):
-    db_tag = db.query(models.NFCTag).filter(models.NFCTag.tag_id == tag_id).first()
-    if db_tag and db_tag.playlist:
-        return db_tag.playlist
-    return None
+def resolve_tag(db: Session, tag_id: str):
+    # Tag, playlist and songs in a single joined query
+    return (
+        db.query(models.NFCTag)
+        .options(joinedload(models.NFCTag.playlist).joinedload(models.Playlist.songs))
+        .filter(models.NFCTag.tag_id == tag_id)
+        .first()
+    )
 
 # Playlist operations
-def get_playlists(db: Session, user_id: int):
-    return db.query(models.Playlist).filter(models.Playlist.user_id == user_id).all()
+def _playlist_songs(with_songs: bool):
+    return selectinload(models.Playlist.songs) if with_songs else lazyload(models.Playlist.songs)
 
-def get_playlist(db: Session, playlist_id: int):
-    return db.query(models.Playlist).filter(models.Playlist.id == playlist_id).first()
+def get_playlists(db: Session, user_id: int, with_songs: bool = True):
+    return db.query(models.Playlist).options(_playlist_songs(with_songs)).filter(models.Playlist.user_id == user_id).all()
+
+def get_playlist(db: Session, playlist_id: int, with_songs: bool = True):
+    return db.query(models.Playlist).options(_playlist_songs(with_songs)).filter(models.Playlist.id == playlist_id).first()
 
 def create_playlist(db: Session, playlist: schemas.PlaylistCreate, user_id: int):
     db_playlist = models.Playlist(name=playlist.name, user_id=user_id)
@@ -103,15 +110,11 @@ def update_playlist(db: Session, playlist_id: int, playlist: schemas.PlaylistUpd
     return db_playlist
 
 def update_playlist_songs(db: Session, playlist_id: int, song_ids: list[int], user_id: int):
-    db_playlist = db.query(models.Playlist).filter(models.Playlist.id == playlist_id, models.Playlist.user_id == user_id).first()
-    if not db_playlist:
-        return None
-    
-    songs = db.query(models.Song).filter(models.Song.id.in_(song_ids)).all()
-    db_playlist.songs = songs
-    db.commit()
-    db_playlist_refreshed = db.query(models.Playlist).filter(models.Playlist.id == playlist_id).first()
-    return db_playlist_refreshed
+    # Diffed against the stored order, so only changed rows are written
+    return playlist_edits.edit_playlist_songs(db, playlist_id, user_id, lambda current: song_ids)
+
+def edit_playlist_songs(db: Session, playlist_id: int, ops: List[schemas.PlaylistSongOp], user_id: int):
+    return playlist_edits.edit_playlist_songs(db, playlist_id, user_id, lambda current: playlist_edits.apply_ops(current, ops))
 
 def delete_nfc_tag(db: Session, tag_id: str, user_id: int):
     db_tag = db.query(models.NFCTag).filter(models.NFCTag.tag_id == tag_id, models.NFCTag.user_id == user_id).first()
@@ -136,6 +139,10 @@ def get_device(db: Session, device_id: str):
 def get_user_devices(db: Session, user_id: int):
     return db.query(models.Device).filter(models.Device.account_id == user_id).all()
 
+def get_user_device_ids(db: Session, user_id: int) -> List[str]:
+    rows = db.query(models.Device.id).filter(models.Device.account_id == user_id).all()
+    return [str(row[0]) for row in rows]
+
 def create_device(db: Session, device_id: str, name: Optional[str] = None):
     db_device = models.Device(id=device_id, name=name)
     db.add(db_device)
@@ -143,14 +150,6 @@ def create_device(db: Session, device_id: str, name: Optional[str] = None):
     db.refresh(db_device)
     return db_device
 
-def update_device_heartbeat(db: Session, device_id: str):
-    import time
-    db_device = get_device(db, device_id)
-    if db_device:
-        db_device.last_seen = float(time.time()) # type: ignore
-        db.commit()
-    return db_device
-
 def delete_device(db: Session, device_id: str, user_id: int):
     db_device = db.query(models.Device).filter(models.Device.id == device_id, models.Device.account_id == user_id).first()
     if db_device:
@@ -160,32 +159,150 @@ def delete_device(db: Session, device_id: str, user_id: int):
     return False
 
 # Command Operations
-def create_command(db: Session, device_id: str, command_type: str, payload: Optional[str] = None):
+def _coalesce_pending(db: Session, device_ids: List[str], command_type: str, payload: Optional[str]):
+    # Fold still-pending commands of a mergeable type into the new payload and
+    # drop the old rows, so fast-firing hardware can't grow the queue unbounded.
+    # Only rows no kiosk has seen yet: a delivered row may already have been
+    # applied, and rewriting it would lose or double-apply the new command.
+    payloads = {device_id: payload for device_id in device_ids}
+    rule = coalescing.get_rule(command_type)
+    if rule is None:
+        return payloads
+    pending = db.query(models.Command.id, models.Command.device_id, models.Command.payload).filter(
+        models.Command.device_id.in_(device_ids),
+        models.Command.command_type == command_type,
+        models.Command.status == "pending",
+        models.Command.delivered_at.is_(None)
+    ).order_by(models.Command.id.asc()).with_for_update().all()
+    if not pending:
+        return payloads
+    previous: dict[str, list[Optional[str]]] = {}
+    for _, device_id, pending_payload in pending:
+        previous.setdefault(str(device_id), []).append(pending_payload)
+    for device_id, pending_payloads in previous.items():
+        payloads[device_id] = rule(pending_payloads, payload)
+    db.query(models.Command).filter(
+        models.Command.id.in_([row[0] for row in pending])
+    ).delete(synchronize_session=False)
+    return payloads
+
+def create_commands_bulk(
+    db: Session, device_ids: List[str], command_type: str, payload: Optional[str] = None, notify: bool = True
+) -> List[int]:
+    # Fan one event out to many devices: a single multi-row INSERT ... RETURNING
+    # and one commit, instead of a commit + refresh per device. notify=False
+    # leaves waking the kiosks to the caller (publishing can block).
     import time
-    db_command = models.Command(
-        device_id=device_id,
-        command_type=command_type,
-        payload=payload,
-        status="pending",
-        created_at=float(time.time())
+    if not device_ids:
+        return []
+    payloads = _coalesce_pending(db, device_ids, command_type, payload)
+    created_at = float(time.time())
+    rows = [
+        {
+            "device_id": device_id,
+            "command_type": command_type,
+            "payload": payloads[device_id],
+            "status": "pending",
+            "created_at": created_at,
+        }
+        for device_id in device_ids
+    ]
+    command_ids = list(db.scalars(insert(models.Command).returning(models.Command.id), rows))
+    db.commit()
+    if notify:
+        command_hub.notify_many(device_ids)
+    return command_ids
+
+def _deliverable(now: float):
+    # Pending commands plus leased ones whose lease ran out without an ack,
+    # skipping anything older than the pending TTL. The explicit "!= acked"
+    # matches the partial index predicate so the planner can use it.
+    return (models.Command.status != "acked") & (models.Command.created_at >= now - COMMAND_PENDING_TTL) & or_(
+        models.Command.status == "pending",
+        (models.Command.status == "leased") & (models.Command.leased_until < now),
     )
-    db.add(db_command)
+
+def _nothing_to_deliver(db: Session, deliverable) -> bool:
+    # Most polls find an empty queue; answer those with a read so they never
+    # take a write lock
+    if db.scalar(select(models.Command.id).where(deliverable).limit(1)) is None:
+        db.commit()
+        return True
+    return False
+
+def get_pending_commands(db: Session, device_id: str) -> List[schemas.Command]:
+    # Marks what it returns as delivered before reading it back, so a command
+    # coalesced concurrently is either in this result untouched or still
+    # undelivered for the next fetch, never both.
+    import time
+    now = float(time.time())
+    deliverable = (models.Command.device_id == device_id) & _deliverable(now)
+    if _nothing_to_deliver(db, deliverable):
+        return []
+    db.execute(
+        update(models.Command)
+        .where(deliverable, models.Command.delivered_at.is_(None))
+        .values(delivered_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    commands = [
+        schemas.Command.model_validate(c)
+        for c in db.scalars(
+            select(models.Command)
+            .where(deliverable, models.Command.delivered_at.is_not(None))
+            .order_by(models.Command.created_at.asc(), models.Command.id.asc())
+        )
+    ]
     db.commit()
-    db.refresh(db_command)
-    return db_command
+    return commands
 
-def get_pending_commands(db: Session, device_id: str):
-    return db.query(models.Command).filter(
-        models.Command.device_id == device_id,
-        models.Command.status == "pending"
-    ).order_by(models.Command.created_at.asc()).all()
+def claim_pending_commands(db: Session, device_id: str, lease: float = 0) -> List[schemas.Command]:
+    # Fetch and mark in one UPDATE ... RETURNING. lease == 0 acks on fetch;
+    # lease > 0 hides the commands until they are acked or the lease expires.
+    # SKIP LOCKED keeps concurrent fetches from handing out the same row.
+    import time
+    now = float(time.time())
+    deliverable = (models.Command.device_id == device_id) & _deliverable(now)
+    if _nothing_to_deliver(db, deliverable):
+        return []
+    claimable = select(models.Command.id).where(deliverable).with_for_update(skip_locked=True)
+    values: dict[str, Any] = {"status": "acked", "leased_until": None}
+    if lease > 0:
+        values = {"status": "leased", "leased_until": now + lease}
+    values["delivered_at"] = func.coalesce(models.Command.delivered_at, now)
+    stmt = (
+        update(models.Command)
+        .where(models.Command.id.in_(claimable))
+        .values(**values)
+        .returning(models.Command)
+        .execution_options(synchronize_session=False)
+    )
+    commands = [schemas.Command.model_validate(c) for c in db.scalars(stmt)]
+    db.commit()
+    commands.sort(key=lambda c: (c.created_at, c.id))
+    return commands
 
 def ack_command(db: Session, command_id: int):
-    db_command = db.query(models.Command).filter(models.Command.id == command_id).first()
-    if db_command:
-        db_command.status = "acked" # type: ignore
-        db.commit()
-    return db_command
+    count = db.query(models.Command).filter(models.Command.id == command_id).update(
+        {"status": "acked", "leased_until": None}, synchronize_session=False
+    )
+    db.commit()
+    return count
+
+def ack_commands(db: Session, device_id: str, command_ids: List[int], up_to_id: Optional[int] = None) -> int:
+    query = db.query(models.Command).filter(
+        models.Command.device_id == device_id,
+        models.Command.status != "acked"
+    )
+    if up_to_id is not None:
+        query = query.filter(models.Command.id <= up_to_id)
+    elif command_ids:
+        query = query.filter(models.Command.id.in_(command_ids))
+    else:
+        return 0
+    count = query.update({"status": "acked", "leased_until": None}, synchronize_session=False)
+    db.commit()
+    return count
 
 # Claim Code Operations
 def create_claim_code(db: Session, device_id: str):
@@ -224,20 +341,111 @@ def verify_claim_code(db: Session, code: str, user_id: int):
             return db_device
     return None
 
-def get_recommendations(db: Session, user_id: int, genre: str, exclude_ids: List[int], limit: int = 5):
+RECOMMENDATION_BATCH = 64
+RECOMMENDATION_BATCH_MAX = 4096
+RECOMMENDATION_PROBES = 4 # random probes per wanted song before falling back to a scan
+RECOMMENDATION_MAX_PROBES = 12 # per pass; larger requests take several songs per probe
+RECOMMENDATION_PROBE_RUN = 8 # songs read per wanted song, to step over excluded ones
+RECOMMENDATION_SCAN_BATCHES = 6 # reads the fallback scan may make per pass
+# Queries one get_recommendations call can make: min/max, then two passes of
+# probes (each with a possible wrap-around read) plus their fallback scans
+RECOMMENDATION_MAX_QUERIES = 1 + 2 * (2 * RECOMMENDATION_MAX_PROBES + RECOMMENDATION_SCAN_BATCHES)
+
+def _owned_songs_query(db: Session, user_id: int, condition):
+    owned = models.user_songs.c.song_id
+    return (
+        db.query(models.Song)
+        .join(models.user_songs, owned == models.Song.id)
+        .filter(models.user_songs.c.user_id == user_id, condition)
+    )
+
+def _sample_owned_songs(db: Session, user_id: int, condition, low: int, high: int, exclude: Set[int], limit: int):
+    # Independent random probes: each takes the first usable owned songs at or
+    # after a random id in [low, high], wrapping around, so the picks are
+    # spread over the whole collection. At most RECOMMENDATION_MAX_PROBES
+    # short index reads; past that many wanted songs each probe takes a few
+    # neighbours. Small or heavily excluded pools fall back to a bounded scan.
+    import random
+    owned = models.user_songs.c.song_id
+    take = -(-limit // RECOMMENDATION_MAX_PROBES)
+    picked: Dict[int, models.Song] = {}
+    for _ in range(min(limit * RECOMMENDATION_PROBES, RECOMMENDATION_MAX_PROBES)):
+        if len(picked) >= limit:
+            break
+        probe = random.randint(low, high)
+        query = _owned_songs_query(db, user_id, condition)
+        run = query.filter(owned >= probe).order_by(owned).limit(RECOMMENDATION_PROBE_RUN * take).all()
+        if not run:
+            run = query.order_by(owned).limit(RECOMMENDATION_PROBE_RUN * take).all()
+            if not run:
+                return [] # Nothing matches condition
+        usable = [song for song in run if song.id not in exclude and song.id not in picked]
+        for song in usable[:min(take, limit - len(picked))]:
+            picked[int(getattr(song, "id"))] = song
+    songs = list(picked.values())
+    if len(songs) < limit:
+        songs += _scan_owned_songs(
+            db, user_id, condition, random.randint(low, high), exclude | set(picked), limit - len(songs)
+        )
+    return songs
+
+def _scan_owned_songs(db: Session, user_id: int, condition, start_id: int, exclude: Set[int], limit: int):
+    # Owned songs matching condition in song id order, starting at start_id
+    # and wrapping around. Reads batches off the user_songs primary key until
+    # limit songs survive the exclude set, so the cost does not grow with the
+    # size of the collection. Batches double while the exclude set keeps
+    # filtering everything out, and stop after RECOMMENDATION_SCAN_BATCHES
+    # reads: an almost fully excluded collection gets fewer songs, not more
+    # queries.
+    owned = models.user_songs.c.song_id
+    picked: List[models.Song] = []
+    reads = 0
+    for bound in (owned >= start_id, owned < start_id):
+        after = None
+        batch_size = RECOMMENDATION_BATCH
+        while len(picked) < limit and reads < RECOMMENDATION_SCAN_BATCHES:
+            query = _owned_songs_query(db, user_id, condition).filter(bound)
+            if after is not None:
+                query = query.filter(owned > after)
+            batch = query.order_by(owned).limit(batch_size).all()
+            reads += 1
+            picked.extend(song for song in batch if song.id not in exclude)
+            if len(batch) < batch_size:
+                break
+            after = batch[-1].id
+            batch_size = min(batch_size * 2, RECOMMENDATION_BATCH_MAX)
+    return picked[:limit]
+
+def get_next_songs(db: Session, user_id: int, song_id: int, exclude_ids: Set[int], limit: int = 5, candidates: int = 20):
+    # Owned songs from the precomputed neighbor list of song_id, best first
+    neighbor = models.SongNeighbor
+    songs = (
+        db.query(models.Song)
+        .join(neighbor, neighbor.neighbor_id == models.Song.id)
+        .join(
+            models.user_songs,
+            (models.user_songs.c.song_id == models.Song.id) & (models.user_songs.c.user_id == user_id),
+        )
+        .filter(neighbor.song_id == song_id)
+        .order_by(neighbor.score.desc())
+        .limit(candidates)
+        .all()
+    )
+    return [song for song in songs if song.id not in exclude_ids][:limit]
+
+def get_recommendations(db: Session, user_id: int, genre: str, exclude_ids: Set[int], limit: int = 5):
     import random
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
+    owned = models.user_songs.c.song_id
+    low, high = db.query(func.min(owned), func.max(owned)).filter(models.user_songs.c.user_id == user_id).one()
+    if low is None:
         return []
-    
-    # Filter collection for genre match
-    pool = [s for s in user.collection if s.genre.lower() == genre.lower() and s.id not in exclude_ids]
-    
+    same_genre = func.lower(models.Song.genre) == genre.lower()
+    picked = _sample_owned_songs(db, user_id, same_genre, low, high, exclude_ids, limit)
+
     # If not enough genre matches, add other songs from collection
-    if len(pool) < limit:
-        others = [s for s in user.collection if s.genre.lower() != genre.lower() and s.id not in exclude_ids]
-        pool.extend(others)
-    
-    # Randomize and limit
-    random.shuffle(pool)
-    return pool[:limit]
+    if len(picked) < limit:
+        other = or_(func.lower(models.Song.genre) != genre.lower(), models.Song.genre.is_(None))
+        picked += _sample_owned_songs(db, user_id, other, low, high, exclude_ids, limit - len(picked))
+
+    random.shuffle(picked)
+    return picked
@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import BigInteger, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,14 +25,234 @@ def get_database_url():
 
 DATABASE_URL = get_database_url()
 
-engine = create_engine(DATABASE_URL)
+# Connection pool tuning. Size the pool together with the threadpool
+# (sync handlers) so neither runs out first.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # Seconds, -1 keeps connections forever
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0")) # Postgres only, 0 disables
+# "auto" uses the async engine when its driver (asyncpg/aiosqlite) is installed
+DB_ASYNC = os.getenv("DB_ASYNC", "auto").lower()
+
+def engine_options(url: str, asynchronous: bool = False) -> dict:
+    options: dict = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    backend = make_url(url).get_backend_name()
+    if backend == "sqlite":
+        # SQLite pools are per-file and not sized
+        return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if backend == "postgresql" and DB_STATEMENT_TIMEOUT_MS > 0:
+        if asynchronous:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def get_async_database_url(url: str):
+    explicit = os.getenv("ASYNC_DATABASE_URL")
+    if explicit:
+        return explicit
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(backend)
+    if driver is None:
+        return None
+    return parsed.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+def _create_async_engine():
+    url = get_async_database_url(DATABASE_URL)
+    if DB_ASYNC in ("0", "false", "no") or url is None:
+        return None
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        return create_async_engine(url, **engine_options(url, asynchronous=True))
+    except (ImportError, ValueError):
+        # Driver or greenlet missing
+        if DB_ASYNC == "auto":
+            return None
+        raise
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = _create_async_engine()
+AsyncSessionLocal = None
+if async_engine is not None:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    # No expiry on commit: attributes must not lazy-load outside run_sync
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+def upgrade_schema(bind=None) -> set:
+    """Bring tables created by older releases up to the current models.
+
+    create_all only creates missing tables. Columns added to existing tables
+    since (nullable or with a server default) are added here, missing
+    indexes are created, indexes named in a table's info["retired_indexes"]
+    are dropped, and on PostgreSQL Integer columns now declared BigInteger
+    are widened. Returns the (table, column) pairs that were added so
+    callers can backfill them.
+    """
+    bind = bind or engine
+    inspector = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+    added = set()
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column for column in inspector.get_columns(table.name)}
+            name = preparer.format_table(table)
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = f"ALTER TABLE {name} ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=bind.dialect)}"
+                    if column.server_default is not None:
+                        default = column.server_default.arg
+                        ddl += f" DEFAULT {getattr(default, 'text', default)}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                    conn.execute(text(ddl))
+                    added.add((table.name, column.name))
+                elif (
+                    bind.dialect.name == "postgresql" and isinstance(column.type, BigInteger)
+                    and not isinstance(existing[column.name]["type"], BigInteger)
+                ):
+                    conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN {preparer.format_column(column)} TYPE BIGINT"))
+            indexes = _index_names(conn, inspector, table.name)
+            for index_name in indexes & set(table.info.get("retired_indexes", ())):
+                conn.execute(text(f"DROP INDEX {preparer.quote(index_name)}"))
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(bind=conn)
+    return added
+
+def prepare_schema(bind=None) -> set:
+    """Create missing tables and upgrade existing ones, backfilling as needed.
+
+    What startup and the standalone jobs (library scanner, co-occurrence
+    refresh) run before touching the database; callers hold init_lock().
+    Returns the (table, column) pairs upgrade_schema added.
+    """
+    # Deferred: both import this module
+    from . import models, playlist_edits
+    bind = bind or engine
+    models.Base.metadata.create_all(bind=bind)
+    added = upgrade_schema(bind)
+    if ("playlist_songs", "position") in added:
+        playlist_edits.backfill_positions(bind)
+    return added
+
+def _index_names(conn, inspector, table_name: str) -> set:
+    if conn.dialect.name == "sqlite":
+        # The inspector skips expression indexes on SQLite
+        return set(conn.scalars(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"), {"table": table_name}
+        ))
+    return {index["name"] for index in inspector.get_indexes(table_name)}
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+class AsyncDB:
+    """Database access for async endpoints.
+
+    run(fn, *args) calls a sync crud-style function with a Session as its
+    first argument. With the async engine it runs on the event loop through
+    AsyncSession.run_sync and holds no threadpool worker; otherwise it
+    falls back to a regular session on the threadpool.
+    """
+
+    def __init__(self):
+        self._async = AsyncSessionLocal() if AsyncSessionLocal is not None else None
+        self._sync = SessionLocal() if self._async is None else None
+
+    async def run(self, fn, *args, **kwargs):
+        if self._async is not None:
+            return await self._async.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, self._sync, *args, **kwargs)
+
+    async def release(self):
+        # End the transaction and hand the connection back to the pool
+        if self._async is not None:
+            await self._async.rollback()
+        else:
+            await run_in_threadpool(self._sync.rollback)
+
+    async def close(self):
+        if self._async is not None:
+            await self._async.close()
+        else:
+            await run_in_threadpool(self._sync.close)
+
+async def get_async_db():
+    db = AsyncDB()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+def pool_stats() -> dict:
+    stats = {"sync": engine.pool.status()}
+    if async_engine is not None:
+        stats["async"] = async_engine.pool.status()
+    return stats
+
+# Arbitrary app-wide keys for pg_advisory_lock
+INIT_LOCK_KEY = 7_411_263_001
+COOCCURRENCE_LOCK_KEY = 7_411_263_002
+COMPACTION_LOCK_KEY = 7_411_263_003
+
+@contextmanager
+def worker_lock(key: int, name: str):
+    # Cross-worker mutex for background jobs. Postgres uses a session-level
+    # advisory lock; other databases (SQLite in local dev) fall back to an
+    # exclusive lock file, which covers workers on one host.
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+        return
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(os.path.join(tempfile.gettempdir(), f"taptone-{name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def init_lock():
+    # One-time startup work (table creation and seeding)
+    return worker_lock(INIT_LOCK_KEY, "init")
+
+@contextmanager
+def count_queries(bind=None):
+    """Collect the SQL statements run inside the block.
+
+    For catching N+1 regressions, e.g.
+    `with count_queries() as statements: ...; assert len(statements) <= 3`.
+    """
+    bind = bind or engine
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", record)
@@ -1,16 +1,20 @@
 from fastapi import Depends, HTTPException, status, Request
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from . import auth, crud, models, database
+from . import crud, schemas, database
 from .auth import SECRET_KEY, ALGORITHM
+from .session_cache import session_cache
 
-def get_current_user(request: Request, db: Session = Depends(database.get_db)):
+def get_current_user(request: Request, db: Session = Depends(database.get_db)) -> schemas.User:
     token = request.cookies.get("session")
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
         )
+    cached = session_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
@@ -20,12 +24,22 @@ def get_current_user(request: Request, db: Session = Depends(database.get_db)):
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     
-    user = crud.get_user_by_email(db, email=email_str)
+    # Newer tokens carry the user id, which turns the lookup into a PK fetch
+    user_id = payload.get("uid")
+    if user_id is not None:
+        user = crud.get_user(db, int(user_id))
+        if user is not None and str(user.email) != email_str:
+            user = None
+    else:
+        user = crud.get_user_by_email(db, email=email_str)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    snapshot = schemas.User.model_validate(user)
+    exp = payload.get("exp")
+    session_cache.put(token, snapshot, float(exp) if exp is not None else None)
+    return snapshot
 
-def get_admin_user(current_user: models.User = Depends(get_current_user)):
+def get_admin_user(current_user: schemas.User = Depends(get_current_user)):
     if str(current_user.role) != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
     return current_user
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import models, schemas
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv("HEARTBEAT_FLUSH_INTERVAL", "10"))
+# Flush early once this many devices are waiting, to bound memory
+HEARTBEAT_BUFFER_MAX = int(os.getenv("HEARTBEAT_BUFFER_MAX", "50000"))
+
+
+class HeartbeatBuffer:
+    """Write-behind store for Device.last_seen.
+
+    Heartbeats only touch memory; flush() writes the latest timestamp per
+    device in one bulk UPDATE. Device reads go through apply() so the
+    buffered (newer) value wins over what is in the database.
+    """
+
+    def __init__(self, max_size: int = HEARTBEAT_BUFFER_MAX):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pending: dict[str, float] = {}
+
+    def record(self, device_id: str, timestamp: Optional[float] = None) -> bool:
+        # Returns True when the buffer is full and should be flushed now
+        with self._lock:
+            self._pending[device_id] = float(time.time()) if timestamp is None else timestamp
+            return len(self._pending) >= self.max_size
+
+    def last_seen(self, device_id: str) -> Optional[float]:
+        with self._lock:
+            return self._pending.get(device_id)
+
+    def apply(self, device: models.Device) -> schemas.Device:
+        result = schemas.Device.model_validate(device)
+        buffered = self.last_seen(result.id)
+        if buffered is not None and (result.last_seen is None or buffered > result.last_seen):
+            result.last_seen = buffered
+        return result
+
+    def flush(self, db: Session) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        known = {
+            str(row[0]) for row in db.query(models.Device.id).filter(models.Device.id.in_(list(pending)))
+        }
+        rows = [{"id": device_id, "last_seen": ts} for device_id, ts in pending.items() if device_id in known]
+        try:
+            if rows:
+                db.execute(update(models.Device), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Put the timestamps back unless a newer heartbeat arrived meanwhile
+            with self._lock:
+                for device_id, ts in pending.items():
+                    if self._pending.get(device_id, 0.0) < ts:
+                        self._pending[device_id] = ts
+            raise
+        return len(rows)
+
+
+def _flush_once():
+    db = SessionLocal()
+    try:
+        return heartbeat_buffer.flush(db)
+    finally:
+        db.close()
+
+
+async def flush_loop(interval: float = HEARTBEAT_FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(_flush_once)
+        except Exception:
+            logger.exception("Heartbeat flush failed")
+
+
+async def flush_now():
+    try:
+        await run_in_threadpool(_flush_once)
+    except Exception:
+        logger.exception("Heartbeat flush failed")
+
+
+heartbeat_buffer = HeartbeatBuffer()
@@ -0,0 +1,66 @@
+import base64
+from typing import Iterable, Set
+
+# Compact wire format for large id sets (e.g. recommendation excludes):
+# sorted ids as unsigned LEB128 varint deltas, base64url without padding.
+# 10k ids from a typical library fit in 15-25 KB instead of ~60 KB of CSV.
+
+MAX_IDS = 100_000
+
+
+def encode_id_set(ids: Iterable[int]) -> str:
+    out = bytearray()
+    previous = 0
+    for value in sorted(set(ids)):
+        if value < 0:
+            raise ValueError("Ids must be non-negative")
+        delta = value - previous
+        previous = value
+        while True:
+            byte = delta & 0x7F
+            delta >>= 7
+            if delta:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                break
+    return base64.urlsafe_b64encode(bytes(out)).decode().rstrip("=")
+
+
+def decode_id_set(value: str) -> Set[int]:
+    try:
+        data = base64.b64decode(value + "=" * (-len(value) % 4), altchars=b"-_", validate=True)
+    except ValueError:
+        raise ValueError("Invalid id set encoding")
+    ids: Set[int] = set()
+    current = delta = shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            if shift > 63:
+                raise ValueError("Invalid id set encoding")
+            continue
+        current += delta
+        ids.add(current)
+        delta = shift = 0
+        if len(ids) > MAX_IDS:
+            raise ValueError(f"Id set larger than {MAX_IDS}")
+    if shift:
+        raise ValueError("Invalid id set encoding")
+    return ids
+
+
+def parse_id_list(value: str) -> Set[int]:
+    """Comma separated ids and inclusive ranges, e.g. "3,7,10-25"."""
+    ids: Set[int] = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        low, sep, high = part.partition("-")
+        start, end = int(low), int(high) if sep else int(low)
+        if end - start + len(ids) > MAX_IDS:
+            raise ValueError(f"Id set larger than {MAX_IDS}")
+        ids.update(range(start, end + 1))
+    return ids
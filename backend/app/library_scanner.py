@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from . import models
+from .audio_metadata import AudioInfo, read_audio_info
+from .response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+SCAN_WORKERS = int(os.getenv("LIBRARY_SCAN_WORKERS", str(min(8, (os.cpu_count() or 1) * 2))))
+SCAN_BATCH_SIZE = int(os.getenv("LIBRARY_SCAN_BATCH_SIZE", "500"))
+AUDIO_EXTENSIONS = (".mp3",)
+
+
+class ScannedFile(NamedTuple):
+    path: str # Relative to the storage root
+    size: int
+    mtime: float
+
+
+class ParsedFile(NamedTuple):
+    file: ScannedFile
+    info: Optional[AudioInfo]
+
+
+def get_image_url(artist, title):
+    seed_str = f"{artist}-{title}".lower()
+    seed_hash = hashlib.md5(seed_str.encode()).hexdigest()[:6]
+    return f"https://picsum.photos/seed/{seed_hash}/400/400"
+
+
+def parse_song_name(filename: str, info: Optional[AudioInfo]):
+    # Format: <artist> - <title> - <genre>.mp3, falling back to the ID3 tag
+    parts = os.path.splitext(os.path.basename(filename))[0].split(" - ")
+    if len(parts) >= 3:
+        return parts[0], parts[1], parts[2]
+    if info is not None and info.artist and info.title:
+        return info.artist, info.title, info.genre or "Unknown"
+    return None
+
+
+def walk_storage(storage_dir: str) -> List[ScannedFile]:
+    # scandir hands back stat results with the directory listing, so this is
+    # one syscall per directory plus one lstat per file at most
+    found: List[ScannedFile] = []
+    stack = [storage_dir]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue # .tmp upload staging and hidden files
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    st = entry.stat()
+                    rel = os.path.relpath(entry.path, storage_dir)
+                    found.append(ScannedFile(rel, st.st_size, st.st_mtime))
+    return found
+
+
+def bootstrap_library(initial_dir: str, storage_dir: str, workers: int = SCAN_WORKERS):
+    # First boot of a fresh volume: copy the library bundled in the image
+    if not os.path.isdir(initial_dir) or (os.path.isdir(storage_dir) and os.listdir(storage_dir)):
+        return 0
+    os.makedirs(storage_dir, exist_ok=True)
+    items = [item for item in os.listdir(initial_dir) if os.path.isfile(os.path.join(initial_dir, item))]
+    logger.info(f"Bootstrap: Copying {len(items)} files from image to volume...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda item: shutil.copy2(os.path.join(initial_dir, item), os.path.join(storage_dir, item)), items))
+    return len(items)
+
+
+class ScanProgress:
+    def __init__(self):
+        self.state = "idle"
+        self.total_files = 0
+        self.changed_files = 0
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.removed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _parse(storage_dir: str, file: ScannedFile) -> ParsedFile:
+    try:
+        return ParsedFile(file, read_audio_info(os.path.join(storage_dir, file.path)))
+    except OSError:
+        logger.warning(f"Could not read audio file: {file.path}")
+        return ParsedFile(file, None)
+
+
+def _metadata(info: Optional[AudioInfo]) -> dict:
+    if info is None:
+        return {}
+    return {
+        "duration": info.duration,
+        "bitrate": info.bitrate,
+        "sample_rate": info.sample_rate,
+        "seek_table": json.dumps(info.seek_table) if info.seek_table else None,
+    }
+
+
+def _apply_batch(db: Session, batch: List[ParsedFile], progress: ScanProgress):
+    paths = [parsed.file.path for parsed in batch]
+    existing = {
+        str(path): int(song_id)
+        for song_id, path in db.query(models.Song.id, models.Song.file_path).filter(models.Song.file_path.in_(paths))
+    }
+    inserts, updates = [], []
+    for parsed in batch:
+        path = parsed.file.path
+        song_id = existing.get(path)
+        if song_id is not None:
+            # Existing song: refresh what the file says, keep curated fields
+            updates.append({"id": song_id, **_metadata(parsed.info)})
+            continue
+        names = parse_song_name(path, parsed.info)
+        if names is None:
+            logger.warning(f"Skipping file with invalid format: {path}")
+            progress.skipped += 1
+            continue
+        artist, title, genre = names
+        inserts.append({
+            "title": title,
+            "artist": artist,
+            "genre": genre,
+            "price": 0.99,
+            "file_path": path,
+            "image_url": get_image_url(artist, title),
+            **_metadata(parsed.info),
+        })
+
+    updates = [row for row in updates if len(row) > 1]
+    if updates:
+        db.execute(update(models.Song), updates)
+    if inserts:
+        for song_id, path in db.execute(insert(models.Song).returning(models.Song.id, models.Song.file_path), inserts):
+            existing[str(path)] = int(song_id)
+
+    # Upsert the manifest rows for this batch
+    db.query(models.LibraryFile).filter(models.LibraryFile.path.in_(paths)).delete(synchronize_session=False)
+    db.execute(insert(models.LibraryFile), [
+        {"path": p.file.path, "size": p.file.size, "mtime": p.file.mtime, "song_id": existing.get(p.file.path)}
+        for p in batch
+    ])
+    db.commit()
+    if inserts or updates:
+        # Bulk statements skip the ORM hooks that normally invalidate
+        response_cache.invalidate("catalog")
+    progress.inserted += len(inserts)
+    progress.updated += len(updates)
+    progress.processed += len(batch)
+
+
+def scan_library(
+    db: Session,
+    storage_dir: str,
+    workers: int = SCAN_WORKERS,
+    batch_size: int = SCAN_BATCH_SIZE,
+    progress: Optional[ScanProgress] = None,
+    on_progress: Optional[Callable[[ScanProgress], None]] = None,
+) -> ScanProgress:
+    """Incrementally sync storage_dir into the songs table.
+
+    Only files whose (size, mtime) differ from the manifest are parsed, in a
+    thread pool; songs and manifest rows are written batch_size at a time.
+    """
+    progress = progress or ScanProgress()
+    progress.state = "running"
+    progress.started_at = time.time()
+    if not os.path.isdir(storage_dir):
+        logger.error(f"Music storage directory NOT FOUND: {storage_dir}")
+        progress.state = "failed"
+        progress.error = "storage directory not found"
+        return progress
+
+    files = walk_storage(storage_dir)
+    manifest = {
+        str(path): (size, mtime)
+        for path, size, mtime in db.query(models.LibraryFile.path, models.LibraryFile.size, models.LibraryFile.mtime)
+    }
+    changed = [f for f in files if manifest.get(f.path) != (f.size, f.mtime)]
+    progress.total_files = len(files)
+    progress.changed_files = len(changed)
+    logger.info(f"Library scan: {len(files)} files, {len(changed)} new or changed")
+
+    gone = list(set(manifest) - {f.path for f in files})
+    for start in range(0, len(gone), batch_size):
+        db.query(models.LibraryFile).filter(
+            models.LibraryFile.path.in_(gone[start:start + batch_size])
+        ).delete(synchronize_session=False)
+        db.commit()
+    progress.removed = len(gone)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(changed), batch_size):
+            chunk = changed[start:start + batch_size]
+            parsed = list(pool.map(lambda f: _parse(storage_dir, f), chunk))
+            _apply_batch(db, parsed, progress)
+            if on_progress is not None:
+                on_progress(progress)
+
+    progress.state = "done"
+    progress.finished_at = time.time()
+    logger.info(
+        f"Library scan complete: {progress.inserted} added, {progress.updated} updated, "
+        f"{progress.skipped} skipped, {progress.removed} removed"
+    )
+    return progress
+
+
+class ScanJob:
+    """Single background scan at a time, with progress for the admin API."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.progress = ScanProgress()
+
+    def start(self, session_factory, storage_dir: str) -> bool:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self.progress = ScanProgress()
+            self._thread = threading.Thread(
+                target=self._run, args=(session_factory, storage_dir), name="library-scan", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _run(self, session_factory, storage_dir: str):
+        db = session_factory()
+        try:
+            scan_library(db, storage_dir, progress=self.progress)
+        except Exception as e:
+            logger.exception("Library scan failed")
+            self.progress.state = "failed"
+            self.progress.error = str(e)
+        finally:
+            db.close()
+
+
+scan_job = ScanJob()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync the music library into the database.")
+    parser.add_argument("--storage", default=os.path.join(os.getcwd(), "music_storage"))
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=SCAN_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from .database import SessionLocal, init_lock, prepare_schema
+    with init_lock():
+        prepare_schema()
+    db = SessionLocal()
+    try:
+        def report(progress: ScanProgress):
+            print(f"{progress.processed}/{progress.changed_files} changed files processed", flush=True)
+        result = scan_library(db, args.storage, workers=args.workers, batch_size=args.batch_size, on_progress=report)
+        print(json.dumps(result.as_dict(), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
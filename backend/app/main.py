@@ -1,52 +1,109 @@
 import os
-import time
 import json
+import asyncio
+from contextlib import asynccontextmanager
 from datetime import timedelta
 from fastapi import FastAPI, Depends, HTTPException, status, Response, Request, UploadFile, File, Form
-import shutil
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
-from typing import List, Any, Optional
-import aiofiles
+from typing import List, Any, Literal, Optional
 import logging
 
 from sqlalchemy import text
-from . import models, schemas, crud, auth, database, dependencies, seed
-from .database import engine, get_db, SessionLocal
+from . import models, schemas, crud, auth, database, dependencies, retention, heartbeats, streaming, uploads, audio_metadata, catalog, idset, cooccurrence, replica, collection
+from .database import engine, get_db, get_async_db, AsyncDB, SessionLocal
+from .notifications import command_hub
+from .heartbeats import heartbeat_buffer
+from .session_cache import session_cache
+from .streaming import song_locations
+from .response_cache import response_cache, CachedBody, encode_json
+from .tag_cache import tag_cache
+from .replica import ReadYourWritesMiddleware, get_read_db
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create tables and auto-seed with retry logic for DB readiness
-def init_db():
-    retries = 5
-    while retries > 0:
+# Startup progress for the readiness probe
+startup_state = {"initialized": False}
+INIT_DB_RETRY_DELAY = float(os.getenv("INIT_DB_RETRY_DELAY", "5"))
+
+def _initialize_database():
+    # Deferred: seeding pulls in bcrypt hashing and the library scanner
+    from . import seed
+    # Only one worker creates tables and seeds at a time; the others wait and
+    # then find nothing left to do
+    with database.init_lock():
+        # Databases from older releases get new columns and indexes too
+        database.prepare_schema(engine)
+        db = SessionLocal()
+        try:
+            seed.auto_seed_data(db)
+        finally:
+            db.close()
+
+# Create tables and auto-seed with retry logic for DB readiness. Runs in the
+# background so the worker serves /healthz while the database comes up.
+async def init_db():
+    attempt = 1
+    while True:
         try:
             logger.info("Attempting to connect to database and initialize...")
-            models.Base.metadata.create_all(bind=engine)
-            
-            db = SessionLocal()
-            try:
-                seed.auto_seed_data(db)
-            finally:
-                db.close()
-            
+            await run_in_threadpool(_initialize_database)
+            startup_state["initialized"] = True
             logger.info("Database initialization and seeding successful.")
-            break
-        except OperationalError as e:
-            retries -= 1
-            logger.error(f"Database connection failed. Retrying in 5 seconds... ({retries} retries left)")
-            time.sleep(5)
-    
-    if retries == 0:
-        logger.critical("Could not connect to database after multiple retries. Exiting.")
-
-init_db()
-
-app = FastAPI(title="TapTone API")
+            return
+        except OperationalError:
+            logger.error(f"Database connection failed (attempt {attempt}). Retrying in {INIT_DB_RETRY_DELAY:g} seconds...")
+        except Exception:
+            # Anything else (a failed upgrade step, a seeding bug) would
+            # otherwise end this task silently and leave /readyz at 503 for good
+            logger.exception(f"Database initialization failed (attempt {attempt}). Retrying in {INIT_DB_RETRY_DELAY:g} seconds...")
+        attempt += 1
+        await asyncio.sleep(INIT_DB_RETRY_DELAY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialization = asyncio.create_task(init_db())
+    command_hub.backend.start()
+    response_cache.backend.start()
+    session_cache.backend.start()
+    song_locations.backend.start()
+    compaction = None
+    if retention.COMMAND_COMPACTION_INTERVAL > 0:
+        compaction = asyncio.create_task(retention.compaction_loop())
+    heartbeat_flush = asyncio.create_task(heartbeats.flush_loop())
+    neighbor_refresh = None
+    if cooccurrence.COOCCURRENCE_REFRESH_INTERVAL > 0:
+        neighbor_refresh = asyncio.create_task(cooccurrence.refresh_loop())
+    yield
+    initialization.cancel()
+    heartbeat_flush.cancel()
+    await heartbeats.flush_now()
+    if compaction is not None:
+        compaction.cancel()
+    if neighbor_refresh is not None:
+        neighbor_refresh.cancel()
+    command_hub.backend.stop()
+    response_cache.backend.stop()
+    session_cache.backend.stop()
+    song_locations.backend.stop()
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+    auth.password_hasher.shutdown()
+
+app = FastAPI(title="TapTone API", lifespan=lifespan)
+
+@app.exception_handler(auth.PasswordHasherBusy)
+async def password_hasher_busy(request: Request, exc: auth.PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many login attempts in progress, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,28 +111,51 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(ReadYourWritesMiddleware)
 
 MUSIC_STORAGE_PATH = os.path.join(os.getcwd(), "music_storage")
+# Upper bound for long-poll waits and the SSE keepalive interval (seconds)
+COMMAND_WAIT_MAX = float(os.getenv("COMMAND_WAIT_MAX", "30"))
+COMMAND_STREAM_KEEPALIVE = float(os.getenv("COMMAND_STREAM_KEEPALIVE", "15"))
 
 # Auth Endpoints
+def _user_credentials(db: Session, email: str):
+    # Read what signup/login need, then hand the connection back from the
+    # same worker thread. Held across bcrypt, a login burst takes the whole
+    # pool while the threadpool fills with requests waiting on it, and the
+    # held sessions can no longer get a thread to release it.
+    db_user = crud.get_user_by_email(db, email=email)
+    snapshot = schemas.User.model_validate(db_user) if db_user is not None else None
+    stored_hash = db_user.hashed_password if db_user is not None else None
+    db.rollback()
+    return db_user, snapshot, stored_hash
+
 @app.post("/auth/signup", response_model=schemas.User)
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    db_user, _, _ = await run_in_threadpool(_user_credentials, db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await auth.password_hasher.hash(user.password)
+    return await run_in_threadpool(crud.create_user, db=db, user=user, hashed_password=hashed_password)
 
 @app.post("/auth/login")
-def login(response: Response, user: schemas.UserCreate, remember_me: bool = False, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if not db_user or not auth.verify_password(user.password, db_user.hashed_password):
+async def login(response: Response, user: schemas.UserCreate, remember_me: bool = False, db: Session = Depends(get_db)):
+    db_user, user_snapshot, stored_hash = await run_in_threadpool(_user_credentials, db, user.email)
+    if not db_user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
+    valid, new_hash = await auth.password_hasher.verify_and_update(user.password, stored_hash)
+    if not valid:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if new_hash:
+        # Stored hash uses an outdated cost factor
+        await run_in_threadpool(crud.update_user_password_hash, db, db_user, new_hash)
     
     expires_minutes = auth.ACCESS_TOKEN_EXPIRE_MINUTES_LONG if remember_me else auth.ACCESS_TOKEN_EXPIRE_MINUTES
     access_token_expires = timedelta(minutes=expires_minutes)
     access_token = auth.create_access_token(
-        data={"sub": db_user.email}, expires_delta=access_token_expires
+        data={"sub": user_snapshot.email, "uid": user_snapshot.id}, expires_delta=access_token_expires
     )
     
     response.set_cookie(
@@ -86,35 +166,73 @@ def login(response: Response, user: schemas.UserCreate, remember_me: bool = Fals
         samesite="lax",
         secure=False 
     )
-    return {"message": "Logged in successfully", "user": schemas.User.model_validate(db_user)}
+    return {"message": "Logged in successfully", "user": user_snapshot}
 
 @app.post("/auth/logout")
-def logout(response: Response):
+def logout(request: Request, response: Response):
+    token = request.cookies.get("session")
+    if token:
+        session_cache.invalidate_token(token)
     response.delete_cookie("session")
     return {"message": "Logged out successfully"}
 
 @app.get("/auth/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(dependencies.get_current_user)):
+def read_users_me(current_user: schemas.User = Depends(dependencies.get_current_user)):
     return current_user
 
+# Probes: liveness only says the process is serving; readiness also needs
+# initialization to have finished and the database to answer
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz(response: Response):
+    if not startup_state["initialized"]:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "starting"}
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except OperationalError:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "database unavailable"}
+    return {"status": "ready"}
+
+# Operational counters for the in-process caches
+@app.get("/metrics")
+def read_metrics():
+    return {
+        "session_cache": session_cache.stats(),
+        "password_hash_queue": auth.password_hasher.queue_depth(),
+        "song_locations": song_locations.stats(),
+        "response_cache": response_cache.stats(),
+        "tag_cache": tag_cache.stats(),
+        "db_pool": {**database.pool_stats(), **replica.pool_stats()},
+    }
+
 # Device Management Endpoints
 @app.post("/api/v1/devices/register", response_model=schemas.Device)
 def register_device(device_id: str, name: Optional[str] = None, db: Session = Depends(get_db)):
     db_device = crud.get_device(db, device_id)
     if not db_device:
         db_device = crud.create_device(db, device_id, name if name else "")
-    return db_device
+    return heartbeat_buffer.apply(db_device)
 
 @app.get("/api/v1/devices/me", response_model=schemas.Device)
 def get_current_device(device_id: str, db: Session = Depends(get_db)):
     db_device = crud.get_device(db, device_id)
     if not db_device:
         raise HTTPException(status_code=404, detail="Device not found")
-    return db_device
+    return heartbeat_buffer.apply(db_device)
 
+# Kiosk and hardware hot paths below are async and use AsyncDB, so they don't
+# hold threadpool workers (see database.AsyncDB)
 @app.post("/api/v1/devices/heartbeat")
-def device_heartbeat(device_id: str, db: Session = Depends(get_db)):
-    crud.update_device_heartbeat(db, device_id)
+async def device_heartbeat(device_id: str, db: AsyncDB = Depends(get_async_db)):
+    # Buffered in memory and written in bulk by heartbeats.flush_loop
+    if heartbeat_buffer.record(device_id):
+        await db.run(heartbeat_buffer.flush)
     return {"status": "ok"}
 
 @app.post("/api/v1/devices/claim-request", response_model=schemas.ClaimCode)
@@ -122,95 +240,220 @@ def request_claim_code(device_id: str, db: Session = Depends(get_db)):
     return crud.create_claim_code(db, device_id)
 
 @app.post("/api/v1/devices/claim-verify")
-def verify_claim(code: str, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def verify_claim(code: str, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     db_device = crud.verify_claim_code(db, code, current_user.id) # type: ignore
     if not db_device:
         raise HTTPException(status_code=400, detail="Invalid or expired claim code")
-    return {"message": "Device claimed successfully", "device": schemas.Device.model_validate(db_device)}
+    return {"message": "Device claimed successfully", "device": heartbeat_buffer.apply(db_device)}
 
 @app.get("/api/v1/my-devices", response_model=List[schemas.Device])
-def get_my_devices(current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
-    return crud.get_user_devices(db, current_user.id) # type: ignore
+def get_my_devices(current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+    return [heartbeat_buffer.apply(device) for device in crud.get_user_devices(db, current_user.id)] # type: ignore
 
 @app.delete("/api/v1/devices/{device_id}")
-def remove_device(device_id: str, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def remove_device(device_id: str, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     success = crud.delete_device(db, device_id, current_user.id) # type: ignore
     if not success:
         raise HTTPException(status_code=404, detail="Device not found")
     return {"message": "Device removed"}
 
 # Event Ingestion (from Arduinos)
+async def queue_commands(db: AsyncDB, device_ids: List[str], command_type: str, payload: Optional[str] = None):
+    command_ids = await db.run(crud.create_commands_bulk, device_ids, command_type, payload, notify=False)
+    if command_ids:
+        # With COMMAND_HUB_BACKEND=postgres each publish is a blocking
+        # pg_notify, and db.run may be on the event loop, so wake kiosks here
+        await run_in_threadpool(command_hub.notify_many, device_ids)
+    return command_ids
+
 @app.post("/api/v1/events/nfc")
-def event_nfc(tag_uid: str, account_id: int, db: Session = Depends(get_db)):
-    tag = db.query(models.NFCTag).filter(models.NFCTag.tag_id == tag_uid, models.NFCTag.user_id == account_id).first()
-    if not tag or tag.playlist_id is None:
+async def event_nfc(tag_uid: str, account_id: int, db: AsyncDB = Depends(get_async_db)):
+    tag = await db.run(tag_cache.get, tag_uid)
+    if tag is None or tag.user_id != account_id or tag.playlist_id is None:
         return {"status": "ignored", "reason": "tag_not_linked"}
     
-    devices = crud.get_user_devices(db, account_id)
-    for device in devices:
-        payload = json.dumps({"playlist_id": tag.playlist_id})
-        crud.create_command(db, str(device.id), "LOAD_PLAYLIST", payload)
+    device_ids = await db.run(crud.get_user_device_ids, account_id)
+    payload = json.dumps({"playlist_id": tag.playlist_id})
+    command_ids = await queue_commands(db, device_ids, "LOAD_PLAYLIST", payload)
     
-    return {"status": "success", "commands_queued": len(devices)}
+    return {"status": "success", "commands_queued": len(command_ids)}
 
 @app.post("/api/v1/events/button")
-def event_button(control: str, account_id: int, db: Session = Depends(get_db)):
+async def event_button(control: str, account_id: int, db: AsyncDB = Depends(get_async_db)):
     cmd_map = {"prev": "PREV", "play_pause": "PLAY_PAUSE", "next": "NEXT"}
     cmd_type = cmd_map.get(control)
     if not cmd_type:
         raise HTTPException(status_code=400, detail="Invalid control type")
     
-    devices = crud.get_user_devices(db, account_id)
-    for device in devices:
-        crud.create_command(db, str(device.id), cmd_type)
+    device_ids = await db.run(crud.get_user_device_ids, account_id)
+    command_ids = await queue_commands(db, device_ids, cmd_type)
         
-    return {"status": "success", "commands_queued": len(devices)}
+    return {"status": "success", "commands_queued": len(command_ids)}
 
 @app.post("/api/v1/events/encoder")
-def event_encoder(delta: int, account_id: int, db: Session = Depends(get_db)):
-    devices = crud.get_user_devices(db, account_id)
-    for device in devices:
-        payload = json.dumps({"delta": delta})
-        crud.create_command(db, str(device.id), "VOLUME_DELTA", payload)
+async def event_encoder(delta: int, account_id: int, db: AsyncDB = Depends(get_async_db)):
+    device_ids = await db.run(crud.get_user_device_ids, account_id)
+    payload = json.dumps({"delta": delta})
+    command_ids = await queue_commands(db, device_ids, "VOLUME_DELTA", payload)
         
-    return {"status": "success", "commands_queued": len(devices)}
+    return {"status": "success", "commands_queued": len(command_ids)}
 
 # Kiosk Polling & Ack
 @app.get("/api/v1/devices/{device_id}/commands", response_model=List[schemas.Command])
-def get_commands(device_id: str, db: Session = Depends(get_db)):
-    return crud.get_pending_commands(db, device_id)
+async def get_commands(
+    device_id: str,
+    wait: float = 0,
+    ack: bool = False,
+    lease: float = 0,
+    db: AsyncDB = Depends(get_async_db)
+):
+    # wait > 0 turns this into a long-poll: park until a command is queued for
+    # the device or the timeout expires, instead of the kiosk re-polling.
+    # ack=true acks on fetch; lease=N hands commands out for N seconds and
+    # redelivers them unless acked. Both claim rows atomically.
+    wait = min(max(wait, 0.0), COMMAND_WAIT_MAX)
+
+    def fetch(session: Session):
+        if ack or lease > 0:
+            return crud.claim_pending_commands(session, device_id, lease=0 if ack else lease)
+        return crud.get_pending_commands(session, device_id)
+
+    with command_hub.listen(device_id) as waiter:
+        commands = await db.run(fetch)
+        if commands or wait == 0:
+            return commands
+        # Give the pooled connection back while parked
+        await db.release()
+        if not await waiter.wait(wait):
+            return []
+        return await db.run(fetch)
+
+@app.get("/api/v1/devices/{device_id}/commands/stream")
+async def stream_commands(device_id: str):
+    # Server-Sent Events: pending commands are pushed as they are queued. The
+    # DB is only queried on connect and when the hub signals this device.
+    async def event_stream():
+        db = AsyncDB()
+        last_id = 0
+        try:
+            with command_hub.listen(device_id) as waiter:
+                while True:
+                    commands = await db.run(crud.get_pending_commands, device_id)
+                    for cmd in commands:
+                        if int(getattr(cmd, "id")) <= last_id:
+                            continue
+                        last_id = int(getattr(cmd, "id"))
+                        data = schemas.Command.model_validate(cmd).model_dump_json()
+                        yield f"id: {last_id}\nevent: command\ndata: {data}\n\n"
+                    await db.release()
+                    if not await waiter.wait(COMMAND_STREAM_KEEPALIVE):
+                        yield ": keepalive\n\n"
+        finally:
+            await db.close()
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/v1/devices/commands/{command_id}/ack")
-def ack_command(command_id: int, db: Session = Depends(get_db)):
-    crud.ack_command(db, command_id)
+async def ack_command(command_id: int, db: AsyncDB = Depends(get_async_db)):
+    await db.run(crud.ack_command, command_id)
     return {"status": "ok"}
 
+@app.post("/api/v1/devices/{device_id}/commands/ack")
+async def ack_commands(device_id: str, ack: schemas.CommandAck, db: AsyncDB = Depends(get_async_db)):
+    if ack.up_to_id is not None and ack.command_ids:
+        # The watermark would silently win over the explicit ids
+        raise HTTPException(status_code=400, detail="Send either command_ids or up_to_id, not both")
+    acked = await db.run(crud.ack_commands, device_id, ack.command_ids, up_to_id=ack.up_to_id)
+    return {"status": "ok", "acked": acked}
+
+RECOMMENDATION_LIMIT_MAX = 50
+
 @app.get("/api/v1/recommendations", response_model=List[schemas.Song])
 def get_recommendations(
     device_id: str, 
     genre: str, 
-    exclude_ids: str, # Comma separated
-    db: Session = Depends(get_db)
+    exclude_ids: str = "", # Comma separated ids and ranges, e.g. "3,7,10-25"
+    exclude: Optional[str] = None, # Compact encoding, see idset.encode_id_set
+    limit: int = 5,
+    mode: Literal["genre", "next"] = "genre",
+    song_id: Optional[int] = None, # Last played song, for mode=next
+    db: Session = Depends(get_read_db)
 ):
     device = crud.get_device(db, device_id)
     if not device or device.account_id is None:
         raise HTTPException(status_code=404, detail="Device or account not found")
     
-    exclude_list = [int(i) for i in exclude_ids.split(",") if i]
+    try:
+        excluded = idset.parse_id_list(exclude_ids)
+        if exclude:
+            excluded |= idset.decode_id_set(exclude)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     # Use getattr to avoid type check errors with SQLAlchemy columns
     user_id = int(getattr(device, 'account_id'))
-    return crud.get_recommendations(db, user_id, genre, exclude_list)
+    limit = max(1, min(limit, RECOMMENDATION_LIMIT_MAX))
+    picked = []
+    if mode == "next":
+        if song_id is None:
+            raise HTTPException(status_code=400, detail="song_id is required for mode=next")
+        # Co-occurrence neighbors first, topped up by genre matching
+        picked = crud.get_next_songs(
+            db, user_id, song_id, excluded, limit=limit, candidates=max(cooccurrence.COOCCURRENCE_TOP_K, limit)
+        )
+        excluded = excluded | {int(getattr(song, "id")) for song in picked}
+    if len(picked) < limit:
+        picked += crud.get_recommendations(db, user_id, genre, excluded, limit=limit - len(picked))
+    return picked
 
 # Music Store Endpoints
 @app.get("/songs", response_model=List[schemas.Song])
-def read_songs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_songs(db, skip=skip, limit=limit)
+def read_songs(
+    request: Request,
+    skip: int = 0,
+    limit: int = 100,
+    q: Optional[str] = None,
+    genre: Optional[str] = None,
+    artist: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: str = "id",
+    order: str = "asc",
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    # The next page's cursor goes in a header so the body stays a plain list
+    def build():
+        try:
+            songs, next_cursor = catalog.search_songs(
+                db, q=q, genre=genre, artist=artist, min_price=min_price, max_price=max_price,
+                sort=sort, order=order, cursor=cursor, skip=skip, limit=limit,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return CachedBody(encode_json(songs, List[schemas.Song]), headers)
+    key = "songs?" + "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return response_cache.respond(request, key, ["catalog"], build)
+
+PURCHASE_BATCH_MAX = 1000
 
 @app.post("/songs/{song_id}/purchase")
-def purchase_song(song_id: int, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
-    crud.add_song_to_collection(db, user_id=current_user.id, song_id=song_id) # type: ignore
+def purchase_song(song_id: int, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+    result = collection.purchase_songs(db, user_id=current_user.id, song_ids=[song_id]) # type: ignore
+    if result["missing"]:
+        raise HTTPException(status_code=404, detail="Song not found")
     return {"message": "Song added to collection"}
 
+@app.post("/songs/purchase")
+def purchase_songs(song_ids: List[int], current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+    # Cart checkout; songs already owned are reported, not charged twice
+    if len(song_ids) > PURCHASE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PURCHASE_BATCH_MAX} songs per purchase")
+    return collection.purchase_songs(db, user_id=current_user.id, song_ids=song_ids) # type: ignore
+
 @app.put("/songs/{song_id}")
 def update_song(song_id: int, song_update: schemas.SongBase, db: Session = Depends(get_db)):
     db_song = crud.get_song(db, song_id=song_id)
@@ -220,6 +463,7 @@ def update_song(song_id: int, song_update: schemas.SongBase, db: Session = Depen
         setattr(db_song, key, value)
     db.commit()
     db.refresh(db_song)
+    song_locations.invalidate(song_id)
     return db_song
 
 @app.delete("/songs/{song_id}")
@@ -228,10 +472,13 @@ def delete_song(song_id: int, db: Session = Depends(get_db)):
     if not song:
         raise HTTPException(status_code=404, detail="Song not found")
     file_path = os.path.join(MUSIC_STORAGE_PATH, str(song.file_path))
-    if os.path.exists(file_path):
+    # Uploads are content-addressed, so identical files are shared between songs
+    shared = crud.count_songs_with_file(db, str(song.file_path)) > 1
+    if os.path.exists(file_path) and not shared:
         os.remove(file_path)
     db.delete(song)
     db.commit()
+    song_locations.invalidate(song_id)
     return {"message": "Song deleted"}
 
 @app.post("/songs/upload")
@@ -246,9 +493,8 @@ async def upload_song(
 ):
     if file.filename is None:
         raise HTTPException(status_code=400, detail="File name missing")
-    file_location = os.path.join(MUSIC_STORAGE_PATH, file.filename)
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
+    stored = await uploads.store_upload(file.file, MUSIC_STORAGE_PATH, file.filename)
+    info = await run_in_threadpool(audio_metadata.read_audio_info, os.path.join(MUSIC_STORAGE_PATH, stored.file_path))
     
     if not image_url:
         import hashlib
@@ -256,25 +502,90 @@ async def upload_song(
         seed_hash = hashlib.md5(seed_str.encode()).hexdigest()[:6]
         image_url = f"https://picsum.photos/seed/{seed_hash}/400/400"
 
-    db_song = models.Song(
+    song = schemas.SongCreate(
         title=title, artist=artist, genre=genre, price=price,
-        image_url=image_url, file_path=file.filename
+        image_url=image_url, file_path=stored.file_path,
+        duration=info.duration, bitrate=info.bitrate, sample_rate=info.sample_rate,
+        seek_table=json.dumps(info.seek_table) if info.seek_table else None
     )
-    db.add(db_song)
-    db.commit()
-    db.refresh(db_song)
+    db_song = await run_in_threadpool(crud.create_song, db, song)
+    song_locations.invalidate(int(getattr(db_song, "id")))
     return db_song
 
+# Library maintenance
+@app.post("/admin/library/scan")
+def start_library_scan(admin: schemas.User = Depends(dependencies.get_admin_user)):
+    from . import library_scanner
+    started = library_scanner.scan_job.start(SessionLocal, MUSIC_STORAGE_PATH)
+    return {"started": started, "progress": library_scanner.scan_job.progress.as_dict()}
+
+@app.get("/admin/library/scan")
+def library_scan_status(admin: schemas.User = Depends(dependencies.get_admin_user)):
+    from . import library_scanner
+    return library_scanner.scan_job.progress.as_dict()
+
 @app.get("/my-collection", response_model=List[schemas.Song])
-def read_my_collection(current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
-    return crud.get_user_collection(db, user_id=current_user.id) # type: ignore
+def read_my_collection(
+    limit: Optional[int] = None, # Page size; without it (and cursor) the whole collection is returned
+    cursor: Optional[str] = None,
+    current_user: schemas.User = Depends(dependencies.get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    # Serialized here rather than through response_model, which would
+    # validate every song a second time
+    if limit is None and cursor is None:
+        return Response(content=encode_json(collection.get_collection(db, current_user.id), List[schemas.Song]), media_type="application/json") # type: ignore
+    try:
+        songs, next_cursor = collection.collection_page(db, current_user.id, cursor=cursor, limit=limit or 100) # type: ignore
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return Response(content=encode_json(songs, List[schemas.Song]), media_type="application/json", headers=headers)
+
+@app.get("/my-collection/export")
+def export_my_collection(request: Request, current_user: schemas.User = Depends(dependencies.get_current_user)):
+    # NDJSON, one song per line. The session is owned by the stream so it
+    # stays open until the last row has been sent.
+    db = replica.read_session(request)
+    user_id = current_user.id
+
+    def lines():
+        try:
+            yield from collection.export_ndjson(db, user_id) # type: ignore
+        finally:
+            db.close()
+    return StreamingResponse(
+        lines(), media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="collection.ndjson"'},
+    )
 
+@app.get("/my-collection/ids", response_model=List[int])
+def read_my_collection_ids(
+    song_ids: Optional[str] = None, # Only check these, e.g. "3,7,10-25"
+    current_user: schemas.User = Depends(dependencies.get_current_user),
+    db: Session = Depends(get_read_db),
+):
+    # Ownership lookup without serializing the songs themselves
+    try:
+        wanted = idset.parse_id_list(song_ids) if song_ids is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return sorted(collection.owned_song_ids(db, current_user.id, wanted)) # type: ignore
+
+# view=summary on tag and playlist reads leaves out the nested songs
 @app.get("/tags", response_model=List[schemas.NFCTag])
-def read_my_tags(current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
-    return crud.get_nfc_tags(db, user_id=current_user.id) # type: ignore
+def read_my_tags(request: Request, view: Literal["full", "summary"] = "full", current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_read_db)):
+    def build():
+        tags = crud.get_nfc_tags(db, user_id=current_user.id, with_songs=view == "full") # type: ignore
+        model = List[schemas.NFCTag] if view == "full" else List[schemas.NFCTagSummary]
+        return CachedBody(encode_json(tags, model))
+    return response_cache.respond(
+        request, f"tags:user:{current_user.id}:{view}", ["catalog", f"user:{current_user.id}"], build,
+        cache_control="private, no-cache",
+    )
 
 @app.post("/tags", response_model=schemas.NFCTag)
-def register_tag(tag: schemas.NFCTagCreate, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def register_tag(tag: schemas.NFCTagCreate, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     tags_count = db.query(models.NFCTag).filter(models.NFCTag.tag_id == tag.tag_id).count()
     if tags_count > 0:
         existing_tag = db.query(models.NFCTag).filter(models.NFCTag.tag_id == tag.tag_id).first()
@@ -286,14 +597,14 @@ def register_tag(tag: schemas.NFCTagCreate, current_user: models.User = Depends(
     return crud.create_nfc_tag(db, tag=tag, user_id=current_user.id) # type: ignore
 
 @app.patch("/tags/{tag_id}")
-def update_tag_info(tag_id: str, name: str, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def update_tag_info(tag_id: str, name: str, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     updated_tag = crud.update_nfc_tag(db, tag_id=tag_id, name=name, user_id=current_user.id) # type: ignore
     if not updated_tag:
         raise HTTPException(status_code=404, detail="Tag not found")
     return updated_tag
 
 @app.put("/tags/{tag_id}/playlist")
-def update_tag_playlist_link(tag_id: str, payload: dict, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def update_tag_playlist_link(tag_id: str, payload: dict, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     playlist_id = payload.get("playlist_id")
     updated_tag = crud.update_tag_playlist(db, tag_id=tag_id, playlist_id=playlist_id, user_id=current_user.id) # type: ignore
     if not updated_tag:
@@ -301,92 +612,106 @@ def update_tag_playlist_link(tag_id: str, payload: dict, current_user: models.Us
     return {"message": "Playlist linked to tag"}
 
 @app.delete("/tags/{tag_id}")
-def delete_tag(tag_id: str, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def delete_tag(tag_id: str, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     success = crud.delete_nfc_tag(db, tag_id=tag_id, user_id=current_user.id) # type: ignore
     if not success:
         raise HTTPException(status_code=404, detail="Tag not found or not owned by user")
     return {"message": "Tag deleted successfully"}
 
 @app.get("/playlists", response_model=List[schemas.Playlist])
-def read_my_playlists(current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
-    return crud.get_playlists(db, user_id=current_user.id) # type: ignore
+def read_my_playlists(request: Request, view: Literal["full", "summary"] = "full", current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_read_db)):
+    def build():
+        playlists = crud.get_playlists(db, user_id=current_user.id, with_songs=view == "full") # type: ignore
+        model = List[schemas.Playlist] if view == "full" else List[schemas.PlaylistSummary]
+        return CachedBody(encode_json(playlists, model))
+    return response_cache.respond(
+        request, f"playlists:user:{current_user.id}:{view}", ["catalog", f"user:{current_user.id}"], build,
+        cache_control="private, no-cache",
+    )
 
 @app.get("/playlists/{playlist_id}", response_model=schemas.Playlist)
-def read_playlist(playlist_id: int, db: Session = Depends(get_db)):
-    playlist = crud.get_playlist(db, playlist_id=playlist_id)
-    if not playlist:
-        raise HTTPException(status_code=404, detail="Playlist not found")
-    return playlist
+def read_playlist(playlist_id: int, request: Request, view: Literal["full", "summary"] = "full", db: Session = Depends(get_read_db)):
+    def build():
+        playlist = crud.get_playlist(db, playlist_id=playlist_id, with_songs=view == "full")
+        if not playlist:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        return CachedBody(encode_json(playlist, schemas.Playlist if view == "full" else schemas.PlaylistSummary))
+    return response_cache.respond(request, f"playlist:{playlist_id}:{view}", ["catalog", f"playlist:{playlist_id}"], build)
 
 @app.post("/playlists", response_model=schemas.Playlist)
-def create_playlist(playlist: schemas.PlaylistCreate, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def create_playlist(playlist: schemas.PlaylistCreate, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     return crud.create_playlist(db, playlist=playlist, user_id=current_user.id) # type: ignore
 
 @app.put("/playlists/{playlist_id}", response_model=schemas.Playlist)
-def update_playlist_name(playlist_id: int, playlist: schemas.PlaylistUpdate, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def update_playlist_name(playlist_id: int, playlist: schemas.PlaylistUpdate, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     updated = crud.update_playlist(db, playlist_id=playlist_id, playlist=playlist, user_id=current_user.id) # type: ignore
     if not updated:
         raise HTTPException(status_code=404, detail="Playlist not found")
     return updated
 
 @app.put("/playlists/{playlist_id}/songs")
-def update_songs_in_playlist(playlist_id: int, song_ids: List[int], current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
-    updated = crud.update_playlist_songs(db, playlist_id=playlist_id, song_ids=song_ids, user_id=current_user.id) # type: ignore
+def update_songs_in_playlist(playlist_id: int, song_ids: List[int], current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+    try:
+        updated = crud.update_playlist_songs(db, playlist_id=playlist_id, song_ids=song_ids, user_id=current_user.id) # type: ignore
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not updated:
         raise HTTPException(status_code=404, detail="Playlist not found")
-    return {"message": "Playlist songs updated"}
+    return {"message": "Playlist songs updated", **updated}
+
+@app.patch("/playlists/{playlist_id}/songs")
+def edit_songs_in_playlist(playlist_id: int, ops: List[schemas.PlaylistSongOp], current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+    # Applied in order, in one transaction
+    try:
+        updated = crud.edit_playlist_songs(db, playlist_id=playlist_id, ops=ops, user_id=current_user.id) # type: ignore
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not updated:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return {"message": "Playlist songs updated", **updated}
 
 @app.delete("/playlists/{playlist_id}")
-def delete_user_playlist(playlist_id: int, current_user: models.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
+def delete_user_playlist(playlist_id: int, current_user: schemas.User = Depends(dependencies.get_current_user), db: Session = Depends(get_db)):
     success = crud.delete_playlist(db, playlist_id=playlist_id, user_id=current_user.id) # type: ignore
     if not success:
         raise HTTPException(status_code=404, detail="Playlist not found")
     return {"message": "Playlist deleted"}
 
 @app.get("/hardware/sync/{tag_id}")
-def sync_hardware(tag_id: str, db: Session = Depends(get_db)):
-    playlist = crud.get_tag_playlist(db, tag_id=tag_id)
-    if playlist is None:
-        raise HTTPException(status_code=404, detail="Tag not registered or no playlist linked")
-    return {
-        "playlist_name": playlist.name,
-        "songs": [
-            {
-                "id": song.id, "title": song.title, "artist": song.artist,
-                "genre": song.genre, "url": f"/stream/{song.id}"
-            }
-            for song in playlist.songs
-        ]
-    }
+def sync_hardware(tag_id: str, request: Request, db: Session = Depends(get_read_db)):
+    def build():
+        tag = tag_cache.get(db, tag_id)
+        if tag is None or tag.playlist_id is None:
+            raise HTTPException(status_code=404, detail="Tag not registered or no playlist linked")
+        return CachedBody(encode_json({"playlist_name": tag.playlist_name, "songs": list(tag.songs)}))
+    return response_cache.respond(request, f"sync:{tag_id}", ["catalog", f"tag:{tag_id}"], build)
+
+def _find_song_and_release(db: Session, song_id: int):
+    # The response can stream for minutes: give the pooled connection back
+    # now, not when the dependency exits. Same thread as the query, so a
+    # burst of listeners can't hold connections while waiting for a worker.
+    try:
+        return crud.get_song(db, song_id=song_id)
+    finally:
+        db.close()
 
 @app.get("/stream/{song_id}")
-async def stream_song(song_id: int, request: Request, db: Session = Depends(get_db)):
-    song = crud.get_song(db, song_id=song_id)
-    if not song:
-        raise HTTPException(status_code=404, detail="Song not found")
-    path = os.path.join(MUSIC_STORAGE_PATH, str(song.file_path))
-    if not os.path.exists(path):
+async def stream_song(song_id: int, request: Request, t: Optional[float] = None, db: Session = Depends(get_db)):
+    # t seeks to a time in seconds using the song's seek table
+    try:
+        stat = song_locations.get(song_id)
+        song = None
+        if stat is None or t is not None:
+            song = await run_in_threadpool(_find_song_and_release, db, song_id)
+            if not song:
+                raise HTTPException(status_code=404, detail="Song not found")
+        if stat is None:
+            path = os.path.realpath(os.path.join(MUSIC_STORAGE_PATH, str(song.file_path)))
+            stat = streaming.stat_file(path)
+            song_locations.put(song_id, stat)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Audio file missing")
-    file_size = os.path.getsize(path)
-    range_header = request.headers.get("range")
-    if range_header:
-        byte_range = range_header.replace("bytes=", "").split("-")
-        start = int(byte_range[0])
-        end = int(byte_range[1]) if byte_range[1] else file_size - 1
-        if start >= file_size:
-            raise HTTPException(status_code=416, detail="Requested range not satisfiable")
-        chunk_size = (end - start) + 1
-        async def range_stream():
-            async with aiofiles.open(path, mode="rb") as f:
-                await f.seek(start)
-                content = await f.read(chunk_size)
-                yield content
-        return StreamingResponse(
-            range_stream(), status_code=206,
-            headers={
-                "Content-Range": f"bytes {start}-{end}/{file_size}",
-                "Accept-Ranges": "bytes", "Content-Length": str(chunk_size),
-                "Content-Type": "audio/mpeg",
-            },
-        )
-    return FileResponse(path, media_type="audio/mpeg")
+    start_at = None
+    if t is not None and song is not None:
+        start_at = audio_metadata.seek_offset(song.seek_table, song.duration, t) # type: ignore
+    return streaming.file_response(request, stat, media_type="audio/mpeg", start_at=start_at)
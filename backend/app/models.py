@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Boolean, Float
+from sqlalchemy import BigInteger, Column, Integer, String, ForeignKey, Table, Boolean, Float, Index, func, literal_column
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -16,6 +16,10 @@ playlist_songs = Table(
     Base.metadata,
     Column("playlist_id", Integer, ForeignKey("playlists.id"), primary_key=True),
     Column("song_id", Integer, ForeignKey("songs.id"), primary_key=True),
+    # Sparse ordering key (see playlist_edits.POSITION_STEP) so an insert or
+    # move only rewrites the rows that actually changed
+    Column("position", Integer, nullable=False, server_default="0"),
+    Index("ix_playlist_songs_position", "playlist_id", "position"),
 )
 
 class User(Base):
@@ -43,10 +47,44 @@ class Song(Base):
     price = Column(Float, default=0.99)
     image_url = Column(String, nullable=True)
     file_path = Column(String)
+    # Filled at ingest from the MP3 headers (see audio_metadata)
+    duration = Column(Float, nullable=True) # Seconds
+    bitrate = Column(Integer, nullable=True) # kbps
+    sample_rate = Column(Integer, nullable=True)
+    seek_table = Column(String, nullable=True) # JSON list of byte offsets
     
     owners = relationship("User", secondary=user_songs, back_populates="collection")
     playlists = relationship("Playlist", secondary=playlist_songs, back_populates="songs")
 
+    __table_args__ = (
+        # Keyset pagination: every catalog sort is (sort key, id), with NULLs
+        # coalesced so they sort and page like any other value. The
+        # expressions must match catalog.SORT_KEYS.
+        Index("ix_songs_title_key", func.coalesce(literal_column("title", String), literal_column("''", String)), "id"),
+        Index("ix_songs_artist_key", func.coalesce(literal_column("artist", String), literal_column("''", String)), "id"),
+        Index("ix_songs_price_key", func.coalesce(literal_column("price", Float), literal_column("0", Float)), "id"),
+        # Full-text search over title/artist (see catalog.search_vector)
+        Index(
+            "ix_songs_search",
+            func.to_tsvector(
+                literal_column("'simple'"),
+                func.coalesce(literal_column("title", String), literal_column("''", String)) + literal_column("' '", String)
+                + func.coalesce(literal_column("artist", String), literal_column("''", String)),
+            ),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+        {"info": {"retired_indexes": ["ix_songs_title_id", "ix_songs_artist_id", "ix_songs_price_id"]}},
+    )
+
+class LibraryFile(Base):
+    # Scanner manifest: what each audio file looked like when last ingested
+    __tablename__ = "library_files"
+
+    path = Column(String, primary_key=True) # Relative to the storage root
+    size = Column(Integer)
+    mtime = Column(Float)
+    song_id = Column(Integer, ForeignKey("songs.id", ondelete="SET NULL"), nullable=True)
+
 class Playlist(Base):
     __tablename__ = "playlists"
 
@@ -55,7 +93,12 @@ class Playlist(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     
     user = relationship("User", back_populates="playlists")
-    songs = relationship("Song", secondary=playlist_songs, back_populates="playlists")
+    # Playlists are almost always serialized with their songs; selectin keeps
+    # that at one extra query per batch of playlists instead of one each
+    songs = relationship(
+        "Song", secondary=playlist_songs, back_populates="playlists", lazy="selectin",
+        order_by=[playlist_songs.c.position, playlist_songs.c.song_id],
+    )
     nfc_tags = relationship("NFCTag", back_populates="playlist")
 
 class NFCTag(Base):
@@ -68,7 +111,7 @@ class NFCTag(Base):
     playlist_id = Column(Integer, ForeignKey("playlists.id"), nullable=True)
     
     user = relationship("User", back_populates="nfc_tags")
-    playlist = relationship("Playlist", back_populates="nfc_tags")
+    playlist = relationship("Playlist", back_populates="nfc_tags", lazy="selectin")
 
 class Device(Base):
     __tablename__ = "devices"
@@ -89,11 +132,55 @@ class Command(Base):
     device_id = Column(String, ForeignKey("devices.id"))
     command_type = Column(String) # LOAD_PLAYLIST, PLAY, PAUSE, NEXT, PREV, SET_VOLUME
     payload = Column(String, nullable=True) # JSON string
-    status = Column(String, default="pending") # pending, acked
+    status = Column(String, default="pending") # pending, leased, acked
     created_at = Column(Float)
+    leased_until = Column(Float, nullable=True) # Timestamp; expired leases are redelivered
+    delivered_at = Column(Float, nullable=True) # First handed out; delivered rows are never coalesced
 
     device = relationship("Device", back_populates="commands")
 
+    __table_args__ = (
+        # Covers the kiosk poll (device_id + not acked, ordered by created_at).
+        # Partial, so acked history never bloats it.
+        Index(
+            "ix_commands_device_undelivered",
+            "device_id", "created_at", "id",
+            postgresql_where=(status != "acked"),
+            sqlite_where=(status != "acked"),
+        ),
+        # Compaction: acked (or expired) rows by age
+        Index("ix_commands_status_created", "status", "created_at"),
+    )
+
+class SongNeighbor(Base):
+    # Precomputed top-K "play next" candidates (see cooccurrence)
+    __tablename__ = "song_neighbors"
+
+    song_id = Column(Integer, ForeignKey("songs.id", ondelete="CASCADE"), primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey("songs.id", ondelete="CASCADE"), primary_key=True)
+    score = Column(Float)
+
+    __table_args__ = (
+        Index("ix_song_neighbors_rank", "song_id", "score"),
+    )
+
+class CooccurrencePlaylist(Base):
+    # What each playlist looked like when the neighbor table last indexed it
+    __tablename__ = "cooccurrence_playlists"
+
+    playlist_id = Column(Integer, primary_key=True)
+    song_ids = Column(String) # idset encoding of the members
+    song_count = Column(Integer)
+    song_id_sum = Column(BigInteger) # Can exceed int4 on long playlists
+    song_digest = Column(BigInteger) # cooccurrence.song_digest of the members
+    plays = Column(Integer, default=0) # LOAD_PLAYLIST taps seen so far
+
+class CooccurrenceState(Base):
+    __tablename__ = "cooccurrence_state"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer)
+
 class ClaimCode(Base):
     __tablename__ = "claim_codes"
 
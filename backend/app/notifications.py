@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import select
+import threading
+from collections import defaultdict
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+COMMAND_CHANNEL = "taptone_commands"
+
+
+# Fan-out backends
+# A backend only moves device ids between processes. Every worker subscribes
+# its hub to the backend, and publish() must reach all subscribers, including
+# the one in the publishing process.
+class InMemoryBackend:
+    def __init__(self):
+        self._callbacks: list[Callable[[str], None]] = []
+
+    def subscribe(self, callback: Callable[[str], None]):
+        self._callbacks.append(callback)
+
+    def publish(self, device_id: str):
+        for callback in self._callbacks:
+            callback(device_id)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PostgresNotifyBackend:
+    """LISTEN/NOTIFY fan-out so every uvicorn worker sees every new command.
+
+    `connect` returns a DB-API connection with the psycopg2 notification API
+    (`cursor()`, `fileno()`, `poll()`, `notifies`); tests can pass a local
+    stand-in.
+    """
+
+    def __init__(self, connect: Callable, channel: str = COMMAND_CHANNEL, poll_interval: float = 5.0):
+        self.connect = connect
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self._callbacks: list[Callable[[str], None]] = []
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, callback: Callable[[str], None]):
+        self._callbacks.append(callback)
+
+    def publish(self, device_id: str):
+        with self._publish_lock:
+            try:
+                if self._publish_conn is None:
+                    self._publish_conn = self._autocommit(self.connect())
+                cur = self._publish_conn.cursor()
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, device_id))
+                cur.close()
+            except Exception:
+                # Drop the connection so the next publish reconnects; waiting
+                # kiosks still pick the command up on their next poll.
+                logger.exception(f"Failed to publish notification on {self.channel}")
+                self._publish_conn = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name=f"{self.channel}-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _autocommit(self, conn):
+        if hasattr(conn, "autocommit"):
+            conn.autocommit = True
+        return conn
+
+    def _listen(self):
+        while not self._stop.is_set():
+            try:
+                conn = self._autocommit(self.connect())
+                cur = conn.cursor()
+                cur.execute(f'LISTEN "{self.channel}"')
+                cur.close()
+                while not self._stop.is_set():
+                    select.select([conn], [], [], self.poll_interval)
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        for callback in self._callbacks:
+                            callback(notify.payload)
+                conn.close()
+            except Exception:
+                logger.exception(f"Notification listener on {self.channel} failed, reconnecting")
+                self._stop.wait(self.poll_interval)
+
+
+class CommandWaiter:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # Loop already closed (worker shutting down)
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+class CommandHub:
+    """Per-device wake-ups for kiosks parked on long-poll or SSE.
+
+    notify() is called from worker threads (publishing may block on the
+    backend); waiters live on the event loop, so delivery always goes
+    through call_soon_threadsafe.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or InMemoryBackend()
+        self.backend.subscribe(self._deliver)
+        self._lock = threading.Lock()
+        self._waiters: dict[str, set[CommandWaiter]] = defaultdict(set)
+
+    def notify(self, device_id: str):
+        self.backend.publish(device_id)
+
+    def notify_many(self, device_ids):
+        for device_id in device_ids:
+            self.backend.publish(device_id)
+
+    def listen(self, device_id: str):
+        # Register before querying the DB so a command committed between the
+        # query and the wait still wakes the caller.
+        return _Subscription(self, device_id)
+
+    def waiting_devices(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+    def _deliver(self, device_id: str):
+        with self._lock:
+            waiters = list(self._waiters.get(device_id, ()))
+        for waiter in waiters:
+            waiter.wake()
+
+    def _add(self, device_id: str, waiter: CommandWaiter):
+        with self._lock:
+            self._waiters[device_id].add(waiter)
+
+    def _remove(self, device_id: str, waiter: CommandWaiter):
+        with self._lock:
+            waiters = self._waiters.get(device_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[device_id]
+
+
+class _Subscription:
+    def __init__(self, hub: CommandHub, device_id: str):
+        self.hub = hub
+        self.device_id = device_id
+        self.waiter: Optional[CommandWaiter] = None
+
+    def __enter__(self) -> CommandWaiter:
+        self.waiter = CommandWaiter(asyncio.get_running_loop())
+        self.hub._add(self.device_id, self.waiter)
+        return self.waiter
+
+    def __exit__(self, *exc):
+        if self.waiter is not None:
+            self.hub._remove(self.device_id, self.waiter)
+        return False
+
+
+def create_backend(channel: str = COMMAND_CHANNEL):
+    kind = os.getenv("COMMAND_HUB_BACKEND", "memory").lower()
+    if kind == "postgres":
+        from .database import DATABASE_URL
+        import psycopg2
+
+        dsn = DATABASE_URL.replace("postgresql+psycopg2://", "postgresql://")
+        return PostgresNotifyBackend(lambda: psycopg2.connect(dsn), channel=channel)
+    return InMemoryBackend()
+
+
+command_hub = CommandHub(create_backend())
@@ -0,0 +1,179 @@
+import bisect
+import os
+from typing import Dict, Iterable, List, Optional, Sequence
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from . import collection, models
+from .response_cache import response_cache
+
+# Gap left between neighbouring songs; inserts and moves take a position in
+# the gap and only renumber the playlist once a gap is used up
+POSITION_STEP = 1024
+# Also keeps every IN (...) below inside the database's bind parameter limit
+PLAYLIST_MAX_SONGS = int(os.getenv("PLAYLIST_MAX_SONGS", "10000"))
+
+playlist_songs = models.playlist_songs
+
+
+def apply_ops(song_ids: List[int], ops: Iterable) -> List[int]:
+    """Apply add/remove/move operations to an ordered list of song ids.
+
+    Positions are list indexes and are clamped to the list; a missing
+    position appends. Adding a song that is already there is a no-op, and
+    move places the given songs, in the given order, at the position they
+    get once they are taken out of the list.
+    """
+    songs = list(song_ids)
+    for op in ops:
+        ids = list(dict.fromkeys(op.song_ids))
+        present = set(songs)
+        if op.op == "add":
+            ids = [song_id for song_id in ids if song_id not in present]
+        elif op.op in ("remove", "move"):
+            taken = set(ids)
+            songs = [song_id for song_id in songs if song_id not in taken]
+            ids = [song_id for song_id in ids if song_id in present] if op.op == "move" else []
+        else:
+            raise ValueError(f"Unsupported operation: {op.op}")
+        if ids:
+            at = len(songs) if op.position is None else max(0, min(op.position, len(songs)))
+            songs[at:at] = ids
+    return songs
+
+
+def _stable_songs(order: Sequence[int], current: Dict[int, int]) -> set:
+    # Longest run of kept songs whose stored positions already increase in
+    # the new order; those rows stay untouched
+    kept = [song_id for song_id in order if song_id in current]
+    tails: List[int] = []
+    tail_index: List[int] = []
+    previous: List[int] = [-1] * len(kept)
+    for i, song_id in enumerate(kept):
+        at = bisect.bisect_left(tails, current[song_id])
+        if at == len(tails):
+            tails.append(current[song_id])
+            tail_index.append(i)
+        else:
+            tails[at] = current[song_id]
+            tail_index[at] = i
+        previous[i] = tail_index[at - 1] if at else -1
+    stable = set()
+    i = tail_index[-1] if tail_index else -1
+    while i >= 0:
+        stable.add(kept[i])
+        i = previous[i]
+    return stable
+
+
+def plan_positions(order: Sequence[int], current: Dict[int, int]) -> Dict[int, int]:
+    """Positions for the new order, reusing as many stored ones as possible."""
+    stable = _stable_songs(order, current)
+    positions: Dict[int, int] = {}
+    pending: List[int] = []
+    low: Optional[int] = None
+    for song_id in list(order) + [None]:  # type: ignore
+        if song_id is not None and song_id not in stable:
+            pending.append(song_id)
+            continue
+        high = current[song_id] if song_id is not None else None
+        if pending:
+            if low is None and high is None:
+                slots = [i * POSITION_STEP for i in range(len(pending))]
+            elif low is None:
+                slots = [high - (len(pending) - i) * POSITION_STEP for i in range(len(pending))]  # type: ignore
+            elif high is None:
+                slots = [low + (i + 1) * POSITION_STEP for i in range(len(pending))]
+            elif high - low > len(pending):
+                slots = [low + (high - low) * (i + 1) // (len(pending) + 1) for i in range(len(pending))]
+            else:
+                # Gap used up: renumber the whole playlist
+                return {song_id: i * POSITION_STEP for i, song_id in enumerate(order)}
+            positions.update(zip(pending, slots))
+            pending = []
+        if song_id is not None:
+            positions[song_id] = high  # type: ignore
+            low = high
+    return positions
+
+
+def edit_playlist_songs(db: Session, playlist_id: int, user_id: int, edit) -> Optional[dict]:
+    """Rewrite a playlist's song order, writing only the rows that changed.
+
+    `edit` maps the current ordered song ids to the new ones. Added songs
+    must be in the user's collection. Returns counts of added, removed and
+    moved songs, or None if the playlist doesn't exist or isn't the user's.
+    """
+    # Row lock so two concurrent edits of one playlist apply one after the other
+    found = db.execute(
+        select(models.Playlist.id)
+        .where(models.Playlist.id == playlist_id, models.Playlist.user_id == user_id)
+        .with_for_update()
+    ).first()
+    if found is None:
+        return None
+    current = {
+        int(song_id): int(position)
+        for song_id, position in db.execute(
+            select(playlist_songs.c.song_id, playlist_songs.c.position)
+            .where(playlist_songs.c.playlist_id == playlist_id)
+            .order_by(playlist_songs.c.position, playlist_songs.c.song_id)
+        )
+    }
+    order = list(dict.fromkeys(edit(list(current))))
+    if len(order) > PLAYLIST_MAX_SONGS:
+        db.rollback()
+        raise ValueError(f"A playlist can hold at most {PLAYLIST_MAX_SONGS} songs")
+
+    added = [song_id for song_id in order if song_id not in current]
+    not_owned = set(added) - collection.owned_song_ids(db, user_id, added)
+    if not_owned:
+        db.rollback()
+        raise ValueError("Songs not in your collection: " + ", ".join(str(song_id) for song_id in sorted(not_owned)))
+    removed = set(current) - set(order)
+    positions = plan_positions(order, {song_id: current[song_id] for song_id in order if song_id in current})
+    moved = [
+        {"b_playlist_id": playlist_id, "b_song_id": song_id, "b_position": position}
+        for song_id, position in positions.items()
+        if song_id in current and current[song_id] != position
+    ]
+
+    if removed:
+        db.execute(delete(playlist_songs).where(
+            playlist_songs.c.playlist_id == playlist_id, playlist_songs.c.song_id.in_(removed)
+        ))
+    if moved:
+        db.execute(
+            update(playlist_songs)
+            .where(
+                playlist_songs.c.playlist_id == bindparam("b_playlist_id"),
+                playlist_songs.c.song_id == bindparam("b_song_id"),
+            )
+            .values(position=bindparam("b_position")),
+            moved,
+        )
+    if added:
+        db.execute(insert(playlist_songs), [
+            {"playlist_id": playlist_id, "song_id": song_id, "position": positions[song_id]} for song_id in added
+        ])
+    changed = bool(removed or moved or added)
+    tag_ids = list(db.scalars(select(models.NFCTag.tag_id).where(models.NFCTag.playlist_id == playlist_id))) if changed else []
+    db.commit()
+    if changed:
+        # Core statements bypass the ORM flush hooks, so invalidate by hand
+        response_cache.invalidate(f"playlist:{playlist_id}", f"user:{user_id}", *(f"tag:{tag_id}" for tag_id in tag_ids))
+    return {"added": len(added), "removed": len(removed), "moved": len(moved)}
+
+
+def backfill_positions(bind):
+    """Number playlist_songs rows from before the position column existed.
+
+    Rows are ordered by song id, the closest thing to the old (unordered)
+    insertion order.
+    """
+    earlier = playlist_songs.alias("earlier")
+    with bind.begin() as conn:
+        conn.execute(update(playlist_songs).values(position=(
+            select(func.count() * POSITION_STEP)
+            .where(earlier.c.playlist_id == playlist_songs.c.playlist_id, earlier.c.song_id < playlist_songs.c.song_id)
+            .scalar_subquery()
+        )))
@@ -0,0 +1,82 @@
+import os
+import time
+from http.cookies import SimpleCookie
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from .database import SessionLocal, engine_options
+
+# Optional read replica for read-only endpoints. Without READ_REPLICA_URL
+# every read goes to the primary and nothing below has any effect. Two local
+# SQLite files work as a stand-in for testing.
+READ_REPLICA_URL = os.getenv("READ_REPLICA_URL")
+# Upper bound on replication lag (seconds): how long a client's reads stay on
+# the primary after its own write, and how long cached reads of changed data
+# may still come from a lagging replica
+READ_REPLICA_MAX_LAG = float(os.getenv("READ_REPLICA_MAX_LAG", "5"))
+PRIMARY_COOKIE = "read_primary_until"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+replica_engine = create_engine(READ_REPLICA_URL, **engine_options(READ_REPLICA_URL)) if READ_REPLICA_URL else None
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
+
+
+def wants_primary(request: Request) -> bool:
+    # Read-your-writes: set by ReadYourWritesMiddleware after a mutation
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, "0")) > time.time()
+    except ValueError:
+        return False
+
+
+def read_session(request: Request):
+    # The replica, unless this client wrote recently or none is configured
+    if ReplicaSessionLocal is not None and not wants_primary(request):
+        return ReplicaSessionLocal()
+    return SessionLocal()
+
+
+def get_read_db(request: Request):
+    db = read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def pool_stats() -> dict:
+    return {"replica": replica_engine.pool.status()} if replica_engine is not None else {}
+
+
+class ReadYourWritesMiddleware:
+    """Pins a client's reads to the primary for a while after it writes.
+
+    Successful POST/PUT/PATCH/DELETE responses get a short-lived cookie that
+    get_read_db honours, so the client's next reads see its own changes even
+    if the replica is behind. Plain ASGI so streamed responses pass through
+    untouched.
+    """
+
+    def __init__(self, app, window: float = READ_REPLICA_MAX_LAG):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or replica_engine is None or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = SimpleCookie()
+                cookie[PRIMARY_COOKIE] = f"{time.time() + self.window:.3f}"
+                cookie[PRIMARY_COOKIE]["max-age"] = int(self.window) + 1
+                cookie[PRIMARY_COOKIE]["path"] = "/"
+                cookie[PRIMARY_COOKIE]["httponly"] = True
+                cookie[PRIMARY_COOKIE]["samesite"] = "lax"
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", cookie[PRIMARY_COOKIE].OutputString().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
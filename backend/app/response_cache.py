@@ -0,0 +1,225 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from . import models, replica
+from .notifications import InMemoryBackend, create_backend
+from .replica import READ_REPLICA_MAX_LAG, replica_engine
+from .streaming import etag_matches
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# Upper bound on staleness if an invalidation from another worker is lost
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+CACHE_CHANNEL = "taptone_cache"
+# Reads of a just-changed scope may come from a replica that is still
+# behind, so entries built inside this window expire when it closes
+RESPONSE_CACHE_SETTLE = READ_REPLICA_MAX_LAG if replica_engine is not None else 0.0
+
+_adapters: dict[Any, TypeAdapter] = {}
+
+
+def encode_json(payload, model: Any = None) -> bytes:
+    """Serialize ORM objects or plain data the way the response_model would."""
+    adapter = _adapters.get(model)
+    if adapter is None:
+        adapter = _adapters[model] = TypeAdapter(model if model is not None else Any)
+    if model is not None:
+        payload = adapter.validate_python(payload, from_attributes=True)
+    return adapter.dump_json(payload)
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    headers: dict = {}
+
+
+class _Entry(NamedTuple):
+    scopes: tuple
+    versions: tuple
+    expires_at: float
+    etag: str
+    body: bytes
+    headers: dict
+
+
+class ResponseCache:
+    """Serialized JSON bodies keyed by request, validated by scope versions.
+
+    Every entry records the versions of the scopes it was built from
+    ("catalog", "playlist:<id>", "tag:<tag_id>", "user:<id>"); invalidate()
+    bumps a scope in every worker, which retires all entries built on it.
+    ETags are content hashes, so they agree across workers.
+    """
+
+    def __init__(
+        self, backend=None, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+        settle: float = RESPONSE_CACHE_SETTLE,
+    ):
+        self.backend = backend or InMemoryBackend()
+        self.backend.subscribe(self._bump)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.settle = settle
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._versions: dict[str, int] = {}
+        self._bumped_at: dict[str, float] = {}
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+    def invalidate(self, *scopes: str):
+        for scope in scopes:
+            self.backend.publish(scope)
+
+    def respond(
+        self,
+        request: Request,
+        key: str,
+        scopes: Iterable[str],
+        build: Callable[[], CachedBody],
+        cache_control: str = "no-cache",
+    ) -> Response:
+        scopes = tuple(scopes)
+        # A client pinned to the primary after a write must not get (or
+        # leave behind) an entry that may have been built from the replica
+        pinned = replica.replica_engine is not None and replica.wants_primary(request)
+        entry = None if pinned else self._lookup(key)
+        if entry is None:
+            # Versions are read before the build, so a write that lands while
+            # building leaves the entry already stale instead of wrongly fresh
+            versions = self.versions(scopes)
+            built = build()
+            entry = _Entry(
+                scopes, versions, self.expiry(scopes, self.ttl),
+                '"' + hashlib.blake2b(built.body, digest_size=16).hexdigest() + '"',
+                built.body, dict(built.headers),
+            )
+            if not pinned:
+                self._store(key, entry)
+        headers = {"ETag": entry.etag, "Cache-Control": cache_control, **entry.headers}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, entry.etag):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": sum(len(entry.body) for entry in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def versions(self, scopes: Iterable[str]) -> tuple:
+        with self._lock:
+            return tuple(self._versions.get(scope, 0) for scope in scopes)
+
+    def expiry(self, scopes: Iterable[str], ttl: float) -> float:
+        """Expiry time for something built now from these scopes."""
+        now = time.time()
+        if self.settle > 0:
+            with self._lock:
+                changed = max((self._bumped_at.get(scope, 0.0) for scope in scopes), default=0.0)
+            if changed + self.settle > now:
+                return min(now + ttl, changed + self.settle)
+        return now + ttl
+
+    def _lookup(self, key: str) -> Optional[_Entry]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = (
+                entry is not None and entry.expires_at > now
+                and entry.versions == tuple(self._versions.get(scope, 0) for scope in entry.scopes)
+            )
+            if not fresh:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _store(self, key: str, entry: _Entry):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _bump(self, scope: str):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+            if self.settle > 0:
+                self._bumped_at[scope] = time.time()
+
+
+response_cache = ResponseCache(create_backend(CACHE_CHANNEL))
+
+
+# Scopes touched by a flush are collected on the session and only published
+# once the transaction commits, so no reader can rebuild from the old rows
+# after the bump. Bulk insert()/update() statements bypass the ORM and must
+# call response_cache.invalidate() themselves.
+_PENDING_KEY = "response_cache_scopes"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_scopes(session, flush_context):
+    scopes = session.info.setdefault(_PENDING_KEY, set())
+    playlist_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.Song):
+            # Playlist edits touch Song.playlists; only column changes matter
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            scopes.add("catalog")
+        elif isinstance(obj, models.Playlist):
+            if obj.id is not None:
+                playlist_ids.add(obj.id)
+                scopes.add(f"playlist:{obj.id}")
+            if obj.user_id is not None:
+                scopes.add(f"user:{obj.user_id}")
+        elif isinstance(obj, models.NFCTag):
+            if obj.tag_id is not None:
+                scopes.add(f"tag:{obj.tag_id}")
+            if obj.user_id is not None:
+                scopes.add(f"user:{obj.user_id}")
+    if playlist_ids:
+        # Hardware sync responses are cached per tag
+        linked = session.connection().execute(
+            select(models.NFCTag.tag_id).where(models.NFCTag.playlist_id.in_(playlist_ids))
+        )
+        scopes.update(f"tag:{tag_id}" for tag_id, in linked)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_scopes(session):
+    scopes = session.info.pop(_PENDING_KEY, None)
+    if scopes:
+        response_cache.invalidate(*scopes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_scopes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+import time
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from . import models
+from .database import COMPACTION_LOCK_KEY, SessionLocal, worker_lock
+
+logger = logging.getLogger(__name__)
+
+# All durations in seconds
+COMMAND_PENDING_TTL = float(os.getenv("COMMAND_PENDING_TTL", str(60 * 60)))
+COMMAND_ACKED_RETENTION = float(os.getenv("COMMAND_ACKED_RETENTION", str(60 * 60 * 24)))
+COMMAND_COMPACTION_INTERVAL = float(os.getenv("COMMAND_COMPACTION_INTERVAL", "300"))
+COMMAND_COMPACTION_BATCH = int(os.getenv("COMMAND_COMPACTION_BATCH", "1000"))
+
+
+def _delete_in_batches(db: Session, condition, batch_size: int) -> int:
+    # Short transactions of at most batch_size rows so compaction never holds
+    # long locks on the table the kiosks are polling.
+    deleted = 0
+    while True:
+        ids = list(db.scalars(select(models.Command.id).where(condition).limit(batch_size)))
+        if not ids:
+            break
+        db.query(models.Command).filter(models.Command.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+
+def compact_commands(db: Session, now: float | None = None, batch_size: int = COMMAND_COMPACTION_BATCH):
+    now = float(time.time()) if now is None else now
+    acked = _delete_in_batches(
+        db,
+        (models.Command.status == "acked") & (models.Command.created_at < now - COMMAND_ACKED_RETENTION),
+        batch_size,
+    )
+    # Commands for kiosks that never came back (pending or leased past the TTL)
+    expired = _delete_in_batches(
+        db,
+        models.Command.status.in_(("pending", "leased")) & (models.Command.created_at < now - COMMAND_PENDING_TTL),
+        batch_size,
+    )
+    return {"acked": acked, "expired": expired}
+
+
+def _compact_once():
+    # One worker at a time; the next one finds little left to delete
+    with worker_lock(COMPACTION_LOCK_KEY, "compaction"):
+        db = SessionLocal()
+        try:
+            return compact_commands(db)
+        finally:
+            db.close()
+
+
+async def compaction_loop(interval: float = COMMAND_COMPACTION_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await run_in_threadpool(_compact_once)
+            if result["acked"] or result["expired"]:
+                logger.info(f"Command compaction removed {result['acked']} acked and {result['expired']} expired commands")
+        except Exception:
+            logger.exception("Command compaction failed")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 class SongBase(BaseModel):
     title: str
@@ -10,9 +10,16 @@ class SongBase(BaseModel):
 
 class SongCreate(SongBase):
     file_path: str
+    duration: Optional[float] = None
+    bitrate: Optional[int] = None
+    sample_rate: Optional[int] = None
+    seek_table: Optional[str] = None
 
 class Song(SongBase):
     id: int
+    duration: Optional[float] = None
+    bitrate: Optional[int] = None
+    sample_rate: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -49,6 +56,19 @@ class Playlist(PlaylistBase):
     class Config:
         from_attributes = True
 
+class PlaylistSongOp(BaseModel):
+    op: Literal["add", "remove", "move"]
+    song_ids: List[int]
+    position: Optional[int] = None # Index in the playlist; None appends
+
+class PlaylistSummary(PlaylistBase):
+    # view=summary: playlist without its songs
+    id: int
+    user_id: int
+
+    class Config:
+        from_attributes = True
+
 class NFCTagBase(BaseModel):
     tag_id: str
     name: Optional[str] = None
@@ -65,6 +85,15 @@ class NFCTag(NFCTagBase):
     class Config:
         from_attributes = True
 
+class NFCTagSummary(NFCTagBase):
+    id: int
+    user_id: int
+    playlist_id: Optional[int] = None
+    playlist: Optional[PlaylistSummary] = None
+
+    class Config:
+        from_attributes = True
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -97,6 +126,11 @@ class Command(CommandBase):
     class Config:
         from_attributes = True
 
+class CommandAck(BaseModel):
+    # Either explicit ids or a watermark acking everything up to and including it
+    command_ids: List[int] = []
+    up_to_id: Optional[int] = None
+
 class ClaimCode(BaseModel):
     code: str
     device_id: str
@@ -1,18 +1,13 @@
 import os
-import hashlib
 import logging
 from sqlalchemy.orm import Session
 from . import models, auth
+from .library_scanner import bootstrap_library, scan_library
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_image_url(artist, title):
-    seed_str = f"{artist}-{title}".lower()
-    seed_hash = hashlib.md5(seed_str.encode()).hexdigest()[:6]
-    return f"https://picsum.photos/seed/{seed_hash}/400/400"
-
 def auto_seed_data(db: Session):
     logger.info("Starting auto-seeding process...")
     # 1. Ensure Admin User Exists
@@ -34,57 +29,13 @@ def auto_seed_data(db: Session):
     else:
         logger.info("Admin user already exists.")
     
-    # 2. Sync Music Storage with DB only if the library is empty
-    song_count = db.query(models.Song).count()
-    if song_count > 0:
-        logger.info(f"Library already contains {song_count} songs. Skipping music seeding.")
-        return
-
+    # 2. Sync Music Storage with DB (incremental, see library_scanner)
     storage_dir = os.path.join(os.getcwd(), "music_storage")
     initial_lib_dir = os.path.join(os.getcwd(), "initial_library")
     
     # If storage is empty and initial_library exists (inside image), bootstrap it
-    if os.path.exists(initial_lib_dir) and not os.listdir(storage_dir):
-        logger.info("Bootstrap: Copying files from image to volume...")
-        import shutil
-        for item in os.listdir(initial_lib_dir):
-            s = os.path.join(initial_lib_dir, item)
-            d = os.path.join(storage_dir, item)
-            shutil.copy2(s, d)
+    if bootstrap_library(initial_lib_dir, storage_dir):
         logger.info("Bootstrap: Files copied successfully.")
 
-    logger.info(f"Checking music storage directory: {storage_dir}")
-    logger.info(f"Directory exists: {os.path.exists(storage_dir)}")
-    if os.path.exists(storage_dir):
-        logger.info(f"Directory contents: {os.listdir(storage_dir)}")
-        files = [f for f in os.listdir(storage_dir) if f.endswith(".mp3")]
-        logger.info(f"Found {len(files)} MP3 files in storage.")
-        for file in files:
-            # Format: <artist> - <title> - <genre>.mp3
-            name_part = file.replace(".mp3", "")
-            parts = name_part.split(" - ")
-            
-            if len(parts) >= 3:
-                artist, title, genre = parts[0], parts[1], parts[2]
-            else:
-                logger.warning(f"Skipping file with invalid format: {file}")
-                continue 
-            
-            # Check if song exists
-            db_song = db.query(models.Song).filter(models.Song.title == title, models.Song.artist == artist).first()
-            if not db_song:
-                db_song = models.Song(
-                    title=title,
-                    artist=artist,
-                    genre=genre,
-                    price=0.99,
-                    file_path=file,
-                    image_url=get_image_url(artist, title)
-                )
-                db.add(db_song)
-                logger.info(f"Auto-seeded song: {title} by {artist}")
-    else:
-        logger.error(f"Music storage directory NOT FOUND: {storage_dir}")
-    
-    db.commit()
+    scan_library(db, storage_dir)
     logger.info("Auto-seeding complete.")
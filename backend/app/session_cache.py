@@ -0,0 +1,136 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import models, schemas
+from .notifications import InMemoryBackend, create_backend
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+SESSION_CHANNEL = "taptone_sessions"
+
+
+def _token_key(token: str) -> str:
+    # Entries and invalidation messages carry a digest, never the token itself
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+class SessionCache:
+    """Bounded LRU of session token -> detached user snapshot.
+
+    Entries expire after `ttl` seconds (never later than the token itself)
+    and are dropped whenever the underlying User row changes, so role or
+    profile edits are picked up on the next request. Invalidations go
+    through the backend so every worker drops its copy.
+    """
+
+    def __init__(self, backend=None, max_size: int = SESSION_CACHE_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.backend = backend or InMemoryBackend()
+        self.backend.subscribe(self._on_invalidate)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, schemas.User]] = OrderedDict()
+        self._tokens_by_user: dict[int, set[str]] = {}
+
+    def get(self, token: str) -> Optional[schemas.User]:
+        token = _token_key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._drop(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, user: schemas.User, token_expires_at: Optional[float] = None):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        token = _token_key(token)
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (expires_at, user)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_token(self, token: str):
+        self.backend.publish("token:" + _token_key(token))
+
+    def invalidate_user(self, user_id: int):
+        self.backend.publish(f"user:{user_id}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def _on_invalidate(self, message: str):
+        kind, _, value = message.partition(":")
+        with self._lock:
+            if kind == "token":
+                self._drop(value)
+            elif kind == "user":
+                for token in list(self._tokens_by_user.get(int(value), ())):
+                    self._drop(token)
+
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[1].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[1].id]
+
+
+session_cache = SessionCache(create_backend(SESSION_CHANNEL))
+
+
+# Changed users are collected at flush and published once the transaction
+# commits, so no worker can re-cache the old row after the drop. Bulk
+# query.update() on users must call invalidate_user itself.
+_PENDING_KEY = "session_cache_users"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_users(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.User) and obj.id is not None:
+            if obj in session.deleted or session.is_modified(obj, include_collections=False):
+                session.info.setdefault(_PENDING_KEY, set()).add(int(obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_users(session):
+    for user_id in session.info.pop(_PENDING_KEY, ()):
+        session_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_users(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import NamedTuple, Optional, Tuple
+import aiofiles
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from .notifications import InMemoryBackend, create_backend
+
+# Read size per send; bounds per-listener memory no matter how large the range
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(64 * 1024)))
+SONG_LOCATION_CACHE_SIZE = int(os.getenv("SONG_LOCATION_CACHE_SIZE", "4096"))
+SONG_LOCATION_CACHE_TTL = float(os.getenv("SONG_LOCATION_CACHE_TTL", "300"))
+SONG_LOCATION_CHANNEL = "taptone_song_locations"
+
+
+class FileStat(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    etag: str
+
+
+def stat_file(path: str) -> FileStat:
+    st = os.stat(path)
+    return FileStat(path, st.st_size, st.st_mtime, f'"{st.st_size:x}-{st.st_mtime_ns:x}"')
+
+
+def _revalidate(cached: FileStat) -> FileStat:
+    st = os.stat(cached.path)
+    if st.st_size == cached.size and st.st_mtime == cached.mtime:
+        return cached
+    return FileStat(cached.path, st.st_size, st.st_mtime, f'"{st.st_size:x}-{st.st_mtime_ns:x}"')
+
+
+class SongLocationCache:
+    """LRU of song_id -> FileStat for the streaming hot path.
+
+    A hit costs one os.stat (to notice files replaced on disk) and no DB
+    query. Song writes must call invalidate(), which goes through the
+    backend so every worker drops its copy; entries also expire after `ttl`
+    seconds in case a writer outside the app moved a file.
+    """
+
+    def __init__(self, backend=None, max_size: int = SONG_LOCATION_CACHE_SIZE, ttl: float = SONG_LOCATION_CACHE_TTL):
+        self.backend = backend or InMemoryBackend()
+        self.backend.subscribe(self._on_invalidate)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[float, FileStat]] = OrderedDict()
+
+    def get(self, song_id: int) -> Optional[FileStat]:
+        with self._lock:
+            entry = self._entries.get(song_id)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[song_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(song_id)
+            self.hits += 1
+        expires_at, cached = entry
+        try:
+            fresh = _revalidate(cached)
+        except FileNotFoundError:
+            self._on_invalidate(str(song_id))
+            raise
+        if fresh is not cached:
+            with self._lock:
+                if song_id in self._entries:
+                    self._entries[song_id] = (expires_at, fresh)
+        return fresh
+
+    def put(self, song_id: int, stat: FileStat):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[song_id] = (time.time() + self.ttl, stat)
+            self._entries.move_to_end(song_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, song_id: int):
+        self.backend.publish(str(song_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _on_invalidate(self, message: str):
+        with self._lock:
+            self._entries.pop(int(message), None)
+
+
+song_locations = SongLocationCache(create_backend(SONG_LOCATION_CHANNEL))
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range` header into inclusive (start, end).
+
+    Returns None when the header should be ignored (malformed, multiple
+    ranges, other units), which means serving the whole file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else max(size - 1, start)
+    except ValueError:
+        return None
+    if start < 0 or end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in header.split(",")]
+    weak = etag.removeprefix("W/")
+    return "*" in candidates or any(tag.removeprefix("W/") == weak for tag in candidates)
+
+
+def _if_range_matches(header: str, etag: str, mtime: float) -> bool:
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        # If-Range requires a strong comparison
+        return header == etag
+    try:
+        # Only an exact match: any other date means a different file
+        return int(parsedate_to_datetime(header).timestamp()) == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+class FileRangeResponse(Response):
+    """Serve [start, end] of a file in fixed-size chunks.
+
+    Uses the ASGI zero-copy extension (sendfile) when the server offers it,
+    otherwise reads STREAM_CHUNK_SIZE bytes at a time off the event loop.
+    """
+
+    def __init__(self, stat: FileStat, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.stat = stat
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        remaining = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD" or remaining <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.stat.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.start,
+                    "count": remaining,
+                    "more_body": False,
+                })
+            return
+        async with aiofiles.open(self.stat.path, mode="rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; close the body anyway
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def file_response(request: Request, stat: FileStat, media_type: str, start_at: Optional[int] = None) -> Response:
+    """Serve a file with conditional and Range support.
+
+    start_at (a time-based seek) makes the response the file from that byte
+    offset on: a plain 200 of the remaining bytes, with Range requests,
+    Content-Range and the ETag all relative to it, so clients that resume
+    or seek within it stay consistent.
+    """
+    offset = start_at if start_at is not None and 0 < start_at < stat.size else 0
+    size = stat.size - offset
+    etag = stat.etag if not offset else f'{stat.etag[:-1]}-{offset:x}"'
+    validators = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=validators)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or _if_range_matches(if_range, etag, stat.mtime)):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", **validators})
+        if byte_range is not None:
+            start, end = byte_range
+            headers = {
+                **validators,
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(end - start + 1),
+            }
+            return FileRangeResponse(stat, offset + start, offset + end, 206, headers, media_type)
+
+    headers = {**validators, "Content-Length": str(size)}
+    return FileRangeResponse(stat, offset, stat.size - 1, 200, headers, media_type)
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from sqlalchemy.orm import Session
+from . import crud
+from .response_cache import response_cache
+
+TAG_CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", "10000"))
+TAG_CACHE_TTL = float(os.getenv("TAG_CACHE_TTL", "300"))
+
+
+class TagManifest(NamedTuple):
+    tag_id: str
+    user_id: int
+    playlist_id: Optional[int]
+    playlist_name: Optional[str]
+    songs: tuple # Sync manifest entries, in playlist order
+
+
+def _manifest(tag) -> TagManifest:
+    playlist = tag.playlist
+    songs = tuple(
+        {
+            "id": song.id, "title": song.title, "artist": song.artist,
+            "genre": song.genre, "duration": song.duration, "url": f"/stream/{song.id}"
+        }
+        for song in (playlist.songs if playlist is not None else ())
+    )
+    return TagManifest(
+        str(tag.tag_id), int(tag.user_id),
+        int(playlist.id) if playlist is not None else None,
+        str(playlist.name) if playlist is not None else None,
+        songs,
+    )
+
+
+class TagCache:
+    """tag_uid -> (account, playlist, song manifest) for the tap path.
+
+    Entries share the response cache's scope versions ("catalog" and
+    "tag:<tag_id>"), so any write that changes what a tap resolves to
+    retires them. Unknown tags are cached too; registering one bumps its
+    scope.
+    """
+
+    def __init__(self, max_size: int = TAG_CACHE_SIZE, ttl: float = TAG_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[tuple, float, Optional[TagManifest]]] = OrderedDict()
+
+    def get(self, db: Session, tag_id: str) -> Optional[TagManifest]:
+        scopes = ("catalog", f"tag:{tag_id}")
+        versions = response_cache.versions(scopes)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(tag_id)
+            if entry is not None and entry[0] == versions and entry[1] > now:
+                self._entries.move_to_end(tag_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        tag = crud.resolve_tag(db, tag_id)
+        manifest = _manifest(tag) if tag is not None else None
+        if self.max_size > 0 and self.ttl > 0:
+            expires_at = response_cache.expiry(scopes, self.ttl)
+            with self._lock:
+                self._entries[tag_id] = (versions, expires_at, manifest)
+                self._entries.move_to_end(tag_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return manifest
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+tag_cache = TagCache()
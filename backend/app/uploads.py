@@ -0,0 +1,60 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, NamedTuple
+from starlette.concurrency import run_in_threadpool
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+class StoredFile(NamedTuple):
+    file_path: str # Relative to the storage root, as stored on Song.file_path
+    sha256: str
+    size: int
+    deduplicated: bool
+
+
+def content_path(digest: str, filename: str) -> str:
+    # Fan out by hash prefix so no single directory grows unbounded
+    ext = os.path.splitext(filename)[1].lower() or ".mp3"
+    return os.path.join(digest[:2], f"{digest}{ext}")
+
+
+def _store(source: BinaryIO, storage_dir: str, filename: str) -> StoredFile:
+    tmp_dir = os.path.join(storage_dir, ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    # Temp file on the same filesystem, so the final rename is atomic
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        relative = content_path(digest, filename)
+        target = os.path.join(storage_dir, relative)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+            return StoredFile(relative, digest, size, True)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+        return StoredFile(relative, digest, size, False)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def store_upload(source: BinaryIO, storage_dir: str, filename: str) -> StoredFile:
+    """Copy an upload into content-addressed storage without blocking the loop.
+
+    The bytes are hashed while they are written to a temp file, then the
+    file is renamed to <sha[:2]>/<sha><ext>. Identical uploads share a file.
+    """
+    return await run_in_threadpool(_store, source, storage_dir, filename)
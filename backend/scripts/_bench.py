@@ -0,0 +1,109 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+def configure(**defaults):
+    """Point the app at a throwaway SQLite database unless DATABASE_URL is set.
+
+    Must run before anything from `app` is imported: modules read the
+    environment once. Set DATABASE_URL to benchmark PostgreSQL instead
+    (the tables are dropped and recreated).
+    """
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="taptone-bench-"), "bench.db"))
+    os.environ.setdefault("COMMAND_HUB_BACKEND", "memory")
+    for name, value in defaults.items():
+        os.environ.setdefault(name, str(value))
+
+
+def reset_schema():
+    from app import database, models
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summary(samples) -> str:
+    ms = [sample * 1000 for sample in samples]
+    return (
+        f"n={len(ms)} p50={percentile(ms, 50):.2f}ms p99={percentile(ms, 99):.2f}ms "
+        f"max={max(ms):.2f}ms mean={statistics.fmean(ms):.2f}ms"
+    )
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def check(label: str, value_ms: float, limit_ms: float | None, unit: str = "ms") -> bool:
+    if limit_ms is None:
+        return True
+    ok = value_ms <= limit_ms
+    print(f"{'PASS' if ok else 'FAIL'} {label}: {value_ms:.2f}{unit} (limit {limit_ms:.2f}{unit})")
+    return ok
+
+
+class StreamListener:
+    """One client of GET `path`, calling the ASGI app directly.
+
+    Reads the body at `rate` bytes/s like a player buffering ahead, so the
+    server holds the response open as it would for a real listener.
+    `delays` collects how long each chunk took to arrive once the listener
+    was ready for it.
+    """
+
+    def __init__(self, app, path: str, rate: float = float("inf")):
+        self.app = app
+        self.path = path
+        self.rate = rate
+        self.status = None
+        self.received = 0
+        self.first_byte = None
+        self.delays: list[float] = []
+        self._ready_at = None
+        self._requested = False
+        self._done = None
+
+    async def listen(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": self.path, "raw_path": self.path.encode(),
+            "query_string": b"", "root_path": "", "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        }
+        self._done = asyncio.Event()
+        start = self._ready_at = time.perf_counter()
+        try:
+            await self.app(scope, self._receive, self._send)
+        finally:
+            self._done.set()
+        if self.first_byte is not None:
+            self.first_byte -= start
+
+    async def _receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._done.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            now = time.perf_counter()
+            if self.first_byte is None:
+                self.first_byte = now
+            else:
+                self.delays.append(now - self._ready_at)
+            self.received += len(message["body"])
+            await asyncio.sleep(len(message["body"]) / self.rate)
+            self._ready_at = time.perf_counter()
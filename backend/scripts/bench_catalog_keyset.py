@@ -0,0 +1,92 @@
+"""Catalog page latency by depth: keyset cursors against OFFSET paging.
+
+Loads --songs songs (some with NULL titles/prices), then for each sort times
+the page at several depths reached by a cursor and by skip. Keyset pages
+should cost the same at any depth. Exits non-zero if a keyset page exceeds
+--max-keyset-page.
+
+    cd backend && python -m scripts.bench_catalog_keyset --songs 1000000
+"""
+import argparse
+import random
+import sys
+
+from scripts._bench import check, configure, reset_schema, timed
+
+configure(DB_ASYNC="false")
+
+from sqlalchemy import insert  # noqa: E402
+from app import catalog, database, models  # noqa: E402
+
+INSERT_CHUNK = 10000
+WORDS = ["night", "drive", "blue", "river", "echo", "summer", "static", "gold", "ghost", "signal"]
+
+
+def fill(songs: int):
+    rng = random.Random(0)
+    for start in range(0, songs, INSERT_CHUNK):
+        rows = []
+        for song_id in range(start + 1, min(start + INSERT_CHUNK, songs) + 1):
+            rows.append({
+                "id": song_id,
+                "title": None if rng.random() < 0.01 else f"{rng.choice(WORDS)} {rng.choice(WORDS)} {song_id}",
+                "artist": f"artist {rng.randrange(songs // 20 or 1)}",
+                "genre": rng.choice(["rock", "pop", "jazz", "folk"]),
+                "price": None if rng.random() < 0.01 else round(rng.uniform(0.5, 2.0), 2),
+            })
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Song), rows)
+    with database.engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def cursor_at(db, sort: str, depth: int, limit: int):
+    # Walk there once with large pages; only the last hop is timed
+    cursor, seen = None, 0
+    while seen < depth:
+        step = min(catalog.MAX_PAGE_SIZE, depth - seen)
+        songs, cursor = catalog.search_songs(db, sort=sort, cursor=cursor, limit=step)
+        seen += len(songs)
+        if cursor is None:
+            break
+    return cursor
+
+
+def best_of(repeat: int, fn, *args, **kwargs) -> float:
+    return min(timed(fn, *args, **kwargs)[0] for _ in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-keyset-page", type=float, help="ms for any keyset page")
+    args = parser.parse_args()
+
+    reset_schema()
+    elapsed, _ = timed(fill, args.songs)
+    print(f"{database.engine.url.get_backend_name()}: {args.songs} songs ({elapsed:.1f}s to load)")
+
+    depths = [depth for depth in (0, 1_000, 100_000, args.songs // 2, args.songs - args.limit) if depth < args.songs]
+    worst = 0.0
+    db = database.SessionLocal()
+    try:
+        for sort in ("id", "title", "price"):
+            for depth in depths:
+                cursor = cursor_at(db, sort, depth, args.limit) if depth else None
+                keyset = best_of(args.repeat, catalog.search_songs, db, sort=sort, cursor=cursor, limit=args.limit)
+                offset = best_of(args.repeat, catalog.search_songs, db, sort=sort, skip=depth, limit=args.limit)
+                worst = max(worst, keyset)
+                print(f"sort={sort:<6} depth={depth:>8}: keyset {keyset * 1000:8.2f}ms   offset {offset * 1000:8.2f}ms")
+        search = best_of(args.repeat, catalog.search_songs, db, q="river echo", limit=args.limit)
+        print(f"search 'river echo': {search * 1000:.2f}ms")
+    finally:
+        db.close()
+
+    ok = check("slowest keyset page", worst * 1000, args.max_keyset_page)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Worker cold start: import time and lifespan start to the first ready probe.
+
+Starts --runs fresh interpreters. Each one times `import app.main`, then
+enters the app's lifespan and polls GET /readyz until it answers 200. The
+first run starts on an empty database (tables created and seeded); the rest
+restart against it, like a redeploy. Also lists the slowest imports under
+`python -X importtime`. Exits non-zero if a --max-* limit is exceeded.
+
+    cd backend && python -m scripts.bench_cold_start --runs 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from scripts._bench import check, configure, percentile, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0, INIT_DB_RETRY_DELAY=0.1)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def probe():
+    # Runs in the child: nothing from app (or its dependencies) is loaded yet
+    start = time.perf_counter()
+    import app.main
+    imported = time.perf_counter() - start
+
+    async def ready() -> float:
+        import httpx
+        transport = httpx.ASGITransport(app=app.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async with app.main.app.router.lifespan_context(app.main.app):
+                started = time.perf_counter()
+                while (await client.get("/readyz")).status_code != 200:
+                    await asyncio.sleep(0.005)
+                return time.perf_counter() - started
+
+    print(json.dumps({"import": imported, "ready": asyncio.run(ready())}))
+
+
+def run_child(storage: str, *python_args: str) -> subprocess.CompletedProcess:
+    # The seed step scans ./music_storage, so children run in an empty directory
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")])))
+    return subprocess.run(
+        [sys.executable, *python_args, "-m", "scripts.bench_cold_start", "--probe"],
+        cwd=storage, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def slowest_imports(storage: str, top: int) -> list:
+    # -X importtime writes "import time: self | cumulative | name" to stderr
+    rows = []
+    for line in run_child(storage, "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if "." not in name or name.startswith("app."):
+            rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--max-import", type=float, help="ms, import app.main p50 on restarts")
+    parser.add_argument("--max-ready", type=float, help="ms, lifespan start to 200 from /readyz p50 on restarts")
+    args = parser.parse_args()
+    if args.probe:
+        probe()
+        return
+
+    # Start from an empty database: the first run creates the tables itself
+    from app import database, models
+    models.Base.metadata.drop_all(bind=database.engine)
+    print(f"{database.engine.url.get_backend_name()}: {args.runs} cold starts")
+
+    storage = tempfile.mkdtemp(prefix="taptone-bench-cwd-")
+    runs = [json.loads(run_child(storage).stdout.splitlines()[-1]) for _ in range(args.runs)]
+    first, restarts = runs[0], runs[1:] or runs
+    print(f"first start (empty database): import {first['import'] * 1000:.0f}ms, ready {first['ready'] * 1000:.0f}ms")
+    print(f"restarts, import app.main: {summary([run['import'] for run in restarts])}")
+    print(f"restarts, lifespan to ready: {summary([run['ready'] for run in restarts])}")
+    print("slowest imports, top-level packages and app modules (cumulative):")
+    for micros, name in slowest_imports(storage, args.top):
+        print(f"  {micros / 1000:8.1f}ms  {name}")
+
+    ok = all([
+        check("import p50", percentile([run["import"] for run in restarts], 50) * 1000, args.max_import),
+        check("ready p50", percentile([run["ready"] for run in restarts], 50) * 1000, args.max_ready),
+    ])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Kiosk poll latency and compaction cost over a large command history.
+
+Fills the commands table with mostly acked history (plus some expired
+pending rows), then times kiosk polls before and after one compaction run.
+Exits non-zero if a --max-* limit is exceeded.
+
+    cd backend && python -m scripts.bench_command_poll --commands 1000000
+"""
+import argparse
+import random
+import sys
+import time
+
+from scripts._bench import check, configure, percentile, reset_schema, summary, timed
+
+configure(DB_ASYNC="false", COMMAND_ACKED_RETENTION=86400, COMMAND_PENDING_TTL=3600)
+
+from sqlalchemy import func, insert, select  # noqa: E402
+from app import crud, database, models, retention  # noqa: E402
+
+INSERT_CHUNK = 10000
+
+
+def fill(devices: int, commands: int):
+    now = time.time()
+    rng = random.Random(0)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Device), [{"id": f"kiosk-{i}"} for i in range(devices)])
+    for start in range(0, commands, INSERT_CHUNK):
+        rows = []
+        for _ in range(min(INSERT_CHUNK, commands - start)):
+            age = rng.uniform(0, 3 * 86400)
+            # ~2% of the history was never delivered (dead kiosks)
+            status = "pending" if rng.random() < 0.02 else "acked"
+            rows.append({
+                "device_id": f"kiosk-{rng.randrange(devices)}",
+                "command_type": "LOAD_PLAYLIST",
+                "payload": '{"playlist_id": 1}',
+                "status": status,
+                "created_at": now - age,
+            })
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Command), rows)
+
+
+def poll_latencies(devices: int, polls: int):
+    rng = random.Random(1)
+    samples = []
+    db = database.SessionLocal()
+    try:
+        for _ in range(polls):
+            device_id = f"kiosk-{rng.randrange(devices)}"
+            # A fresh command so every poll returns one row, like a live kiosk
+            crud.create_commands_bulk(db, [device_id], "NEXT")
+            elapsed, _ = timed(crud.claim_pending_commands, db, device_id, lease=30)
+            samples.append(elapsed)
+    finally:
+        db.close()
+    return samples
+
+
+def count_commands() -> int:
+    with database.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(models.Command)).scalar_one()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument("--max-poll-p99", type=float, help="ms, checked before and after compaction")
+    parser.add_argument("--max-compaction", type=float, help="ms for one full compaction run")
+    args = parser.parse_args()
+
+    reset_schema()
+    elapsed, _ = timed(fill, args.devices, args.commands)
+    print(f"{database.engine.url.get_backend_name()}: {count_commands()} commands for {args.devices} devices ({elapsed:.1f}s to load)")
+
+    before = poll_latencies(args.devices, args.polls)
+    print(f"poll before compaction: {summary(before)}")
+
+    db = database.SessionLocal()
+    try:
+        compaction, result = timed(retention.compact_commands, db)
+    finally:
+        db.close()
+    print(f"compaction: {compaction:.2f}s, removed {result['acked']} acked and {result['expired']} expired, {count_commands()} left")
+
+    after = poll_latencies(args.devices, args.polls)
+    print(f"poll after compaction: {summary(after)}")
+
+    ok = all([
+        check("poll p99 before compaction", percentile(before, 99) * 1000, args.max_poll_p99),
+        check("poll p99 after compaction", percentile(after, 99) * 1000, args.max_poll_p99),
+        check("compaction", compaction * 1000, args.max_compaction),
+    ])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
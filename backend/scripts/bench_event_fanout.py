@@ -0,0 +1,104 @@
+"""Event latency by fan-out: one button press against accounts with more devices.
+
+Runs the app in-process and, for each --devices count, posts --events button
+presses for an account with that many kiosks. With --parked (the default)
+every kiosk is parked on a long-poll first, so each event also reports how
+long until the last kiosk got its command. Exits non-zero if a --max-* limit
+is exceeded at any device count.
+
+    cd backend && python -m scripts.bench_event_fanout --devices 1,10,100,500
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from scripts._bench import check, configure, percentile, reset_schema, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0)
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from app import database, models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.notifications import command_hub  # noqa: E402
+
+# One line per request would drown the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def fill(counts):
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": account_id, "email": f"user{account_id}@example.com", "first_name": "U", "last_name": str(count)}
+            for account_id, count in enumerate(counts, start=1)
+        ])
+        conn.execute(insert(models.Device), [
+            {"id": f"kiosk-{account_id}-{i}", "account_id": account_id}
+            for account_id, count in enumerate(counts, start=1)
+            for i in range(count)
+        ])
+
+
+async def receive(client: httpx.AsyncClient, device_id: str) -> float:
+    response = await client.get(f"/api/v1/devices/{device_id}/commands", params={"wait": 30, "ack": "true"})
+    response.raise_for_status()
+    assert response.json(), f"{device_id} timed out without its command"
+    return time.perf_counter()
+
+
+async def press(client: httpx.AsyncClient, account_id: int, devices: int, parked: bool):
+    device_ids = [f"kiosk-{account_id}-{i}" for i in range(devices)]
+    pollers = []
+    if parked:
+        pollers = [asyncio.create_task(receive(client, device_id)) for device_id in device_ids]
+        while command_hub.waiting_devices() < devices:
+            await asyncio.sleep(0.005)
+    start = time.perf_counter()
+    response = await client.post("/api/v1/events/button", params={"control": "next", "account_id": account_id})
+    posted = time.perf_counter()
+    response.raise_for_status()
+    assert response.json()["commands_queued"] == devices
+    received = await asyncio.gather(*pollers)
+    return posted - start, (max(received) - start if received else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", default="1,10,100,500", help="comma separated device counts per account")
+    parser.add_argument("--events", type=int, default=50, help="button presses per device count")
+    parser.add_argument("--no-parked", dest="parked", action="store_false", help="no kiosks long-polling")
+    parser.add_argument("--max-event-p99", type=float, help="ms, POST latency p99 at any device count")
+    parser.add_argument("--max-delivery-p99", type=float, help="ms, press to last kiosk p99 at any device count")
+    args = parser.parse_args()
+    counts = [int(count) for count in args.devices.split(",")]
+
+    reset_schema()
+    fill(counts)
+    print(f"{database.engine.url.get_backend_name()}: {args.events} presses per account, "
+          f"{'all kiosks parked on a long-poll' if args.parked else 'no kiosks waiting'}")
+
+    async def run():
+        # One event loop throughout: the async engine's pool is bound to it
+        results = []
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for account_id, devices in enumerate(counts, start=1):
+                samples = [await press(client, account_id, devices, args.parked) for _ in range(args.events)]
+                results.append((devices, [post for post, _ in samples], [last for _, last in samples if last is not None]))
+        return results
+
+    ok = True
+    for devices, posts, deliveries in asyncio.run(run()):
+        print(f"{devices:>5} devices: event {summary(posts)}")
+        if deliveries:
+            print(f"{'':>5}          last kiosk {summary(deliveries)}")
+        ok &= check(f"event p99 at {devices} devices", percentile(posts, 99) * 1000, args.max_event_p99)
+        if deliveries:
+            ok &= check(f"delivery p99 at {devices} devices", percentile(deliveries, 99) * 1000, args.max_delivery_p99)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
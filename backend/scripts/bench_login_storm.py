@@ -0,0 +1,100 @@
+"""Kiosk command poll latency while a burst of logins hits the same worker.
+
+Runs the app in-process (one worker) and keeps --kiosks pollers on
+GET /api/v1/devices/{id}/commands, first alone and then alongside
+--logins concurrent login loops. Exits non-zero if the poll p99 during the
+storm exceeds --max-poll-p99.
+
+    cd backend && python -m scripts.bench_login_storm --logins 200
+"""
+import argparse
+import asyncio
+import sys
+import time
+from collections import Counter
+
+from scripts._bench import check, configure, percentile, reset_schema, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0)
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from app import auth, database, models  # noqa: E402
+from app.main import app  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def fill(users: int, kiosks: int):
+    hashed = auth.get_password_hash(PASSWORD)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"email": f"user{i}@example.com", "hashed_password": hashed, "first_name": "U", "last_name": str(i)}
+            for i in range(users)
+        ])
+        conn.execute(insert(models.Device), [{"id": f"kiosk-{i}"} for i in range(kiosks)])
+
+
+async def poll(client: httpx.AsyncClient, device_id: str, interval: float, until: float, samples: list):
+    while time.perf_counter() < until:
+        start = time.perf_counter()
+        response = await client.get(f"/api/v1/devices/{device_id}/commands")
+        response.raise_for_status()
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - start)))
+
+
+async def login(client: httpx.AsyncClient, i: int, users: int, until: float, outcomes: Counter):
+    body = {"email": f"user{i % users}@example.com", "password": PASSWORD, "first_name": "U", "last_name": str(i)}
+    while time.perf_counter() < until:
+        response = await client.post("/auth/login", json=body)
+        outcomes[response.status_code] += 1
+        if response.status_code == 503:
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+async def phase(kiosks: int, interval: float, logins: int, users: int, seconds: float):
+    samples: list = []
+    outcomes: Counter = Counter()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        until = time.perf_counter() + seconds
+        await asyncio.gather(
+            *(poll(client, f"kiosk-{i}", interval, until, samples) for i in range(kiosks)),
+            *(login(client, i, users, until, outcomes) for i in range(logins)),
+        )
+    return samples, outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kiosks", type=int, default=50)
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between one kiosk's polls")
+    parser.add_argument("--logins", type=int, default=200, help="concurrent login loops during the storm")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--max-poll-p99", type=float, help="ms, poll p99 during the storm")
+    args = parser.parse_args()
+
+    reset_schema()
+    fill(args.users, args.kiosks)
+    print(f"{database.engine.url.get_backend_name()}: {args.kiosks} kiosks, bcrypt cost {auth.BCRYPT_ROUNDS}, "
+          f"{auth.PASSWORD_HASH_WORKERS} hash workers, queue {auth.PASSWORD_HASH_QUEUE}")
+
+    async def run():
+        # One event loop for both phases: the async engine's pool is bound to it
+        quiet, _ = await phase(args.kiosks, args.poll_interval, 0, args.users, args.seconds)
+        print(f"poll, no logins: {summary(quiet)}")
+        return await phase(args.kiosks, args.poll_interval, args.logins, args.users, args.seconds)
+
+    storm, outcomes = asyncio.run(run())
+    print(f"poll, {args.logins} concurrent logins: {summary(storm)}")
+    print("login responses: " + ", ".join(f"{code}={count}" for code, count in sorted(outcomes.items())))
+    auth.password_hasher.shutdown()
+
+    ok = check("poll p99 during login storm", percentile(storm, 99) * 1000, args.max_poll_p99)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Server memory with many concurrent stream listeners.
+
+Writes --songs audio files, then has --listeners clients stream them at the
+same time through GET /stream/{id}, each reading at --rate like a player
+buffering ahead. The app is called directly over ASGI so only the server
+side is measured: Python heap growth (tracemalloc) and process RSS at the
+peak, per listener. Exits non-zero if a --max-* limit is exceeded.
+
+    cd backend && python -m scripts.bench_stream_listeners --listeners 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from scripts._bench import StreamListener, check, configure, reset_schema, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0)
+
+from sqlalchemy import insert  # noqa: E402
+from app import database, models  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def fill(songs: int, size: int) -> str:
+    storage = tempfile.mkdtemp(prefix="taptone-bench-songs-")
+    rows = []
+    for song_id in range(1, songs + 1):
+        path = os.path.join(storage, f"{song_id}.mp3")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        # An absolute file_path is used as is by /stream
+        rows.append({"id": song_id, "title": f"song {song_id}", "artist": "a", "genre": "rock", "file_path": path})
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Song), rows)
+    return storage
+
+
+def rss() -> int:
+    # Resident set size in bytes (Linux); 0 where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+async def sample_memory(peak: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        peak["rss"] = max(peak["rss"], rss())
+        peak["heap"] = max(peak["heap"], tracemalloc.get_traced_memory()[0])
+        await asyncio.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listeners", type=int, default=500)
+    parser.add_argument("--songs", type=int, default=20)
+    parser.add_argument("--song-size", type=int, default=1024, help="KB per song file")
+    parser.add_argument("--rate", type=int, default=256, help="KB/s each listener reads")
+    parser.add_argument("--max-heap-per-listener", type=float, help="KB of Python heap per listener at the peak")
+    parser.add_argument("--max-rss-per-listener", type=float, help="KB of RSS growth per listener at the peak")
+    args = parser.parse_args()
+
+    reset_schema()
+    fill(args.songs, args.song_size * 1024)
+    print(f"{database.engine.url.get_backend_name()}: {args.listeners} listeners over {args.songs} songs of "
+          f"{args.song_size}KB at {args.rate}KB/s each")
+
+    async def run():
+        # Warm the song location cache so the run measures streaming, not lookups
+        for song_id in range(1, args.songs + 1):
+            await StreamListener(app, f"/stream/{song_id}").listen()
+        tracemalloc.start()
+        base_heap, base_rss = tracemalloc.get_traced_memory()[0], rss()
+        peak = {"heap": base_heap, "rss": base_rss}
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(peak, stop))
+        listeners = [StreamListener(app, f"/stream/{i % args.songs + 1}", args.rate * 1024) for i in range(args.listeners)]
+        start = time.perf_counter()
+        await asyncio.gather(*(listener.listen() for listener in listeners))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+        tracemalloc.stop()
+        return listeners, elapsed, peak["heap"] - base_heap, peak["rss"] - base_rss
+
+    listeners, elapsed, heap, rss_growth = asyncio.run(run())
+    failed = [listener for listener in listeners if listener.status != 200 or listener.received != args.song_size * 1024]
+    served = sum(listener.received for listener in listeners)
+    print(f"{len(listeners) - len(failed)}/{len(listeners)} complete, "
+          f"{served / elapsed / 1024 / 1024:.1f}MB/s in {elapsed:.1f}s")
+    print(f"first byte: {summary([listener.first_byte for listener in listeners])}")
+    print(f"peak heap growth: {heap / 1024:.0f}KB ({heap / 1024 / args.listeners:.1f}KB per listener)")
+    if rss_growth:
+        print(f"peak RSS growth: {rss_growth / 1024:.0f}KB ({rss_growth / 1024 / args.listeners:.1f}KB per listener)")
+
+    ok = all([
+        not failed,
+        check("heap per listener", heap / 1024 / args.listeners, args.max_heap_per_listener, "KB"),
+        check("RSS per listener", rss_growth / 1024 / args.listeners, args.max_rss_per_listener, "KB"),
+    ])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Kiosk and event endpoints with DB_ASYNC=true against DB_ASYNC=false.
+
+Runs the same mixed load once per mode, each in a fresh interpreter since
+the engines are chosen at import: --kiosks loops sending a heartbeat and
+polling with ack=true, and --controllers loops posting button events to
+accounts with --devices kiosks each. Reports requests/s and latency per
+endpoint side by side. Exits non-zero if a --max-* limit is exceeded in
+either mode.
+
+    cd backend && python -m scripts.bench_sync_vs_async --kiosks 100 --controllers 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from scripts._bench import check, configure, percentile, reset_schema, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0)
+
+ENDPOINTS = ("heartbeat", "poll", "event")
+
+
+def fill(kiosks: int, devices: int):
+    from sqlalchemy import insert
+    from app import database, models
+    accounts = max(1, kiosks // devices)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i, "email": f"user{i}@example.com", "first_name": "U", "last_name": str(i)} for i in range(1, accounts + 1)
+        ])
+        conn.execute(insert(models.Device), [
+            {"id": f"kiosk-{i}", "account_id": i % accounts + 1} for i in range(kiosks)
+        ])
+    return accounts
+
+
+async def timed_request(samples: dict, name: str, request):
+    start = time.perf_counter()
+    response = await request
+    response.raise_for_status()
+    samples[name].append(time.perf_counter() - start)
+
+
+async def kiosk(client, device_id: str, until: float, samples: dict):
+    while time.perf_counter() < until:
+        await timed_request(samples, "heartbeat", client.post("/api/v1/devices/heartbeat", params={"device_id": device_id}))
+        await timed_request(samples, "poll", client.get(f"/api/v1/devices/{device_id}/commands", params={"ack": "true"}))
+
+
+async def controller(client, accounts: int, seed: int, until: float, samples: dict):
+    rng = random.Random(seed)
+    while time.perf_counter() < until:
+        params = {"control": "next", "account_id": rng.randint(1, accounts)}
+        await timed_request(samples, "event", client.post("/api/v1/events/button", params=params))
+
+
+def measure(args):
+    # Runs in the child, with DB_ASYNC set by the parent
+    import httpx
+    from app import database
+    from app.main import app
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    reset_schema()
+    accounts = fill(args.kiosks, args.devices)
+
+    async def run():
+        samples: dict = defaultdict(list)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            until = time.perf_counter() + args.seconds
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(kiosk(client, f"kiosk-{i}", until, samples) for i in range(args.kiosks)),
+                *(controller(client, accounts, seed, until, samples) for seed in range(args.controllers)),
+            )
+            return samples, time.perf_counter() - start
+
+    samples, elapsed = asyncio.run(run())
+    engine = "async" if database.async_engine is not None else "sync"
+    print(json.dumps({"engine": engine, "elapsed": elapsed, "samples": samples}))
+
+
+def run_mode(mode: str, argv: list) -> dict:
+    env = dict(os.environ, DB_ASYNC=mode)
+    result = subprocess.run(
+        [sys.executable, "-m", "scripts.bench_sync_vs_async", "--measure", *argv],
+        env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        result.check_returncode()
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kiosks", type=int, default=100, help="concurrent kiosk loops")
+    parser.add_argument("--controllers", type=int, default=10, help="concurrent button event loops")
+    parser.add_argument("--devices", type=int, default=5, help="kiosks per account")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--max-p99", type=float, help="ms, any endpoint's p99 in either mode")
+    args = parser.parse_args()
+    if args.measure:
+        measure(args)
+        return
+
+    argv = [f"--kiosks={args.kiosks}", f"--controllers={args.controllers}", f"--devices={args.devices}", f"--seconds={args.seconds}"]
+    results = {mode: run_mode(mode, argv) for mode in ("false", "true")}
+    print(f"{args.kiosks} kiosks, {args.controllers} event loops, {args.devices} kiosks per account, {args.seconds:g}s per mode")
+
+    ok = True
+    for name in ENDPOINTS:
+        for mode, result in results.items():
+            samples = result["samples"][name]
+            label = f"DB_ASYNC={mode} ({result['engine']})"
+            print(f"{name:<9} {label:<22} {len(samples) / result['elapsed']:7.1f}/s  {summary(samples)}")
+            ok &= check(f"{name} p99 with DB_ASYNC={mode}", percentile(samples, 99) * 1000, args.max_p99)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Tap-to-manifest latency: NFC event to the kiosk holding the playlist manifest.
+
+Runs the app in-process with one kiosk per account parked on a long-poll.
+Each tap posts /api/v1/events/nfc, the kiosk wakes with LOAD_PLAYLIST and
+fetches GET /hardware/sync/{tag_uid}, as the hardware does. Taps are timed
+with the tag and response caches cleared first (cold) and warm, split into
+event, delivery and manifest. Exits non-zero if a --max-* limit is exceeded.
+
+    cd backend && python -m scripts.bench_tap_to_manifest --tags 1000 --taps 200
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+
+from scripts._bench import check, configure, percentile, reset_schema, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0)
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from app import database, models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.notifications import command_hub  # noqa: E402
+from app.response_cache import response_cache  # noqa: E402
+from app.tag_cache import tag_cache  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def fill(tags: int, songs_per_playlist: int, catalog: int):
+    # Account i owns tag i, linked to playlist i, and kiosk i
+    rng = random.Random(0)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i, "email": f"user{i}@example.com", "first_name": "U", "last_name": str(i)} for i in range(1, tags + 1)
+        ])
+        conn.execute(insert(models.Song), [
+            {"id": i, "title": f"song {i}", "artist": f"artist {i % 97}", "genre": "rock", "file_path": f"{i}.mp3"}
+            for i in range(1, catalog + 1)
+        ])
+        conn.execute(insert(models.Playlist), [{"id": i, "name": f"playlist {i}", "user_id": i} for i in range(1, tags + 1)])
+        conn.execute(insert(models.playlist_songs), [
+            {"playlist_id": i, "song_id": song_id, "position": position}
+            for i in range(1, tags + 1)
+            for position, song_id in enumerate(rng.sample(range(1, catalog + 1), songs_per_playlist))
+        ])
+        conn.execute(insert(models.NFCTag), [
+            {"id": i, "tag_id": f"04:{i:08x}", "user_id": i, "playlist_id": i} for i in range(1, tags + 1)
+        ])
+        conn.execute(insert(models.Device), [{"id": f"kiosk-{i}", "account_id": i} for i in range(1, tags + 1)])
+
+
+async def tap(client: httpx.AsyncClient, account_id: int):
+    tag_uid = f"04:{account_id:08x}"
+    kiosk = f"/api/v1/devices/kiosk-{account_id}/commands"
+    poll = asyncio.create_task(client.get(kiosk, params={"wait": 30, "ack": "true"}))
+    while command_hub.waiting_devices() < 1:
+        await asyncio.sleep(0.001)
+
+    start = time.perf_counter()
+    event = await client.post("/api/v1/events/nfc", params={"tag_uid": tag_uid, "account_id": account_id})
+    posted = time.perf_counter()
+    assert event.json().get("commands_queued") == 1, event.text
+    commands = (await poll).json()
+    delivered = time.perf_counter()
+    assert commands and commands[0]["command_type"] == "LOAD_PLAYLIST", commands
+    manifest = await client.get(f"/hardware/sync/{tag_uid}")
+    done = time.perf_counter()
+    manifest.raise_for_status()
+    return {"event": posted - start, "delivery": delivered - start, "manifest": done - delivered, "total": done - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tags", type=int, default=1000, help="accounts, each with one tag, playlist and kiosk")
+    parser.add_argument("--playlist-songs", type=int, default=50)
+    parser.add_argument("--catalog", type=int, default=10000, help="songs in the catalog")
+    parser.add_argument("--taps", type=int, default=200, help="taps per round")
+    parser.add_argument("--max-cold-p99", type=float, help="ms, tap to manifest p99 with caches cleared")
+    parser.add_argument("--max-warm-p99", type=float, help="ms, tap to manifest p99 with caches warm")
+    args = parser.parse_args()
+
+    reset_schema()
+    fill(args.tags, args.playlist_songs, args.catalog)
+    print(f"{database.engine.url.get_backend_name()}: {args.tags} tags, {args.playlist_songs} songs per playlist")
+
+    async def run():
+        # One event loop throughout: the async engine's pool is bound to it
+        rng = random.Random(1)
+        rounds = {"cold": [], "warm": []}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for _ in range(args.taps):
+                account_id = rng.randint(1, args.tags)
+                tag_cache.clear()
+                response_cache.clear()
+                rounds["cold"].append(await tap(client, account_id))
+                # Same tag again: everything it touches is cached now
+                rounds["warm"].append(await tap(client, account_id))
+        return rounds
+
+    ok = True
+    for name, taps in asyncio.run(run()).items():
+        for stage in ("event", "delivery", "manifest", "total"):
+            print(f"{name:<4} {stage:<8} {summary([sample[stage] for sample in taps])}")
+        limit = args.max_cold_p99 if name == "cold" else args.max_warm_p99
+        ok &= check(f"{name} tap to manifest p99", percentile([sample["total"] for sample in taps], 99) * 1000, limit)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Upload throughput with and without active streams on the same worker.
+
+Runs --uploaders concurrent POST /songs/upload loops for --seconds, first
+alone and then while --listeners clients stream songs at --rate. Reports
+uploads/s and MB/s for both phases, upload latency, and how long listeners
+waited on each chunk during the uploads. Exits non-zero if a --max-* limit
+is exceeded.
+
+    cd backend && python -m scripts.bench_uploads_during_streams --uploaders 8 --listeners 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from scripts._bench import StreamListener, check, configure, percentile, reset_schema, summary
+
+configure(COMMAND_COMPACTION_INTERVAL=0, COOCCURRENCE_REFRESH_INTERVAL=0)
+
+# /songs/upload stores under ./music_storage
+os.chdir(tempfile.mkdtemp(prefix="taptone-bench-storage-"))
+
+import httpx  # noqa: E402
+from app import database  # noqa: E402
+from app.main import app  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417-byte frames
+FRAME_HEADER = struct.pack(">I", 0xFFFB9064)
+FRAME_SIZE = 417
+
+
+def mp3_bytes(size: int) -> bytes:
+    # Valid frame headers around random payloads: unique per upload, so no
+    # upload is deduplicated, and parseable for the duration/seek table
+    frames = max(1, size // FRAME_SIZE)
+    return b"".join(FRAME_HEADER + os.urandom(FRAME_SIZE - 4) for _ in range(frames))
+
+
+async def upload(client: httpx.AsyncClient, size: int, until: float, samples: list):
+    while time.perf_counter() < until:
+        body = mp3_bytes(size)
+        start = time.perf_counter()
+        response = await client.post(
+            "/songs/upload",
+            data={"title": "t", "artist": "a", "genre": "rock"},
+            files={"file": ("upload.mp3", body, "audio/mpeg")},
+        )
+        response.raise_for_status()
+        samples.append((time.perf_counter() - start, len(body)))
+
+
+async def listen(path: str, rate: float, until: float, listeners: list):
+    while time.perf_counter() < until:
+        listener = StreamListener(app, path, rate)
+        listeners.append(listener)
+        await listener.listen()
+
+
+async def phase(client: httpx.AsyncClient, args, song_ids: list, listeners: int):
+    uploads: list = []
+    streams: list = []
+    until = time.perf_counter() + args.seconds
+    start = time.perf_counter()
+    listening = [
+        asyncio.create_task(listen(f"/stream/{song_ids[i % len(song_ids)]}", args.rate * 1024, until, streams))
+        for i in range(listeners)
+    ]
+    await asyncio.gather(*(upload(client, args.upload_size * 1024, until, uploads) for _ in range(args.uploaders)))
+    elapsed = time.perf_counter() - start
+    # Listeners finish the song they are on
+    await asyncio.gather(*listening)
+    return uploads, streams, elapsed
+
+
+def report(label: str, uploads: list, elapsed: float):
+    sent = sum(size for _, size in uploads)
+    print(f"{label}: {len(uploads) / elapsed:.1f} uploads/s, {sent / elapsed / 1024 / 1024:.1f}MB/s, "
+          f"latency {summary([latency for latency, _ in uploads])}")
+    return sent / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uploaders", type=int, default=8, help="concurrent upload loops")
+    parser.add_argument("--upload-size", type=int, default=4096, help="KB per upload")
+    parser.add_argument("--listeners", type=int, default=200)
+    parser.add_argument("--songs", type=int, default=20, help="songs uploaded up front for the listeners")
+    parser.add_argument("--song-size", type=int, default=1024, help="KB per listener song")
+    parser.add_argument("--rate", type=int, default=256, help="KB/s each listener reads")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--max-upload-p99", type=float, help="ms, upload latency p99 during streams")
+    parser.add_argument("--max-chunk-wait-p99", type=float, help="ms, listener wait per chunk p99 during uploads")
+    args = parser.parse_args()
+
+    reset_schema()
+    print(f"{database.engine.url.get_backend_name()}: {args.uploaders} uploaders of {args.upload_size}KB, "
+          f"{args.listeners} listeners at {args.rate}KB/s")
+
+    async def run():
+        # One event loop for both phases: the async engine's pool is bound to it
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            song_ids = []
+            for _ in range(args.songs):
+                response = await client.post(
+                    "/songs/upload",
+                    data={"title": "t", "artist": "a", "genre": "rock"},
+                    files={"file": ("song.mp3", mp3_bytes(args.song_size * 1024), "audio/mpeg")},
+                )
+                response.raise_for_status()
+                song_ids.append(response.json()["id"])
+            alone = await phase(client, args, song_ids, 0)
+            busy = await phase(client, args, song_ids, args.listeners)
+        return alone, busy
+
+    (alone, _, alone_elapsed), (busy, streams, busy_elapsed) = asyncio.run(run())
+    before = report("uploads alone", alone, alone_elapsed)
+    during = report(f"uploads with {args.listeners} listeners", busy, busy_elapsed)
+    waits = [delay for listener in streams for delay in listener.delays]
+    print(f"streams: {len(streams)} songs played, chunk wait {summary(waits)}")
+    print(f"upload throughput kept: {during / before:.0%}")
+
+    ok = all([
+        all(listener.status == 200 for listener in streams),
+        check("upload p99 during streams", percentile([latency for latency, _ in busy], 99) * 1000, args.max_upload_p99),
+        check("listener chunk wait p99", percentile(waits, 99) * 1000, args.max_chunk_wait_p99),
+    ])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
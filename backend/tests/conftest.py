@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+# Configure before app modules are imported: they read the environment once
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="taptone-tests-"), "test.db")
+os.environ["DB_ASYNC"] = "false"
+os.environ["COMMAND_HUB_BACKEND"] = "memory"
+
+import pytest
+from app import database, models
+
+
+@pytest.fixture
+def db():
+    models.Base.metadata.create_all(bind=database.engine)
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(bind=database.engine)
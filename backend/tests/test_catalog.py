@@ -0,0 +1,60 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from app import catalog, models
+from app.main import app
+
+
+@pytest.fixture
+def songs(db):
+    # Every third title, fourth artist and seventh price is NULL
+    db.execute(insert(models.Song), [
+        {
+            "id": song_id,
+            "title": None if song_id % 3 == 0 else f"title {song_id % 5}",
+            "artist": None if song_id % 4 == 0 else f"artist {song_id % 2}",
+            "genre": "rock",
+            "price": None if song_id % 7 == 0 else float(song_id % 10),
+        }
+        for song_id in range(1, 101)
+    ])
+    db.commit()
+    return list(range(1, 101))
+
+
+@pytest.mark.parametrize("sort", ["id", "title", "artist", "price"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_keyset_pages_include_null_sort_values(db, songs, sort, order):
+    seen, cursor = [], None
+    while True:
+        page, cursor = catalog.search_songs(db, sort=sort, order=order, cursor=cursor, limit=7)
+        seen += [song.id for song in page]
+        if cursor is None:
+            break
+    assert len(seen) == len(songs)
+    assert sorted(seen) == songs
+
+
+def test_nulls_sort_as_empty_title(db, songs):
+    page, _ = catalog.search_songs(db, sort="title", limit=3)
+    assert [song.title for song in page] == [None, None, None]
+
+
+def test_null_cursor_value_reads_as_the_null_sort_value():
+    cursor = catalog.encode_cursor("title", "asc", None, 3)
+    assert catalog.decode_cursor(cursor, "title", "asc") == ("", 3)
+
+
+@pytest.mark.parametrize("sort, value", [
+    ("title", {"a": 1}), ("title", [1]), ("price", "1.0"), ("price", True), ("id", None),
+])
+def test_malformed_cursor_value_is_rejected(sort, value):
+    cursor = catalog.encode_cursor(sort, "asc", value, 3)
+    with pytest.raises(ValueError):
+        catalog.decode_cursor(cursor, sort, "asc")
+
+
+def test_malformed_cursor_is_a_bad_request(db, songs):
+    cursor = catalog.encode_cursor("title", "asc", {"a": 1}, 3)
+    response = TestClient(app).get("/songs", params={"sort": "title", "cursor": cursor})
+    assert response.status_code == 400
@@ -0,0 +1,121 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from app import crud, models
+from app.main import app
+
+
+@pytest.fixture
+def device(db):
+    db.add(models.Device(id="k1"))
+    db.commit()
+    return "k1"
+
+
+def queue(db, device_id, command_type, **payload):
+    return crud.create_commands_bulk(db, [device_id], command_type, json.dumps(payload) if payload else None)
+
+
+def pending(db, device_id):
+    rows = db.query(models.Command).filter(
+        models.Command.device_id == device_id, models.Command.status == "pending"
+    ).order_by(models.Command.created_at, models.Command.id)
+    return [(row.command_type, json.loads(row.payload) if row.payload else None) for row in rows]
+
+
+def test_volume_deltas_merge_behind_interleaved_buttons(db, device):
+    queue(db, device, "VOLUME_DELTA", delta=1)
+    queue(db, device, "NEXT")
+    queue(db, device, "VOLUME_DELTA", delta=2)
+    queue(db, device, "PLAY_PAUSE")
+    queue(db, device, "VOLUME_DELTA", delta=-4)
+
+    assert pending(db, device) == [("NEXT", None), ("PLAY_PAUSE", None), ("VOLUME_DELTA", {"delta": -1})]
+
+
+def test_load_playlist_keeps_latest_after_interleaved_buttons(db, device):
+    queue(db, device, "PLAY_PAUSE")
+    queue(db, device, "LOAD_PLAYLIST", playlist_id=1)
+    queue(db, device, "NEXT")
+    queue(db, device, "LOAD_PLAYLIST", playlist_id=2)
+
+    assert pending(db, device) == [("PLAY_PAUSE", None), ("NEXT", None), ("LOAD_PLAYLIST", {"playlist_id": 2})]
+
+
+def test_buttons_are_never_merged(db, device):
+    for command_type in ("NEXT", "NEXT", "PLAY_PAUSE", "PLAY_PAUSE", "PREV"):
+        queue(db, device, command_type)
+
+    assert [command_type for command_type, _ in pending(db, device)] == ["NEXT", "NEXT", "PLAY_PAUSE", "PLAY_PAUSE", "PREV"]
+
+
+def test_types_merge_independently(db, device):
+    queue(db, device, "VOLUME_DELTA", delta=5)
+    queue(db, device, "LOAD_PLAYLIST", playlist_id=3)
+    queue(db, device, "VOLUME_DELTA", delta=5)
+
+    assert pending(db, device) == [("LOAD_PLAYLIST", {"playlist_id": 3}), ("VOLUME_DELTA", {"delta": 10})]
+
+
+def test_fetched_command_is_not_rewritten_before_ack(db, device):
+    # Long-poll without ack/lease: the kiosk holds id 1 until it acks it
+    queue(db, device, "VOLUME_DELTA", delta=5)
+    fetched = crud.get_pending_commands(db, device)
+    assert [json.loads(c.payload) for c in fetched] == [{"delta": 5}]
+
+    queue(db, device, "VOLUME_DELTA", delta=5)
+    crud.ack_commands(db, device, [fetched[0].id])
+
+    remaining = crud.get_pending_commands(db, device)
+    assert [json.loads(c.payload) for c in remaining] == [{"delta": 5}]
+    assert remaining[0].id != fetched[0].id
+
+
+def test_undelivered_commands_still_merge_after_a_fetch(db, device):
+    queue(db, device, "VOLUME_DELTA", delta=5)
+    crud.get_pending_commands(db, device)
+    queue(db, device, "VOLUME_DELTA", delta=1)
+    queue(db, device, "VOLUME_DELTA", delta=2)
+
+    assert pending(db, device) == [("VOLUME_DELTA", {"delta": 5}), ("VOLUME_DELTA", {"delta": 3})]
+
+
+def test_stream_delivery_sees_every_command(db, device):
+    # SSE re-reads pending commands and skips ids it has already pushed
+    last_id = 0
+    delivered = []
+
+    def push():
+        nonlocal last_id
+        for command in crud.get_pending_commands(db, device):
+            if command.id > last_id:
+                last_id = command.id
+                delivered.append((command.command_type, json.loads(command.payload) if command.payload else None))
+
+    queue(db, device, "PREV")
+    queue(db, device, "VOLUME_DELTA", delta=1)
+    push()
+    queue(db, device, "VOLUME_DELTA", delta=2)
+    push()
+
+    assert delivered == [("PREV", None), ("VOLUME_DELTA", {"delta": 1}), ("VOLUME_DELTA", {"delta": 2})]
+
+
+def test_leased_command_is_not_rewritten(db, device):
+    queue(db, device, "LOAD_PLAYLIST", playlist_id=1)
+    leased = crud.claim_pending_commands(db, device, lease=30)
+    queue(db, device, "LOAD_PLAYLIST", playlist_id=2)
+    crud.ack_commands(db, device, [c.id for c in leased])
+
+    assert [json.loads(c.payload) for c in crud.claim_pending_commands(db, device, lease=30)] == [{"playlist_id": 2}]
+
+
+def test_ack_rejects_ids_together_with_a_watermark(db, device):
+    first, second = (queue(db, device, "NEXT")[0] for _ in range(2))
+    client = TestClient(app)
+    response = client.post(f"/api/v1/devices/{device}/commands/ack", json={"command_ids": [second], "up_to_id": first})
+    assert response.status_code == 400
+    assert len(pending(db, device)) == 2
+
+    response = client.post(f"/api/v1/devices/{device}/commands/ack", json={"up_to_id": first})
+    assert response.json()["acked"] == 1
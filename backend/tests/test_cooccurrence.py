@@ -0,0 +1,39 @@
+from sqlalchemy import delete, insert, select
+from app import cooccurrence, models
+
+
+def set_members(db, playlist_id, song_ids):
+    db.execute(delete(models.playlist_songs).where(models.playlist_songs.c.playlist_id == playlist_id))
+    db.execute(insert(models.playlist_songs), [
+        {"playlist_id": playlist_id, "song_id": song_id, "position": i} for i, song_id in enumerate(song_ids)
+    ])
+    db.commit()
+
+
+def neighbors(db, song_id):
+    return set(db.scalars(select(models.SongNeighbor.neighbor_id).where(models.SongNeighbor.song_id == song_id)))
+
+
+def test_swap_with_same_count_and_sum_is_reindexed(db):
+    db.add_all([models.Song(id=song_id, title=f"s{song_id}", artist="a", genre="g") for song_id in range(1, 6)])
+    db.add(models.Playlist(id=1, name="p"))
+    db.commit()
+    set_members(db, 1, [1, 4, 5])
+    cooccurrence.refresh_neighbors(db)
+    assert neighbors(db, 5) == {1, 4}
+
+    # Same count (3) and same id sum (10)
+    set_members(db, 1, [2, 3, 5])
+    assert cooccurrence.refresh_neighbors(db)["playlists"] == 1
+    assert neighbors(db, 5) == {2, 3}
+    assert neighbors(db, 1) == set()
+
+
+def test_unchanged_playlists_are_skipped(db):
+    db.add_all([models.Song(id=song_id, title=f"s{song_id}", artist="a", genre="g") for song_id in range(1, 4)])
+    db.add(models.Playlist(id=1, name="p"))
+    db.commit()
+    set_members(db, 1, [1, 2, 3])
+    cooccurrence.refresh_neighbors(db)
+
+    assert cooccurrence.refresh_neighbors(db)["playlists"] == 0
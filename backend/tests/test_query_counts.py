@@ -0,0 +1,82 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from app import dependencies, models, schemas
+from app.database import count_queries
+from app.main import app
+from app.response_cache import response_cache
+from app.tag_cache import tag_cache
+
+USER = schemas.User(id=1, email="listener@example.com", first_name="A", last_name="B", role="user")
+
+
+@pytest.fixture
+def client(db):
+    # No context manager: the lifespan (seeding, background jobs) is not run
+    app.dependency_overrides[dependencies.get_current_user] = lambda: USER
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+def library(db, playlists: int, songs_per_playlist: int = 5):
+    db.add(models.User(id=USER.id, email=USER.email, first_name="A", last_name="B"))
+    db.add_all([
+        models.Song(id=song_id, title=f"s{song_id}", artist="a", genre="g", file_path=f"{song_id}.mp3")
+        for song_id in range(1, songs_per_playlist + 1)
+    ])
+    for playlist_id in range(1, playlists + 1):
+        db.add(models.Playlist(id=playlist_id, name=f"p{playlist_id}", user_id=USER.id))
+        db.add(models.NFCTag(tag_id=f"tag{playlist_id}", user_id=USER.id, playlist_id=playlist_id))
+    db.flush()
+    db.execute(insert(models.playlist_songs), [
+        {"playlist_id": playlist_id, "song_id": song_id, "position": song_id}
+        for playlist_id in range(1, playlists + 1)
+        for song_id in range(1, songs_per_playlist + 1)
+    ])
+    db.commit()
+
+
+def queries(client, path):
+    response_cache.clear()
+    tag_cache.clear()
+    with count_queries() as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/hardware/sync/tag1", 1),
+    ("/tags", 3),
+    ("/tags?view=summary", 2),
+    ("/playlists", 2),
+    ("/playlists?view=summary", 1),
+    ("/playlists/1", 2),
+])
+def test_read_query_count(client, db, path, expected):
+    library(db, playlists=20)
+    assert queries(client, path) == expected
+
+
+@pytest.mark.parametrize("path", ["/tags", "/playlists"])
+def test_query_count_does_not_grow_with_rows(client, db, path):
+    library(db, playlists=2)
+    few = queries(client, path)
+    db.query(models.NFCTag).delete()
+    db.query(models.Playlist).delete()
+    db.execute(models.playlist_songs.delete())
+    db.query(models.Song).delete()
+    db.query(models.User).delete()
+    db.commit()
+    library(db, playlists=40)
+    assert queries(client, path) == few
+
+
+def test_cached_read_runs_no_queries(client, db):
+    library(db, playlists=1)
+    client.get("/hardware/sync/tag1")
+    with count_queries() as statements:
+        assert client.get("/hardware/sync/tag1").status_code == 200
+    assert statements == []
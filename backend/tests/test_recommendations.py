@@ -0,0 +1,54 @@
+import random
+import pytest
+from sqlalchemy import insert
+from app import crud, database, models
+
+
+@pytest.fixture
+def collection(db):
+    # 1000 owned songs, every tenth one jazz
+    db.add(models.User(id=1, email="listener@example.com"))
+    db.execute(insert(models.Song), [
+        {"id": song_id, "title": f"s{song_id}", "artist": "a", "genre": "jazz" if song_id % 10 == 0 else "rock"}
+        for song_id in range(1, 1001)
+    ])
+    db.execute(insert(models.user_songs), [{"user_id": 1, "song_id": song_id} for song_id in range(1, 1001)])
+    db.commit()
+
+
+def test_picks_are_spread_over_the_collection(db, collection):
+    random.seed(7)
+    picks = sorted(song.id for song in crud.get_recommendations(db, 1, "rock", set(), limit=5))
+    assert len(picks) == 5
+    # A contiguous window would put all five within a few ids of each other
+    assert picks[-1] - picks[0] > 100
+
+
+def test_genre_and_exclusions_are_honoured(db, collection):
+    random.seed(3)
+    excluded = set(range(10, 1001, 20))
+    for _ in range(20):
+        picks = crud.get_recommendations(db, 1, "JAZZ", excluded, limit=5)
+        assert len({song.id for song in picks}) == 5
+        assert all(song.genre == "jazz" and song.id not in excluded for song in picks)
+
+
+def test_small_pool_is_filled_from_other_genres(db, collection):
+    # Only 2 jazz songs left after exclusions
+    excluded = set(range(10, 981, 10))
+    picks = crud.get_recommendations(db, 1, "jazz", excluded, limit=5)
+    assert len({song.id for song in picks}) == 5
+    assert sorted(song.id for song in picks if song.genre == "jazz") == [990, 1000]
+
+
+@pytest.mark.parametrize("genre", ["jazz", "polka"])
+def test_query_count_is_bounded(db, collection, genre):
+    random.seed(11)
+    excluded = set(range(1, 1001, 3))
+    with database.count_queries() as statements:
+        picks = crud.get_recommendations(db, 1, genre, excluded, limit=50)
+    assert len({song.id for song in picks}) == 50
+    assert len(statements) <= crud.RECOMMENDATION_MAX_QUERIES
+    # A genre nobody owns costs two reads, not a pass of probes
+    if genre == "polka":
+        assert len(statements) <= 3 + 2 * crud.RECOMMENDATION_MAX_PROBES
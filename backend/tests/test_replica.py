@@ -0,0 +1,60 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import dependencies, models, replica, schemas
+from app.main import app
+from app.response_cache import response_cache
+
+USER = schemas.User(id=1, email="listener@example.com", first_name="A", last_name="B", role="user")
+
+
+@pytest.fixture
+def replica_db(db, tmp_path, monkeypatch):
+    # A second SQLite file stands in for a replica that hasn't caught up
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(replica, "replica_engine", engine)
+    monkeypatch.setattr(replica, "ReplicaSessionLocal", sessionmaker(autoflush=False, bind=engine))
+    monkeypatch.setattr(response_cache, "settle", 5.0)
+    response_cache.clear()
+    for session, name in ((db, "renamed"), (replica.ReplicaSessionLocal(), "original")):
+        session.add(models.User(id=USER.id, email=USER.email))
+        session.add(models.Playlist(id=1, name=name, user_id=USER.id))
+        session.commit()
+    app.dependency_overrides[dependencies.get_current_user] = lambda: USER
+    try:
+        yield engine
+    finally:
+        app.dependency_overrides.clear()
+        response_cache.clear()
+        engine.dispose()
+
+
+def playlist_name(client):
+    response = client.get("/playlists/1")
+    assert response.status_code == 200
+    return response.json()["name"]
+
+
+def test_reads_go_to_the_replica(replica_db):
+    assert playlist_name(TestClient(app)) == "original"
+
+
+def test_a_write_pins_the_client_to_the_primary(replica_db):
+    client = TestClient(app)
+    response = client.put("/playlists/1", json={"name": "renamed"})
+    assert response.status_code == 200
+    assert replica.PRIMARY_COOKIE in response.cookies
+    assert playlist_name(client) == "renamed"
+
+
+def test_pinned_client_skips_entries_built_from_the_replica(replica_db):
+    pinned, other = TestClient(app), TestClient(app)
+    pinned.put("/playlists/1", json={"name": "renamed"})
+    # Another client rebuilds the entry from the lagging replica right after
+    assert playlist_name(other) == "original"
+
+    assert playlist_name(pinned) == "renamed"
+    # ...and the primary read isn't stored for clients still on the replica
+    assert playlist_name(other) == "original"
@@ -0,0 +1,51 @@
+import sys
+import pytest
+from sqlalchemy import inspect, text
+from app import cooccurrence, database, library_scanner
+
+
+def index_names(table):
+    with database.engine.connect() as conn:
+        return database._index_names(conn, inspect(conn), table)
+
+
+def test_upgrade_is_a_no_op_on_a_current_schema(db):
+    assert database.upgrade_schema() == set()
+    assert database.upgrade_schema() == set()
+
+
+def test_upgrade_adds_missing_columns_and_indexes(db):
+    with database.engine.begin() as conn:
+        conn.execute(text("DROP TABLE cooccurrence_playlists"))
+        conn.execute(text(
+            "CREATE TABLE cooccurrence_playlists (playlist_id INTEGER PRIMARY KEY, song_ids VARCHAR, "
+            "song_count INTEGER, song_id_sum INTEGER, plays INTEGER)"
+        ))
+        conn.execute(text("DROP INDEX ix_songs_title_key"))
+
+    assert database.upgrade_schema() == {("cooccurrence_playlists", "song_digest")}
+    assert "song_digest" in {column["name"] for column in inspect(database.engine).get_columns("cooccurrence_playlists")}
+    assert "ix_songs_title_key" in index_names("songs")
+
+
+def test_upgrade_drops_retired_indexes(db):
+    with database.engine.begin() as conn:
+        conn.execute(text("CREATE INDEX ix_songs_title_id ON songs (title, id)"))
+
+    database.upgrade_schema()
+    assert "ix_songs_title_id" not in index_names("songs")
+
+
+@pytest.mark.parametrize("job", [library_scanner, cooccurrence])
+def test_standalone_jobs_upgrade_the_schema(db, job, tmp_path, monkeypatch):
+    with database.engine.begin() as conn:
+        conn.execute(text("DROP TABLE playlist_songs"))
+        conn.execute(text("CREATE TABLE playlist_songs (playlist_id INTEGER, song_id INTEGER, PRIMARY KEY (playlist_id, song_id))"))
+        conn.execute(text("INSERT INTO playlist_songs VALUES (1, 30), (1, 10), (1, 20)"))
+
+    monkeypatch.setattr(sys, "argv", [job.__name__, "--storage", str(tmp_path)] if job is library_scanner else [job.__name__])
+    job.main()
+    with database.engine.connect() as conn:
+        rows = conn.execute(text("SELECT song_id, position FROM playlist_songs ORDER BY position")).all()
+    assert [song_id for song_id, _ in rows] == [10, 20, 30]
+    assert len({position for _, position in rows}) == 3
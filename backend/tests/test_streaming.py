@@ -0,0 +1,69 @@
+from email.utils import formatdate
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from app import streaming
+from app.notifications import InMemoryBackend
+
+BODY = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "song.mp3"
+    path.write_bytes(BODY)
+    app = FastAPI()
+
+    @app.get("/song")
+    def song(request: Request, start_at: int = 0):
+        return streaming.file_response(request, streaming.stat_file(str(path)), "audio/mpeg", start_at=start_at or None)
+
+    client = TestClient(app)
+    client.stat = streaming.stat_file(str(path))
+    return client
+
+
+def test_if_range_date_must_match_exactly(client):
+    last_modified = formatdate(client.stat.mtime, usegmt=True)
+    later = formatdate(client.stat.mtime + 3600, usegmt=True)
+
+    partial = client.get("/song", headers={"Range": "bytes=0-9", "If-Range": last_modified})
+    assert partial.status_code == 206 and partial.content == BODY[:10]
+    full = client.get("/song", headers={"Range": "bytes=0-9", "If-Range": later})
+    assert full.status_code == 200 and full.content == BODY
+
+
+def test_seek_without_range_is_a_plain_200_from_the_offset(client):
+    response = client.get("/song", params={"start_at": 100})
+    assert response.status_code == 200
+    assert "content-range" not in response.headers
+    assert response.headers["content-length"] == str(len(BODY) - 100)
+    assert response.content == BODY[100:]
+    assert response.headers["etag"] != client.stat.etag
+
+
+def test_ranges_within_a_seek_are_relative_to_it(client):
+    seek = client.get("/song", params={"start_at": 100})
+    response = client.get(
+        "/song", params={"start_at": 100}, headers={"Range": "bytes=10-19", "If-Range": seek.headers["etag"]}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 10-19/{len(BODY) - 100}"
+    assert response.content == BODY[110:120]
+
+
+def test_song_location_invalidation_reaches_every_worker(client):
+    backend = InMemoryBackend()
+    workers = [streaming.SongLocationCache(backend), streaming.SongLocationCache(backend)]
+    for cache in workers:
+        cache.put(1, client.stat)
+    workers[0].invalidate(1)
+    assert [cache.get(1) for cache in workers] == [None, None]
+
+
+def test_song_location_entries_expire(client, monkeypatch):
+    cache = streaming.SongLocationCache(ttl=60)
+    cache.put(1, client.stat)
+    assert cache.get(1) == client.stat
+    monkeypatch.setattr(streaming.time, "time", lambda: client.stat.mtime + 10**9)
+    assert cache.get(1) is None
@@ -117,20 +117,29 @@ const App = () => {
   };
 
   const startPolling = () => {
-    // Polling using recursive setTimeout to avoid closure traps
+    // Long-polling using recursive setTimeout to avoid closure traps.
+    // The backend holds the request open until a command arrives or `wait` expires.
     const poll = async () => {
+      let delay = 0;
       try {
         await client.post(`/api/v1/devices/heartbeat?device_id=${deviceId}`);
-        const res = await client.get(`/api/v1/devices/${deviceId}/commands`);
+        // Leased: hidden from other fetches (and never merged into) until
+        // acked below, redelivered if the kiosk dies before acking
+        const res = await client.get(`/api/v1/devices/${deviceId}/commands?wait=25&lease=30`);
         const commands = res.data;
         for (const cmd of commands) {
           await handleCommand(cmd);
-          await client.post(`/api/v1/devices/commands/${cmd.id}/ack`);
+        }
+        if (commands.length > 0) {
+          await client.post(`/api/v1/devices/${deviceId}/commands/ack`, {
+            command_ids: commands.map((cmd) => cmd.id),
+          });
         }
       } catch (err) {
         console.error('Polling error', err);
+        delay = 1500;
       }
-      setTimeout(poll, 1500);
+      setTimeout(poll, delay);
     };
     poll();
   };
@@ -259,6 +268,8 @@ const App = () => {
       const res = await client.get(`/api/v1/recommendations`, {
         params: {
           device_id: deviceId,
+          mode: 'next',
+          song_id: lastSong.id,
           genre: lastSong.genre,
           exclude_ids: excludeIds
         }
@@ -288,15 +299,9 @@ const App = () => {
   const handleAddSongToPlaylist = async (song) => {
     if (!playlist) return;
     try {
-      // Get latest playlist songs from server to avoid race conditions
-      const res = await client.get(`/playlists/${playlist.id}`);
-      const latestPlaylist = res.data;
-      
-      const currentIds = latestPlaylist.songs.map(s => s.id);
-      if (!currentIds.includes(song.id)) {
-        await client.put(`/playlists/${playlist.id}/songs`, [...currentIds, song.id]);
-        setSavedSongIds(prev => [...prev, song.id]);
-      }
+      // Appended server-side; songs already in the playlist are left alone
+      await client.patch(`/playlists/${playlist.id}/songs`, [{ op: 'add', song_ids: [song.id] }]);
+      setSavedSongIds(prev => [...prev, song.id]);
     } catch (err) {
       console.error('Error adding song to current playlist', err);
     }
@@ -305,16 +310,9 @@ const App = () => {
   const handleAddAllRecommended = async () => {
     if (!playlist) return;
     try {
-      // Get latest playlist songs from server
-      const res = await client.get(`/playlists/${playlist.id}`);
-      const latestPlaylist = res.data;
-      
-      const discoverySongs = playlist.songs.filter(s => s.isDiscovery);
-      const currentIds = latestPlaylist.songs.map(s => s.id);
-      const newIds = [...new Set([...currentIds, ...discoverySongs.map(s => s.id)])];
-      
-      await client.put(`/playlists/${playlist.id}/songs`, newIds);
-      setSavedSongIds(prev => [...new Set([...prev, ...discoverySongs.map(s => s.id)])]);
+      const discoveryIds = playlist.songs.filter(s => s.isDiscovery).map(s => s.id);
+      await client.patch(`/playlists/${playlist.id}/songs`, [{ op: 'add', song_ids: discoveryIds }]);
+      setSavedSongIds(prev => [...new Set([...prev, ...discoveryIds])]);
     } catch (err) {
       console.error('Error adding all songs to current playlist', err);
     }
@@ -44,8 +44,15 @@ const MyCollection = () => {
 
   const fetchCollection = async () => {
     try {
-      const response = await client.get('/my-collection');
-      setSongs(response.data);
+      // Paged so a large collection doesn't arrive as one huge response
+      let all = [];
+      let cursor = null;
+      do {
+        const response = await client.get('/my-collection', { params: cursor ? { limit: 500, cursor } : { limit: 500 } });
+        all = all.concat(response.data);
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor);
+      setSongs(all);
     } catch (error) {
       showNotification('Failed to load collection', 'error');
     }
@@ -39,8 +39,8 @@ const Store = () => {
 
   const fetchCollection = async () => {
     try {
-      const response = await client.get('/my-collection');
-      setCollectionIds(new Set(response.data.map(s => s.id)));
+      const response = await client.get('/my-collection/ids');
+      setCollectionIds(new Set(response.data));
     } catch (error) {
       console.error('Failed to fetch collection', error);
     }